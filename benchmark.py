@@ -0,0 +1,746 @@
+# -*- coding: utf-8 -*-
+"""
+スマートホーム管理サーバーの性能計測 (ベンチマーク)
+シミュレーター (sim_backend.py, SMARTHOME_BACKEND=sim) の上でサーバーを動かし、主要な処理の速さを計測して
+結果をJSONファイルに保存する。前回の結果を --compare で渡すと、指標ごとの変化を表示する。
+(GPIO・I2C・カメラ・cec-client・SwitchBot・Tuya Cloud・PCのAIサーバーはすべてシミュレーターを使う)
+
+計測する項目:
+    status      /status と /api/sensor_data の応答時間・スループット (同時接続数ごと、ETagあり/なし)
+    video       /video_feed の視聴者ごとのフレームレートとサーバーのCPU使用率 (視聴者 1〜5)
+    log_page    /log の応答時間と操作ログの行数の関係 (1千〜100万行)
+    log_append  log_action() と write_log() の1件あたりの時間
+    keypad      キーを押してから、キーの処理・シーンの開始・シーンの完了までの時間
+
+HTTPの計測では、サーバーを別プロセス (python smart_home_server.py --port ...) で起動する。
+log_append と keypad は、このプロセスにサーバーのモジュールを読み込んで関数を直接呼ぶ。
+
+使い方:
+    python benchmark.py                          すべて計測して benchmark_results.json に保存
+    python benchmark.py --only status,keypad     一部だけ計測
+    python benchmark.py --quick                  件数・時間を減らして短く計測
+    python benchmark.py --production             HTTPの計測を本番モード (複数ワーカー) のサーバーで行う
+    python benchmark.py --compare old.json       計測して、前回の結果と比べる (悪化があれば終了コード1)
+    python benchmark.py --compare old.json --compare-only new.json   計測せずに2つの結果を比べる
+"""
+
+import argparse
+import csv
+import http.client
+import io
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_SCRIPT = os.path.join(REPO_DIR, 'smart_home_server.py')
+
+# サーバーのモジュールは、読み込む前にシミュレーターを選んでおく
+os.environ['SMARTHOME_BACKEND'] = 'sim'
+
+BENCHMARKS = ['status', 'video', 'log_page', 'log_append', 'keypad']
+DEFAULT_OUTPUT = 'benchmark_results.json'
+BENCH_PORT = 15000              # 計測用のサーバーの待ち受けポート (通常の5000番とぶつからないように)
+SERVER_START_TIMEOUT = 60       # サーバーが応答するようになるまで待つ最長時間 (秒)
+LOG_PER_PAGE = 50               # /log の1ページあたりの件数 (view_log と同じ)
+
+# 計測の規模 (通常 / --quick)
+PROFILES = {
+    'full': {
+        'http_clients': [1, 4, 16], 'http_seconds': 5,
+        'video_viewers': [1, 2, 3, 4, 5], 'video_seconds': 5, 'video_fps': 15,
+        'log_rows': [1000, 10000, 100000, 1000000], 'log_requests': 20,
+        'log_action_calls': 20000, 'write_log_calls': 2000,
+        'keypad_presses': 20, 'keypad_interval': 1.0,
+    },
+    'quick': {
+        'http_clients': [1, 4], 'http_seconds': 2,
+        'video_viewers': [1, 2, 3, 4, 5], 'video_seconds': 2, 'video_fps': 15,
+        'log_rows': [1000, 10000, 100000], 'log_requests': 5,
+        'log_action_calls': 2000, 'write_log_calls': 200,
+        'keypad_presses': 5, 'keypad_interval': 1.0,
+    },
+}
+
+def report(message):
+    """進み具合を表示する (サーバーのモジュールの出力はログファイルに回しているので、元の標準出力に書く)"""
+    print(f"[Bench] {message}", file=sys.__stdout__, flush=True)
+
+
+# ==============================================================================
+# 集計
+# ==============================================================================
+def percentile(sorted_values, fraction):
+    """並べ替え済みの値の分位点 (最近傍順位法)"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize(samples, scale=1000.0):
+    """
+    所要時間 (秒) のリストを集計する
+
+    Args:
+        samples (list): 所要時間 (秒)
+        scale (float): 単位の変換 (1000ならミリ秒、1000000ならマイクロ秒)
+    Returns:
+        dict: count, mean, p50, p95, p99, max
+    """
+    values = sorted(v * scale for v in samples)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': round(sum(values) / len(values), 3),
+        'p50': round(percentile(values, 0.50), 3),
+        'p95': round(percentile(values, 0.95), 3),
+        'p99': round(percentile(values, 0.99), 3),
+        'max': round(values[-1], 3),
+    }
+
+
+# ==============================================================================
+# サーバープロセス
+# ==============================================================================
+def process_tree_cpu_seconds(pid):
+    """プロセスとその子孫 (本番モードのワーカーを含む) が使ったCPU時間の合計 (秒, Linuxの /proc から読む)"""
+    ticks = os.sysconf('SC_CLK_TCK')
+    children, usage = {}, {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat', 'rb') as f:
+                stat = f.read()
+        except OSError:
+            continue # 読んでいる間に終了したプロセス
+        # 2番目の項目 (コマンド名) は空白や括弧を含むことがあるので、最後の ')' の後ろから数える
+        fields = stat[stat.rfind(b')') + 2:].split()
+        children.setdefault(int(fields[1]), []).append(int(name))
+        usage[int(name)] = (int(fields[11]) + int(fields[12])) / ticks # utime + stime
+    total, stack = 0.0, [pid]
+    while stack:
+        current = stack.pop()
+        total += usage.get(current, 0.0)
+        stack.extend(children.get(current, []))
+    return total
+
+class ServerProcess:
+    """計測用に smart_home_server.py を別プロセスで起動する (作業ディレクトリ・ポートを分ける)"""
+
+    def __init__(self, workdir, port=BENCH_PORT, production=False, workers=2):
+        self.workdir = workdir
+        self.port = port
+        self.production = production
+        self.workers = workers
+        self.process = None
+        self._log = None
+
+    def start(self):
+        os.makedirs(self.workdir, exist_ok=True)
+        command = [sys.executable, SERVER_SCRIPT, '--port', str(self.port)]
+        if self.production:
+            command += ['--production', '--workers', str(self.workers)]
+        self._log = open(os.path.join(self.workdir, 'server.log'), 'ab')
+        self.process = subprocess.Popen(command, cwd=self.workdir, stdout=self._log, stderr=subprocess.STDOUT,
+                                        env=dict(os.environ, PYTHONUNBUFFERED='1'))
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited during startup (see {self._log.name}).")
+            try:
+                status, _, _ = http_get(self.port, '/status')
+                if status == 200:
+                    return self
+            except OSError:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"Server did not respond within {SERVER_START_TIMEOUT}s (see {self._log.name}).")
+
+    def cpu_seconds(self):
+        return process_tree_cpu_seconds(self.process.pid)
+
+    def stop(self):
+        """Ctrl+C と同じく SIGINT で止める (サーバーの終了処理を通す)"""
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signal.SIGINT)
+            try:
+                self.process.wait(15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+def http_get(port, path, headers=None, timeout=30):
+    """1回だけGETする (ステータスコード, ヘッダー, 本文)"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('GET', path, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.headers, response.read()
+    finally:
+        conn.close()
+
+
+# ==============================================================================
+# 計測: /status・/api/sensor_data
+# ==============================================================================
+def load_client_process(port, path, threads, start_at, seconds, conditional):
+    """
+    threads 本の接続 (Keep-Alive) から、start_at (time.time) から seconds 秒間GETを繰り返す
+    (http_load から別プロセスで呼ばれる。conditional が True なら前回の ETag を If-None-Match で送る)
+
+    Returns:
+        (list, int, int): (所要時間 (秒) のリスト, エラー数, 304 の数)
+    """
+    samples, counters = [], {'errors': 0, 'not_modified': 0}
+    lock = threading.Lock()
+    deadline = start_at + seconds
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local_samples, errors, not_modified, etag = [], 0, 0, None
+        time.sleep(max(0.0, start_at - time.time()))
+        while time.time() < deadline:
+            headers = {'If-None-Match': etag} if conditional and etag else {}
+            started = time.perf_counter()
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                continue
+            local_samples.append(time.perf_counter() - started)
+            if response.status == 200:
+                etag = response.getheader('ETag')
+            elif response.status == 304:
+                not_modified += 1
+            else:
+                errors += 1
+        conn.close()
+        with lock:
+            samples.extend(local_samples)
+            counters['errors'] += errors
+            counters['not_modified'] += not_modified
+
+    workers = [threading.Thread(target=client, daemon=True) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return samples, counters['errors'], counters['not_modified']
+
+def http_load(port, path, clients, seconds, conditional=False):
+    """
+    clients 本の接続から seconds 秒間GETを繰り返し、応答時間とスループットを測る
+    接続はCPUの数までのプロセスに分ける (計測する側がGILで頭打ちになり、サーバーの限界が見えなくならないように)
+    """
+    processes = max(1, min(clients, os.cpu_count() or 1))
+    threads = [clients // processes + (1 if i < clients % processes else 0) for i in range(processes)]
+    if processes == 1:
+        start_at = time.time() + 0.2
+        outcomes = [load_client_process(port, path, clients, start_at, seconds, conditional)]
+    else:
+        with multiprocessing.get_context('spawn').Pool(processes) as pool:
+            start_at = time.time() + 2.0 # 子プロセスの起動を待ってから一斉に始める
+            outcomes = pool.starmap(load_client_process,
+                                    [(port, path, n, start_at, seconds, conditional) for n in threads])
+    samples = [sample for outcome in outcomes for sample in outcome[0]]
+    return {
+        'case': f"GET {path} clients={clients}{' etag' if conditional else ''}",
+        'path': path,
+        'clients': clients,
+        'client_processes': processes,
+        'conditional': conditional,
+        'requests': len(samples),
+        'errors': sum(outcome[1] for outcome in outcomes),
+        'not_modified': sum(outcome[2] for outcome in outcomes),
+        'throughput_rps': round(len(samples) / seconds, 1),
+        'latency_ms': summarize(samples),
+    }
+
+def bench_status(server, profile):
+    results = []
+    for path in ('/status', '/api/sensor_data'):
+        http_get(server.port, path) # 初回 (キャッシュの作成) は計測に含めない
+        for conditional in (False, True):
+            for clients in profile['http_clients']:
+                result = http_load(server.port, path, clients, profile['http_seconds'], conditional)
+                report(f"{result['case']}: {result['throughput_rps']} req/s, "
+                       f"p50 {result['latency_ms'].get('p50')} ms, p99 {result['latency_ms'].get('p99')} ms")
+                results.append(result)
+    return results
+
+
+# ==============================================================================
+# 計測: /video_feed
+# ==============================================================================
+FRAME_BOUNDARY = b'--frame\r\n'
+VIDEO_SETTLE_SECONDS = 2.0 # 視聴者の数を変える前に待つ時間
+
+def wait_for_first_frame(port, path, timeout=30):
+    """1つの視聴者で最初のフレームを受け取るまで待つ (カメラの準備・OpenCVの読み込みを計測に含めない)"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        data = b''
+        while response.status == 200 and data.count(FRAME_BOUNDARY) < 2:
+            chunk = response.read1(65536)
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        conn.close()
+
+def bench_video(server, profile):
+    """視聴者の数ごとに、各視聴者が受け取れたフレームレートとサーバーのCPU使用率を測る"""
+    results = []
+    path = f"/video_feed?fps={profile['video_fps']}"
+    wait_for_first_frame(server.port, path)
+    for viewers in profile['video_viewers']:
+        # 前の計測の接続が閉じ、サーバーが視聴者の登録を解除するのを待つ (同時視聴数の上限に数えられないように)
+        time.sleep(VIDEO_SETTLE_SECONDS)
+        stop = threading.Event()
+        window = {'start': None, 'end': None}
+        frames = [0] * viewers
+        statuses = [None] * viewers
+
+        def viewer(i):
+            conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=10)
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                statuses[i] = response.status
+                if response.status != 200:
+                    response.read()
+                    return
+                tail = b''
+                while not stop.is_set():
+                    chunk = response.read1(65536)
+                    if not chunk:
+                        break
+                    data = tail + chunk
+                    now = time.perf_counter()
+                    # 計測区間に受け取ったフレームだけを数える
+                    if window['start'] is not None and window['start'] <= now and window['end'] is None:
+                        frames[i] += data.count(FRAME_BOUNDARY)
+                    tail = data[-(len(FRAME_BOUNDARY) - 1):]
+            except (OSError, http.client.HTTPException):
+                pass
+            finally:
+                conn.close()
+
+        threads = [threading.Thread(target=viewer, args=(i,), daemon=True) for i in range(viewers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(1.0) # 生成スレッドの起動と最初のフレームを待つ
+        cpu_before = server.cpu_seconds()
+        window['start'] = started = time.perf_counter()
+        time.sleep(profile['video_seconds'])
+        window['end'] = ended = time.perf_counter()
+        cpu_used = server.cpu_seconds() - cpu_before
+        stop.set()
+        for thread in threads:
+            thread.join(10)
+
+        accepted = [frames[i] / (ended - started) for i in range(viewers) if statuses[i] == 200]
+        result = {
+            'case': f"viewers={viewers}",
+            'viewers': viewers,
+            'accepted': len(accepted),
+            'rejected': viewers - len(accepted), # VIDEO_MAX_STREAMS を超えた分は 503
+            'requested_fps': profile['video_fps'],
+            'fps_per_viewer': {
+                'mean': round(sum(accepted) / len(accepted), 2) if accepted else 0,
+                'min': round(min(accepted), 2) if accepted else 0,
+                'max': round(max(accepted), 2) if accepted else 0,
+            },
+            'server_cpu_percent': round(cpu_used / (ended - started) * 100, 1),
+        }
+        report(f"/video_feed {result['case']}: {result['fps_per_viewer']['mean']} fps/viewer "
+               f"({result['rejected']} rejected), server CPU {result['server_cpu_percent']}%")
+        results.append(result)
+    return results
+
+
+# ==============================================================================
+# 計測: /log
+# ==============================================================================
+LOG_FIXTURE_SOURCES = ['Keypad', 'Web UI', 'AI', 'System']
+LOG_FIXTURE_TYPES = ['シーン実行', 'モード切替', 'データ記録', 'HDMI切替', 'プロジェクター']
+
+def append_log_fixture(csv_path, start_row, count, chunk_rows=20000):
+    """操作ログCSVに計測用の行を追記する (日付は行番号から決め、古い順に並ぶようにする)"""
+    base = datetime(2020, 1, 1)
+    with open(csv_path, 'ab') as f:
+        for chunk_start in range(start_row, start_row + count, chunk_rows):
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for i in range(chunk_start, min(start_row + count, chunk_start + chunk_rows)):
+                when = base + timedelta(minutes=i)
+                writer.writerow([when.strftime('%Y/%m/%d'), when.strftime('%H:%M:%S'),
+                                 LOG_FIXTURE_SOURCES[i % len(LOG_FIXTURE_SOURCES)],
+                                 LOG_FIXTURE_TYPES[i % len(LOG_FIXTURE_TYPES)],
+                                 f"シーン'set{(i % 5) * 25}'を実行", '192.168.0.10'])
+            f.write(buffer.getvalue().encode('utf-8'))
+
+def timed_get(port, path, count):
+    """count 回GETして所要時間 (秒) のリストを返す"""
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        status, _, _ = http_get(port, path)
+        if status != 200:
+            raise RuntimeError(f"GET {path} returned {status}")
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def bench_log_page(server, profile):
+    """
+    操作ログを指定の行数まで増やしながら /log の応答時間を測る
+    増やした直後の1回目 (索引が増えた分を取り込む) は first_ms として分けて記録する
+    """
+    import smart_home_server as s
+    csv_path = os.path.join(server.workdir, s.LOG_CSV_FILE)
+    rows = 0
+    results = []
+    for target in profile['log_rows']:
+        append_log_fixture(csv_path, rows, target - rows)
+        rows = target
+        started = time.perf_counter()
+        http_get(server.port, '/log')
+        first = time.perf_counter() - started
+        last_page = (rows + LOG_PER_PAGE - 1) // LOG_PER_PAGE
+        result = {
+            'case': f"rows={target}",
+            'rows': target,
+            'csv_bytes': os.path.getsize(csv_path),
+            'first_ms': round(first * 1000, 3),
+            'first_page_ms': summarize(timed_get(server.port, '/log', profile['log_requests'])),
+            'last_page_ms': summarize(timed_get(server.port, f'/log?page={last_page}', profile['log_requests'])),
+            'filtered_ms': summarize(timed_get(server.port, '/log?source=AI&from=2020-06-01',
+                                               profile['log_requests'])),
+        }
+        report(f"/log {result['case']}: first {result['first_ms']} ms, "
+               f"page 1 p50 {result['first_page_ms']['p50']} ms, last page p50 {result['last_page_ms']['p50']} ms, "
+               f"filtered p50 {result['filtered_ms']['p50']} ms")
+        results.append(result)
+    return results
+
+
+# ==============================================================================
+# 計測: log_action()・write_log() (このプロセスで直接呼ぶ)
+# ==============================================================================
+def bench_log_append(s, profile):
+    results = {}
+
+    # --- log_action: 呼び出し側の時間 (キューに積むだけ) と、書き込みスレッドが書き終えるまでの時間 ---
+    calls = profile['log_action_calls']
+    s.action_log_writer.start()
+    s.action_log_writer.flush()
+    samples = []
+    started = time.perf_counter()
+    for i in range(calls):
+        call_started = time.perf_counter()
+        s.log_action('Bench', '計測', f"行 {i}")
+        samples.append(time.perf_counter() - call_started)
+    enqueued = time.perf_counter()
+    s.action_log_writer.flush()
+    drained = time.perf_counter()
+    results['log_action'] = {
+        'calls': calls,
+        'call_us': summarize(samples, scale=1e6),
+        'enqueue_total_ms': round((enqueued - started) * 1000, 3),
+        'drain_ms': round((drained - enqueued) * 1000, 3),
+        'rows_per_second': round(calls / (drained - started), 1),
+        'fsync_policy': s.ACTION_LOG_FSYNC_POLICY,
+    }
+    report(f"log_action: p50 {results['log_action']['call_us']['p50']} us/call, "
+           f"{results['log_action']['rows_per_second']} rows/s written")
+
+    # --- write_log: 時系列ストアへの追記と集計の更新 (5分間隔の記録を連続して書く) ---
+    calls = profile['write_log_calls']
+    data = {'local_temp': 21.5, 'local_hum': 48.0, 'local_pres': 1012.3, 'local_lux': 850.0,
+            'hub_temp': 22.1, 'hub_hum': 45, 'hub_lux': 12, 'tuya_curtain_percent': 50}
+    base = datetime(2021, 1, 1)
+    samples = []
+    for i in range(calls):
+        timestamp = base + timedelta(minutes=5 * i)
+        call_started = time.perf_counter()
+        s.write_log(timestamp, data)
+        samples.append(time.perf_counter() - call_started)
+    results['write_log'] = {
+        'calls': calls,
+        'call_us': summarize(samples, scale=1e6),
+    }
+    report(f"write_log: p50 {results['write_log']['call_us']['p50']} us/call")
+    return results
+
+
+# ==============================================================================
+# 計測: キーパッド → シーン (このプロセスで直接動かす)
+# ==============================================================================
+def bench_keypad(s, sim, profile):
+    """
+    シミュレーターのキーパッドでキーを押し、次の時刻を測る
+        handled_ms : キーの処理 (handle_keypad_key) が始まるまで (エッジ検出・チャタリング確認・マトリクス走査)
+        scene_start_ms : シーンの実行が始まるまで (ブザー・操作ログ・LCD表示を含む)
+        scene_done_ms : シーンが完了するまで (SwitchBot・Tuya Cloud・CEC の代替への送信を含む)
+    プロジェクターの起動待ちがないシーン (キー1: set0, キー2: set25) を交互に使う
+    """
+    events = queue.Queue()
+    original_handle = s.handle_keypad_key
+    original_start = s.scene_engine.start
+
+    def handle_keypad_key(key_pressed):
+        events.put(('handled', time.perf_counter(), None))
+        original_handle(key_pressed)
+
+    def start_scene(scene_name, triggered_by='manual'):
+        run = original_start(scene_name, triggered_by)
+        events.put(('scene', time.perf_counter(), run))
+        return run
+
+    s.handle_keypad_key = handle_keypad_key
+    s.scene_engine.start = start_scene
+    handled, scene_start, scene_done, failures = [], [], [], 0
+    try:
+        for i in range(profile['keypad_presses']):
+            key = '1' if i % 2 == 0 else '2'
+            pressed = time.perf_counter()
+            sim.GPIO.press_key(key)
+            try:
+                _, handled_at, _ = events.get(timeout=5)
+                _, started_at, run = events.get(timeout=5)
+            except queue.Empty:
+                failures += 1
+                continue
+            if not run.wait(30) or run.status != 'completed':
+                failures += 1
+            handled.append(handled_at - pressed)
+            scene_start.append(started_at - pressed)
+            scene_done.append(time.perf_counter() - pressed)
+            time.sleep(profile['keypad_interval'])
+    finally:
+        s.handle_keypad_key = original_handle
+        s.scene_engine.start = original_start
+
+    result = {
+        'presses': profile['keypad_presses'],
+        'failures': failures,
+        'settle_seconds': s.KEYPAD_SETTLE_SECONDS,
+        'handled_ms': summarize(handled),
+        'scene_start_ms': summarize(scene_start),
+        'scene_done_ms': summarize(scene_done),
+    }
+    report(f"keypad: handled p50 {result['handled_ms'].get('p50')} ms, "
+           f"scene start p50 {result['scene_start_ms'].get('p50')} ms, "
+           f"scene done p50 {result['scene_done_ms'].get('p50')} ms ({failures} failures)")
+    return result
+
+def init_in_process(s):
+    """keypad・log_append の計測に使う部分だけを初期化する (smart_home_server.py の起動処理の一部)"""
+    s.init_gpio()
+    s.keypad_driver.start()
+    threading.Thread(target=s.keypad_dispatch_loop, daemon=True).start()
+    if s.init_i2c():
+        s.setup_bme280()
+    s.init_sensor_store()
+    threading.Thread(target=s.tuya_connect_loop, daemon=True).start()
+    threading.Thread(target=s.projector_status_loop, daemon=True).start()
+    if not s.tuya_ready.wait(15):
+        raise RuntimeError("Tuya stand-in did not connect.")
+    if not s.cec_monitor.ready.wait(15):
+        raise RuntimeError("Simulated cec-client did not start.")
+
+
+# ==============================================================================
+# 結果の比較
+# ==============================================================================
+# 値が大きいほど良い指標 (それ以外は小さいほど良い)
+HIGHER_IS_BETTER = ('throughput_rps', 'rows_per_second', 'fps_per_viewer')
+# 計測条件を表す項目 (比較しない)
+CONDITION_KEYS = ('/count', '/calls', '/requests', '/presses', '/rows', '/viewers', '/clients', '/client_processes',
+                  '/accepted', '/requested_fps', '/settle_seconds', '/csv_bytes')
+
+def flatten_metrics(results):
+    """結果のJSONを {'ベンチマーク/ケース/指標': 値} に平らにする (比較用)"""
+    metrics = {}
+
+    def walk(prefix, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if key != 'case':
+                    walk(f"{prefix}/{key}", item)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict) and 'case' in item:
+                    walk(f"{prefix}/{item['case']}", item)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[prefix] = value
+
+    for name, value in results.get('benchmarks', {}).items():
+        walk(name, value)
+    return metrics
+
+def compare_results(old, new, threshold):
+    """2つの結果の共通の指標を比べて表示する。threshold (%) を超えて悪化した指標の数を返す"""
+    old_metrics, new_metrics = flatten_metrics(old), flatten_metrics(new)
+    regressions = 0
+    print(f"{'metric':<70} {'old':>12} {'new':>12} {'change':>9}")
+    for key in sorted(old_metrics.keys() & new_metrics.keys()):
+        before, after = old_metrics[key], new_metrics[key]
+        if key.endswith(CONDITION_KEYS):
+            continue # 計測条件で、性能の指標ではない
+        change = (after - before) / before * 100 if before else 0.0
+        worse = -change if any(part in key for part in HIGHER_IS_BETTER) else change
+        flag = ''
+        if worse > threshold:
+            flag = '  <- regression'
+            regressions += 1
+        print(f"{key:<70} {before:>12g} {after:>12g} {change:>+8.1f}%{flag}")
+    print(f"\n{regressions} metrics regressed by more than {threshold}%.")
+    return regressions
+
+
+# ==============================================================================
+# メイン
+# ==============================================================================
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run_benchmarks(args):
+    profile = dict(PROFILES['quick' if args.quick else 'full'])
+    selected = args.only.split(',') if args.only else BENCHMARKS
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        raise SystemExit(f"Unknown benchmark(s): {', '.join(sorted(unknown))} (choose from {', '.join(BENCHMARKS)})")
+
+    workdir = tempfile.mkdtemp(prefix='smarthome-bench-')
+    local_dir = os.path.join(workdir, 'local')
+    os.makedirs(local_dir)
+    report(f"Working directory: {workdir}")
+
+    # サーバーのモジュールが出すメッセージはログファイルに回す (計測の表示と混ざらないように)
+    module_log = open(os.path.join(workdir, 'in_process.log'), 'a', encoding='utf-8')
+    sys.stdout = module_log
+    os.chdir(local_dir) # 操作ログ・時系列ストアなどは作業ディレクトリに作られる
+    sys.path.insert(0, REPO_DIR)
+    import sim_backend
+    import smart_home_server as s
+    # 代替サーバーはこのプロセスで起動し、計測用のサーバーのプロセスにも使わせる
+    # (サーバーのCPU使用率に代替サーバーの処理が含まれないように)
+    sim_backend.start_services()
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'profile': 'quick' if args.quick else 'full',
+            'production': args.production,
+            'workers': args.workers if args.production else None,
+            'sim_latency_ms': dict({name: service.latency_ms for name, service in sim_backend.services.items()},
+                                   cec=sim_backend.CEC_LATENCY_MS),
+            'parameters': profile,
+        },
+        'benchmarks': {},
+    }
+
+    try:
+        if {'log_append', 'keypad'} & set(selected):
+            init_in_process(s)
+            if 'log_append' in selected:
+                results['benchmarks']['log_append'] = bench_log_append(s, profile)
+            if 'keypad' in selected:
+                results['benchmarks']['keypad'] = bench_keypad(s, sim_backend, profile)
+
+        http_benchmarks = [name for name in ('status', 'video', 'log_page') if name in selected]
+        if http_benchmarks:
+            server = ServerProcess(os.path.join(workdir, 'server'), args.port, args.production, args.workers)
+            report(f"Starting server ({'production, %d workers' % args.workers if args.production else 'development'}) "
+                   f"on port {args.port}...")
+            server.start()
+            try:
+                if 'status' in selected:
+                    results['benchmarks']['status'] = bench_status(server, profile)
+                if 'video' in selected:
+                    results['benchmarks']['video'] = bench_video(server, profile)
+                if 'log_page' in selected:
+                    results['benchmarks']['log_page'] = bench_log_page(server, profile)
+            finally:
+                server.stop()
+    finally:
+        s.cec_monitor.stop()
+        sim_backend.stop_services()
+        sys.stdout = sys.__stdout__
+        module_log.close()
+        if args.keep_workdir:
+            report(f"Kept working directory {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="スマートホーム管理サーバーの性能計測 (シミュレーター上で実行)")
+    parser.add_argument('--only', help=f"計測する項目 (カンマ区切り: {', '.join(BENCHMARKS)})")
+    parser.add_argument('--quick', action='store_true', help="件数・時間を減らして短く計測する")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help=f"結果のJSONファイル (既定: {DEFAULT_OUTPUT})")
+    parser.add_argument('--port', type=int, default=BENCH_PORT, help=f"計測用サーバーのポート (既定: {BENCH_PORT})")
+    parser.add_argument('--production', action='store_true', help="HTTPの計測を本番モードのサーバーで行う")
+    parser.add_argument('--workers', type=int, default=2, help="本番モードのワーカープロセス数 (既定: 2)")
+    parser.add_argument('--compare', metavar='OLD_JSON', help="前回の結果のJSONと比べて変化を表示する")
+    parser.add_argument('--compare-only', metavar='NEW_JSON',
+                        help="計測せずに、--compare のファイルとこのファイルを比べるだけにする")
+    parser.add_argument('--threshold', type=float, default=10.0, help="悪化とみなす変化の割合 (%%, 既定: 10)")
+    parser.add_argument('--keep-workdir', action='store_true', help="計測に使った作業ディレクトリを残す")
+    args = parser.parse_args()
+
+    if args.compare_only:
+        if not args.compare:
+            parser.error("--compare-only requires --compare")
+        with open(args.compare, encoding='utf-8') as f:
+            old = json.load(f)
+        with open(args.compare_only, encoding='utf-8') as f:
+            new = json.load(f)
+        sys.exit(1 if compare_results(old, new, args.threshold) else 0)
+
+    output = os.path.abspath(args.output)
+    compare = os.path.abspath(args.compare) if args.compare else None
+    results = run_benchmarks(args)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    report(f"Results written to {output}")
+
+    if compare:
+        with open(compare, encoding='utf-8') as f:
+            old = json.load(f)
+        sys.exit(1 if compare_results(old, results, args.threshold) else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,782 @@
+# -*- coding: utf-8 -*-
+"""
+スマートホーム管理サーバーのシミュレーター (ハードウェアのバックエンド)
+環境変数 SMARTHOME_BACKEND=sim で smart_home_server.py を起動すると、実機の代わりにこれを使う。
+Raspberry Pi がなくても (x86のLinuxでも) 実際のコードの経路をそのまま動かし、計測・負荷試験ができる。
+
+シミュレートするもの:
+    - GPIO (RPi.GPIO 互換): LEDの出力、キーパッドのマトリクス (列の出力と行の入力・立ち上がりエッジの通知)
+    - I2Cバス (smbus2 互換): BME280 (温湿度・気圧) と BH1750 (照度) のレジスタ
+    - I2C LCD (RPLCD 互換): 16x2 の表示内容をメモリ上に保持
+    - カメラ (cv2.VideoCapture 互換): 合成した映像を実機と同じフレームレートで返す
+    - cec-client: 標準入出力で cec-client と同じ形式の TRAFFIC 行を返すプロセス (プロジェクターの起動時間つき)
+    - Tuya Cloud (tuya_connector 互換): ローカルの代替サーバーにHTTPで接続する
+    - SwitchBot・PCのAIサーバー: ローカルの代替HTTPサーバー
+
+代替サーバーの応答時間 (ミリ秒) は環境変数で変えられる:
+    SIM_SWITCHBOT_LATENCY_MS, SIM_TUYA_LATENCY_MS, SIM_AI_LATENCY_MS, SIM_CEC_LATENCY_MS
+    (実行中に変える場合は services['switchbot'].latency_ms などを書き換える)
+
+単体での使い方:
+    python sim_backend.py serve        代替サーバーだけを起動する (別プロセスで負荷をかける場合など)
+    python sim_backend.py cec-client   cec-client の代わりとして動く (サーバーが自動で起動する)
+"""
+
+import argparse
+import gzip
+import json
+import math
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import numpy as np
+import requests
+
+# ==============================================================================
+# 1. 設定 (環境変数で変更できる)
+# ==============================================================================
+SIM_HOST = os.environ.get('SIM_HOST', '127.0.0.1')
+SWITCHBOT_PORT = int(os.environ.get('SIM_SWITCHBOT_PORT', 18081))
+TUYA_PORT = int(os.environ.get('SIM_TUYA_PORT', 18082))
+AI_PORT = int(os.environ.get('SIM_AI_PORT', 18083))
+
+# 代替サーバー・cec-client の応答時間 (実機で観測したおおよその値)
+SWITCHBOT_LATENCY_MS = float(os.environ.get('SIM_SWITCHBOT_LATENCY_MS', 80))
+TUYA_LATENCY_MS = float(os.environ.get('SIM_TUYA_LATENCY_MS', 300))
+AI_LATENCY_MS = float(os.environ.get('SIM_AI_LATENCY_MS', 30))
+CEC_LATENCY_MS = float(os.environ.get('SIM_CEC_LATENCY_MS', 40))
+LATENCY_JITTER = 0.2 # 応答時間のばらつき (±20%)
+
+CEC_STARTUP_SECONDS = float(os.environ.get('SIM_CEC_STARTUP_SECONDS', 0.3)) # アダプターを開くまでの時間
+PROJECTOR_WARMUP_SECONDS = float(os.environ.get('SIM_PROJECTOR_WARMUP_SECONDS', 5)) # 電源ONから起動完了まで
+CEC_NACK_RATE = float(os.environ.get('SIM_CEC_NACK_RATE', 0)) # 送信が NACK になる割合 (0〜1, 再送の経路の確認用)
+CAMERA_FPS = float(os.environ.get('SIM_CAMERA_FPS', 30)) # カメラのフレームレート
+
+# smart_home_server.py が使う接続先 (代替サーバー)
+SWITCHBOT_BASE_URL = f"http://{SIM_HOST}:{SWITCHBOT_PORT}/itap/v1"
+TUYA_API_ENDPOINT = f"http://{SIM_HOST}:{TUYA_PORT}"
+AI_PREDICT_URL = f"http://{SIM_HOST}:{AI_PORT}/predict"
+CEC_CLIENT_COMMAND = [sys.executable, os.path.abspath(__file__), 'cec-client']
+
+def simulated_delay(latency_ms):
+    """応答時間 (ばらつきを含む) だけ待つ"""
+    if latency_ms > 0:
+        time.sleep(latency_ms / 1000 * random.uniform(1 - LATENCY_JITTER, 1 + LATENCY_JITTER))
+
+
+# ==============================================================================
+# 2. 環境 (気温・湿度・気圧・明るさ) のモデル
+# ==============================================================================
+class SimEnvironment:
+    """
+    時刻に応じて変化する屋外・室内の環境
+    1日周期の変化 (日中は暖かく明るい) に小さなノイズを加える
+    """
+
+    def __init__(self, seed=None):
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _noise(self, scale):
+        with self._lock:
+            return self._random.gauss(0, scale)
+
+    @staticmethod
+    def _day_phase(now):
+        """0時からの経過を 0〜1 で返す (ローカル時刻)"""
+        t = time.localtime(now)
+        return (t.tm_hour * 3600 + t.tm_min * 60 + t.tm_sec) / 86400
+
+    def daylight(self, now=None):
+        """日の出 (6時) から日の入り (18時) までの明るさ 0〜1"""
+        phase = self._day_phase(now or time.time())
+        return max(0.0, math.sin((phase - 0.25) * 2 * math.pi))
+
+    def outdoor(self, now=None):
+        """屋外 (ローカルのBME280・BH1750) の (気温℃, 湿度%, 気圧hPa, 照度lux)"""
+        now = now or time.time()
+        phase = self._day_phase(now)
+        temp = 18 + 6 * math.sin((phase - 0.375) * 2 * math.pi) + self._noise(0.1)
+        hum = 60 - 15 * math.sin((phase - 0.375) * 2 * math.pi) + self._noise(0.5)
+        pres = 1012 + 3 * math.sin(now / 86400 / 3 * 2 * math.pi) + self._noise(0.05)
+        lux = 30000 * self.daylight(now) + abs(self._noise(20))
+        return temp, min(max(hum, 0), 100), pres, min(lux, 54000)
+
+    def indoor(self, now=None):
+        """室内 (SwitchBotハブ) の (気温℃, 湿度%, 明るさレベル1〜20)"""
+        now = now or time.time()
+        temp = 22 + 1.5 * math.sin((self._day_phase(now) - 0.4) * 2 * math.pi) + self._noise(0.05)
+        hum = 45 + self._noise(0.5)
+        light_level = 1 + round(19 * self.daylight(now))
+        return round(temp, 1), round(hum), light_level
+
+environment = SimEnvironment()
+
+
+# ==============================================================================
+# 3. GPIO (RPi.GPIO 互換)
+# ==============================================================================
+class SimGPIO:
+    """
+    RPi.GPIO と同じ関数を持つGPIOのシミュレーター
+
+    キーパッドは「押されているキーの行ピンは、その列ピンの出力がHIGHのときHIGHになる」という
+    マトリクスの配線をそのまま再現する。行ピンの立ち上がりエッジは、RPi.GPIO と同じく
+    1本のイベントスレッドからコールバックする (bouncetime の間の再通知はしない)。
+    """
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._modes = {}       # ピン -> IN / OUT
+        self._outputs = {}     # 出力ピン -> レベル
+        self._closed = set()   # 押されているキーの (行ピン, 列ピン)
+        self._detect = {}      # ピン -> {'edge', 'callback', 'bouncetime', 'last'}
+        self._levels = {}      # エッジ検出中のピンの前回のレベル
+        self._keymap = {}      # キー -> (行ピン, 列ピン)
+        self._events = queue.Queue()
+        self._event_thread = None
+
+    # --- RPi.GPIO 互換の関数 ---
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, mode, pull_up_down=None, initial=None):
+        with self._lock:
+            self._modes[pin] = mode
+            if mode == self.OUT:
+                self._outputs[pin] = self.LOW if initial is None else initial
+        self._update_edges()
+
+    def output(self, pin, level):
+        with self._lock:
+            self._outputs[pin] = self.HIGH if level else self.LOW
+        self._update_edges()
+
+    def input(self, pin):
+        with self._lock:
+            return self._level(pin)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        with self._lock:
+            if pin in self._detect:
+                raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+            self._detect[pin] = {'edge': edge, 'callback': callback, 'bouncetime': bouncetime or 0, 'last': 0}
+            self._levels[pin] = self._level(pin)
+            if self._event_thread is None:
+                self._event_thread = threading.Thread(target=self._event_loop, name='SimGPIOEvents', daemon=True)
+                self._event_thread.start()
+
+    def remove_event_detect(self, pin):
+        with self._lock:
+            self._detect.pop(pin, None)
+            self._levels.pop(pin, None)
+
+    def cleanup(self):
+        with self._lock:
+            self._modes.clear()
+            self._outputs.clear()
+            self._detect.clear()
+            self._levels.clear()
+            self._closed.clear()
+
+    # --- シミュレーター用の操作 ---
+    def configure_keypad(self, row_pins, col_pins, keymap):
+        """キーパッドの配線 (KEYPAD_ROW_PINS, KEYPAD_COL_PINS, KEYPAD_MAP) を登録する"""
+        self._keymap = {key: (row_pins[r], col_pins[c])
+                        for r, keys in enumerate(keymap) for c, key in enumerate(keys)}
+
+    def press_key(self, key, hold_seconds=0.1):
+        """キーを押し、hold_seconds 後に離す (すぐに戻る)"""
+        switch = self._keymap[key]
+        with self._lock:
+            self._closed.add(switch)
+        self._update_edges()
+        threading.Timer(hold_seconds, self._release, args=(switch,)).start()
+
+    def _release(self, switch):
+        with self._lock:
+            self._closed.discard(switch)
+        self._update_edges()
+
+    def level(self, pin):
+        """出力ピンの現在のレベル (LEDの点灯確認用)"""
+        with self._lock:
+            return self._outputs.get(pin, self.LOW)
+
+    # --- 内部処理 ---
+    def _level(self, pin):
+        """ピンのレベル (ロックを取ってから呼ぶ)"""
+        if self._modes.get(pin) == self.OUT:
+            return self._outputs.get(pin, self.LOW)
+        for row_pin, col_pin in self._closed:
+            if row_pin == pin and self._outputs.get(col_pin) == self.HIGH:
+                return self.HIGH
+        return self.LOW
+
+    def _update_edges(self):
+        """エッジ検出中のピンのレベル変化を調べ、該当するエッジをイベントスレッドに渡す"""
+        now = time.monotonic()
+        with self._lock:
+            for pin, detect in self._detect.items():
+                level, previous = self._level(pin), self._levels.get(pin)
+                self._levels[pin] = level
+                if level == previous:
+                    continue
+                rising = level == self.HIGH
+                if detect['edge'] == self.BOTH or (detect['edge'] == self.RISING) == rising:
+                    if (now - detect['last']) * 1000 >= detect['bouncetime']:
+                        detect['last'] = now
+                        self._events.put((detect['callback'], pin))
+
+    def _event_loop(self):
+        while True:
+            callback, pin = self._events.get()
+            if callback is None:
+                continue
+            try:
+                callback(pin)
+            except Exception as e:
+                print(f"[Sim] GPIO callback for pin {pin} failed: {e}")
+
+GPIO = SimGPIO()
+
+
+# ==============================================================================
+# 4. I2Cバス (smbus2 互換) と LCD (RPLCD 互換)
+# ==============================================================================
+# BME280 の補正値 (データシートの計算例の値。湿度は実機で読み取った典型的な値)
+BME280_CALIBRATION = {
+    'T1': 27504, 'T2': 26435, 'T3': -1000,
+    'P1': 36477, 'P2': -10685, 'P3': 3024, 'P4': 2855, 'P5': 140, 'P6': -7,
+    'P7': 15500, 'P8': -14600, 'P9': 6000,
+    'H1': 75, 'H2': 362, 'H3': 0, 'H4': 313, 'H5': 50, 'H6': 30,
+}
+
+def bme280_compensate(adc_T, adc_P, adc_H, cal=BME280_CALIBRATION):
+    """BME280 の生の値から (気温℃, 気圧hPa, 湿度%) を計算する (データシートの浮動小数点版)"""
+    v1 = (adc_T / 16384.0 - cal['T1'] / 1024.0) * cal['T2']
+    v2 = ((adc_T / 131072.0 - cal['T1'] / 8192.0) ** 2) * cal['T3']
+    t_fine = v1 + v2
+    var1 = (t_fine / 2.0) - 64000.0
+    var2 = var1 * var1 * cal['P6'] / 32768.0
+    var2 = var2 + var1 * cal['P5'] * 2.0
+    var2 = (var2 / 4.0) + (cal['P4'] * 65536.0)
+    var1 = (cal['P3'] * var1 * var1 / 524288.0 + cal['P2'] * var1) / 524288.0
+    var1 = (1.0 + var1 / 32768.0) * cal['P1']
+    p = 1048576.0 - adc_P
+    p = (p - (var2 / 4096.0)) * 6250.0 / var1
+    p = p + (cal['P9'] * p * p / 2147483648.0 + p * cal['P8'] / 32768.0 + cal['P7']) / 16.0
+    h = t_fine - 76800.0
+    h = (adc_H - (cal['H4'] * 64.0 + cal['H5'] / 16384.0 * h)) * \
+        (cal['H2'] / 65536.0 * (1.0 + cal['H6'] / 67108864.0 * h * (1.0 + cal['H3'] / 67108864.0 * h)))
+    h = h * (1.0 - cal['H1'] * h / 524288.0)
+    return t_fine / 5120.0, p / 100, h
+
+def _bisect_adc(target, low, high, value_of):
+    """value_of(adc) が target に最も近くなる adc を二分探索で求める (value_of は単調)"""
+    increasing = value_of(high) > value_of(low)
+    while high - low > 1:
+        mid = (low + high) // 2
+        if (value_of(mid) < target) == increasing:
+            low = mid
+        else:
+            high = mid
+    return low
+
+def bme280_raw_values(temp, pres, hum, cal=BME280_CALIBRATION):
+    """(気温℃, 気圧hPa, 湿度%) になる BME280 の生の値 (adc_T, adc_P, adc_H) を求める"""
+    adc_T = _bisect_adc(temp, 0, (1 << 20) - 1, lambda a: bme280_compensate(a, 0, 0, cal)[0])
+    adc_P = _bisect_adc(pres, 1, (1 << 20) - 1, lambda a: bme280_compensate(adc_T, a, 0, cal)[1])
+    adc_H = _bisect_adc(hum, 0, (1 << 16) - 1, lambda a: bme280_compensate(adc_T, 0, a, cal)[2])
+    return adc_T, adc_P, adc_H
+
+def _bme280_calibration_registers(cal=BME280_CALIBRATION):
+    """補正値をレジスタ (0x88〜, 0xA1, 0xE1〜) のバイト列に変換する"""
+    def word(value):
+        value &= 0xFFFF
+        return [value & 0xFF, value >> 8]
+    block1 = []
+    for name in ('T1', 'T2', 'T3', 'P1', 'P2', 'P3', 'P4', 'P5', 'P6', 'P7', 'P8', 'P9'):
+        block1 += word(cal[name])
+    block1 += [0, 0] # 0xA0 (未使用) まで
+    h4, h5 = cal['H4'] & 0xFFF, cal['H5'] & 0xFFF
+    block3 = word(cal['H2']) + [cal['H3'], h4 >> 4, ((h5 & 0x0F) << 4) | (h4 & 0x0F), h5 >> 4, cal['H6'] & 0xFF]
+    registers = {0x88 + i: b for i, b in enumerate(block1)}
+    registers[0xA1] = cal['H1']
+    registers.update({0xE1 + i: b for i, b in enumerate(block3)})
+    return registers
+
+class SimSMBus:
+    """smbus2.SMBus と同じ関数を持つI2Cバス (BME280: 0x76, BH1750: 0x23, LCD: 0x3f が接続されている)"""
+
+    BME280_ADDRESS = 0x76
+    BH1750_ADDRESS = 0x23
+    LCD_ADDRESS = 0x3f
+
+    def __init__(self, bus=1, env=environment):
+        self.env = env
+        self.devices = {self.BME280_ADDRESS, self.BH1750_ADDRESS, self.LCD_ADDRESS}
+        self._bme280_registers = _bme280_calibration_registers()
+
+    def _check(self, address):
+        if address not in self.devices:
+            raise OSError(121, "Remote I/O error")
+
+    def read_byte(self, address):
+        self._check(address)
+        return 0
+
+    def write_byte(self, address, value):
+        self._check(address)
+
+    def write_byte_data(self, address, register, value):
+        self._check(address)
+        if address == self.BME280_ADDRESS:
+            self._bme280_registers[register] = value
+
+    def read_byte_data(self, address, register):
+        return self.read_i2c_block_data(address, register, 1)[0]
+
+    def read_i2c_block_data(self, address, register, length):
+        self._check(address)
+        if address == self.BH1750_ADDRESS:
+            # 照度 x 1.2 を16ビットで返す (高解像度モード)
+            raw = min(int(self.env.outdoor()[3] * 1.2), 0xFFFF)
+            return [raw >> 8, raw & 0xFF][:length]
+        if address == self.BME280_ADDRESS and register == 0xF7:
+            temp, hum, pres, _ = self.env.outdoor()
+            adc_T, adc_P, adc_H = bme280_raw_values(temp, pres, hum)
+            data = [adc_P >> 12, (adc_P >> 4) & 0xFF, (adc_P & 0x0F) << 4,
+                    adc_T >> 12, (adc_T >> 4) & 0xFF, (adc_T & 0x0F) << 4,
+                    adc_H >> 8, adc_H & 0xFF]
+            return data[:length]
+        return [self._bme280_registers.get(register + i, 0) for i in range(length)]
+
+    def close(self):
+        pass
+
+smbus2 = types.SimpleNamespace(SMBus=SimSMBus)
+
+class SimCharLCD:
+    """RPLCD.i2c.CharLCD と同じ使い方ができるLCD (表示内容を lines() で読める)"""
+
+    def __init__(self, i2c_expander=None, address=None, port=None, cols=16, rows=2, **kwargs):
+        self.cols = cols
+        self.rows = rows
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._buffer = [[' '] * self.cols for _ in range(self.rows)]
+            self.cursor_pos = (0, 0)
+
+    def write_string(self, text):
+        with self._lock:
+            row, col = self.cursor_pos
+            for ch in text:
+                if ch == '\n':
+                    row, col = (row + 1) % self.rows, 0
+                    continue
+                if ch == '\r':
+                    col = 0
+                    continue
+                if col < self.cols:
+                    self._buffer[row][col] = ch
+                col += 1
+            self.cursor_pos = (row, min(col, self.cols - 1))
+
+    def lines(self):
+        with self._lock:
+            return [''.join(line) for line in self._buffer]
+
+    def close(self, clear=False):
+        pass
+
+CharLCD = SimCharLCD
+
+class SimVideoCapture:
+    """
+    cv2.VideoCapture と同じ使い方ができるカメラ
+    read() は実機のカメラと同じく次のフレームの時刻まで待ってから、新しい配列を返す。
+    映像はグラデーションの上を四角形が動くもの (JPEGの圧縮の重さが実際の映像に近くなるよう、ノイズを加える)
+    """
+
+    CAP_PROP_FRAME_WIDTH = 3  # cv2.CAP_PROP_FRAME_WIDTH
+    CAP_PROP_FRAME_HEIGHT = 4 # cv2.CAP_PROP_FRAME_HEIGHT
+    LOOP_FRAMES = 60          # 四角形が左端から右端まで動くフレーム数
+
+    def __init__(self, index=0, width=640, height=480, fps=CAMERA_FPS):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self._opened = True
+        self._background = None
+        self._count = 0
+        self._next_due = time.monotonic()
+
+    def isOpened(self):
+        return self._opened
+
+    def set(self, prop, value):
+        if prop == self.CAP_PROP_FRAME_WIDTH:
+            self.width = int(value)
+        elif prop == self.CAP_PROP_FRAME_HEIGHT:
+            self.height = int(value)
+        else:
+            return False
+        self._background = None # 次の read() で作り直す
+        return True
+
+    def get(self, prop):
+        return {self.CAP_PROP_FRAME_WIDTH: self.width, self.CAP_PROP_FRAME_HEIGHT: self.height}.get(prop, 0)
+
+    def _make_background(self):
+        rng = np.random.default_rng(0)
+        x = np.linspace(0, 255, self.width, dtype=np.float32)
+        y = np.linspace(0, 255, self.height, dtype=np.float32)[:, None]
+        base = np.stack([np.broadcast_to(x, (self.height, self.width)),
+                         np.broadcast_to(y, (self.height, self.width)),
+                         np.full((self.height, self.width), 96, np.float32)], axis=2)
+        base += rng.normal(0, 6, base.shape).astype(np.float32)
+        return np.clip(base, 0, 255).astype(np.uint8)
+
+    def read(self):
+        if not self._opened:
+            return False, None
+        if self._background is None:
+            self._background = self._make_background()
+        delay = self._next_due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_due = max(self._next_due + 1 / self.fps, time.monotonic())
+        frame = self._background.copy()
+        size = max(8, self.height // 4)
+        left = (self.width - size) * (self._count % self.LOOP_FRAMES) // self.LOOP_FRAMES
+        top = (self.height - size) // 2
+        frame[top:top + size, left:left + size] = 230
+        self._count += 1
+        return True, frame
+
+    def release(self):
+        self._opened = False
+
+
+# ==============================================================================
+# 5. Tuya Cloud (tuya_connector 互換)
+# ==============================================================================
+class SimTuyaOpenAPI:
+    """tuya_connector.TuyaOpenAPI の代わり (署名なしで、ローカルの代替サーバーにHTTPで接続する)"""
+
+    def __init__(self, endpoint, access_id, access_secret, lang='en'):
+        self.endpoint = endpoint.rstrip('/')
+        self.access_id = access_id
+        self.token = None
+        self.session = requests.Session()
+
+    def connect(self, username='', password='', country_code='', schema=''):
+        response = self.session.get(f"{self.endpoint}/v1.0/token", params={'grant_type': 1}, timeout=10).json()
+        if response.get('success'):
+            self.token = response['result']['access_token']
+        return response
+
+    def _request(self, method, path, params=None, body=None):
+        response = self.session.request(method, f"{self.endpoint}{path}", params=params, json=body,
+                                        headers={'client_id': self.access_id, 'access_token': self.token or ''},
+                                        timeout=10)
+        return response.json()
+
+    def get(self, path, params=None):
+        return self._request('GET', path, params=params)
+
+    def post(self, path, body=None):
+        return self._request('POST', path, body=body)
+
+tuya_connector = types.SimpleNamespace(TuyaOpenAPI=SimTuyaOpenAPI)
+
+
+# ==============================================================================
+# 6. 代替HTTPサーバー (SwitchBot・Tuya Cloud・PCのAIサーバー)
+# ==============================================================================
+class StandInService:
+    """
+    ローカルで動く代替HTTPサーバー
+    route(method, path, body) を実装したサブクラスを作る。応答の前に latency_ms だけ待つ
+    """
+
+    name = 'service'
+
+    def __init__(self, port, latency_ms, host=SIM_HOST):
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms
+        self.request_counts = {} # パス -> 件数
+        self._counts_lock = threading.Lock()
+        self._server = None
+
+    def route(self, method, path, body):
+        """(ステータスコード, 応答の辞書) を返す"""
+        raise NotImplementedError
+
+    def start(self):
+        """別スレッドでサーバーを起動する (ポートが使用中ならFalse: 別プロセスの代替サーバーを使う)"""
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # Keep-Alive (HttpClient の接続の再利用を実機と同じにする)
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                path = urlparse(self.path).path
+                with service._counts_lock:
+                    service.request_counts[path] = service.request_counts.get(path, 0) + 1
+                simulated_delay(service.latency_ms)
+                try:
+                    status, payload = service.route(self.command, path, json.loads(body) if body else None)
+                except Exception as e:
+                    status, payload = 500, {'error': str(e)}
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass # アクセスログは出さない
+
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            print(f"[Sim] {self.name} stand-in not started on port {self.port} ({e}). Using the existing one.")
+            return False
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=f"Sim-{self.name}", daemon=True).start()
+        print(f"[Sim] {self.name} stand-in listening on http://{self.host}:{self.port} "
+              f"(latency {self.latency_ms:g} ms)")
+        return True
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+class SwitchBotStandIn(StandInService):
+    """SwitchBot (ローカルAPI) の代替: ハブの温湿度・明るさと、カーテンの setPosition"""
+
+    name = 'SwitchBot'
+
+    def __init__(self, port=SWITCHBOT_PORT, latency_ms=SWITCHBOT_LATENCY_MS, env=environment):
+        super().__init__(port, latency_ms)
+        self.env = env
+        self.curtain_positions = {} # デバイスID -> 位置
+
+    def route(self, method, path, body):
+        if path.endswith('/devices/status'):
+            temp, hum, light_level = self.env.indoor()
+            return 200, {'temperature': temp, 'humidity': hum, 'lightLevel': light_level}
+        if path.endswith('/devices/commands'):
+            command = (body or {}).get('command', {})
+            self.curtain_positions[body.get('deviceId')] = command.get('parameter')
+            return 200, {'statusCode': 100, 'message': 'success'}
+        return 404, {'statusCode': 404, 'message': 'not found'}
+
+class TuyaStandIn(StandInService):
+    """Tuya Cloud の代替: トークンの発行と、デバイスへのコマンド"""
+
+    name = 'Tuya Cloud'
+
+    def __init__(self, port=TUYA_PORT, latency_ms=TUYA_LATENCY_MS):
+        super().__init__(port, latency_ms)
+        self.commands = [] # 受け取ったコマンドの記録 [(デバイスID, コマンドのリスト)]
+
+    def route(self, method, path, body):
+        if path == '/v1.0/token':
+            return 200, {'success': True, 'result': {'access_token': 'sim-token', 'expire_time': 7200}}
+        parts = path.strip('/').split('/')
+        if method == 'POST' and len(parts) == 4 and parts[:2] == ['v1.0', 'devices'] and parts[3] == 'commands':
+            self.commands.append((parts[2], (body or {}).get('commands')))
+            return 200, {'success': True, 'result': True, 't': int(time.time() * 1000)}
+        return 200, {'success': False, 'code': 1108, 'msg': 'uri path invalid'}
+
+class AiStandIn(StandInService):
+    """PCのAIサーバーの代替: /predict (明るさでカーテン位置を決める), /ping, 学習データの受信"""
+
+    name = 'AI server'
+
+    def __init__(self, port=AI_PORT, latency_ms=AI_LATENCY_MS):
+        super().__init__(port, latency_ms)
+        self.training_records = 0
+
+    def route(self, method, path, body):
+        if path == '/ping':
+            return 200, {'status': 'ok'}
+        if path == '/predict':
+            lux = (body or {}).get('local_light_lux') or 0
+            return 200, {'predicted_label': min(4, int(lux // 8000))}
+        if path == '/add_training_data':
+            self.training_records += 1
+            return 200, {'status': 'success'}
+        if path == '/add_training_data_batch':
+            self.training_records += len((body or {}).get('records', []))
+            return 200, {'status': 'success'}
+        return 404, {'error': 'not found'}
+
+services = {
+    'switchbot': SwitchBotStandIn(),
+    'tuya': TuyaStandIn(),
+    'ai': AiStandIn(),
+}
+
+def start_services():
+    """すべての代替サーバーを起動する (起動済み・別プロセスで起動中のものはそのまま)"""
+    for service in services.values():
+        if service._server is None:
+            service.start()
+    return services
+
+def stop_services():
+    for service in services.values():
+        service.stop()
+
+
+# ==============================================================================
+# 7. cec-client の代わり (python sim_backend.py cec-client)
+# ==============================================================================
+class SimCecClient:
+    """
+    cec-client と同じ形式で標準入出力をやり取りする、プロジェクター (論理アドレス0) のシミュレーター
+    自分 (再生機器) の論理アドレスは1、物理アドレスは 1.0.0.0 とする
+    """
+
+    OWN_ADDRESS = 1
+    POWER_TEXT = {0x00: 'on', 0x01: 'standby', 0x02: 'in transition from standby to on',
+                  0x03: 'in transition from on to standby'}
+
+    def __init__(self, out=sys.stdout, latency_ms=CEC_LATENCY_MS, warmup_seconds=PROJECTOR_WARMUP_SECONDS,
+                 nack_rate=CEC_NACK_RATE):
+        self.out = out
+        self.latency_ms = latency_ms
+        self.warmup_seconds = warmup_seconds
+        self.nack_rate = nack_rate
+        self.started = time.monotonic()
+        self.power = 0x01 # スタンバイから始める
+        self.power_on_at = None
+        self._lock = threading.Lock()
+
+    def _emit(self, line):
+        with self._lock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def _traffic(self, direction, frame):
+        elapsed_ms = int((time.monotonic() - self.started) * 1000)
+        self._emit(f"TRAFFIC: [{elapsed_ms:8d}]\t{direction} " + ':'.join(f"{b:02x}" for b in frame))
+
+    def _current_power(self):
+        if self.power == 0x02 and time.monotonic() >= self.power_on_at:
+            self.power = 0x00 # 起動完了
+        return self.power
+
+    def _transmit(self, command, frame):
+        """
+        フレームを送信する (ACKされたらTrue)
+        libCEC と同じく、"<<" は送信キューに積んだ時点で出力し、NACKの場合はその後に失敗の行を出力する
+        """
+        self._traffic('<<', frame)
+        simulated_delay(self.latency_ms)
+        if random.random() < self.nack_rate:
+            elapsed_ms = int((time.monotonic() - self.started) * 1000)
+            self._emit(f"WARNING: [{elapsed_ms:8d}]\tcommand '{command}' was not acked by the controller")
+            return False
+        return True
+
+    def handle(self, line):
+        """1行のコマンドを処理する (終了の場合はFalse)"""
+        parts = line.split()
+        if not parts:
+            return True
+        name, args = parts[0].lower(), parts[1:]
+        own = self.OWN_ADDRESS << 4
+        if name == 'q':
+            return False
+        if name == 'pow' and args:
+            destination = int(args[0], 16)
+            if self._transmit(name, [own | destination, 0x8F]):
+                power = self._current_power()
+                self._traffic('>>', [(destination << 4) | self.OWN_ADDRESS, 0x90, power])
+                self._emit(f"power status: {self.POWER_TEXT[power]}")
+        elif name == 'on' and args:
+            if self._transmit(name, [own | int(args[0], 16), 0x04]) and self._current_power() != 0x00:
+                self.power = 0x02
+                self.power_on_at = time.monotonic() + self.warmup_seconds
+        elif name == 'standby' and args:
+            if self._transmit(name, [own | int(args[0], 16), 0x36]):
+                self.power = 0x01
+        elif name == 'as':
+            self._transmit(name, [own | 0x0F, 0x82, 0x10, 0x00])
+        elif name == 'tx' and args:
+            self._transmit(name, [int(b, 16) for b in args[0].split(':')])
+        else:
+            self._emit(f"unknown command: '{line.strip()}'")
+        return True
+
+    def run(self, stdin=sys.stdin):
+        self._emit("opening a connection to the CEC adapter...")
+        time.sleep(CEC_STARTUP_SECONDS)
+        self._emit("waiting for input")
+        for line in stdin:
+            if not self.handle(line.strip()):
+                break
+
+
+# ==============================================================================
+# 8. コマンドライン
+# ==============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="スマートホーム管理サーバーのシミュレーター")
+    parser.add_argument('mode', choices=['serve', 'cec-client'],
+                        help="serve: 代替HTTPサーバーを起動 / cec-client: cec-client の代わりとして動く")
+    parser.add_argument('cec_args', nargs='*', help=argparse.SUPPRESS) # cec-client のオプション (無視する)
+    args, _ = parser.parse_known_args()
+    if args.mode == 'cec-client':
+        SimCecClient().run()
+        return
+    start_services()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stop_services()
+
+if __name__ == '__main__':
+    main()
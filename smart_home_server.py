@@ -9,38 +9,92 @@ AIによる自動制御機能も含まれます。
 
 # --- 1. 標準ライブラリ・外部ライブラリのインポート ---
 import time
-import smbus2
+PROCESS_START = time.perf_counter() # 起動時間の計測の基準 (インポートにかかる時間も含める)
 import os
 from datetime import datetime
 import requests
+import urllib3 # 接続失敗の原因 (NewConnectionError) の判定用
 import json
 import subprocess
 import sys
 import threading # スレッド（並行処理）のために必要
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
 import logging
 import csv
+import io
+import gzip
+import queue
+import collections
+from collections.abc import Mapping
+from types import MappingProxyType
+import atexit
+import mmap # プロセス間で状態を共有するメモリ領域 (本番モード) 用
+import socket
+import struct
+import array # 操作ログ索引 (行位置の配列) 用
+import argparse # コマンドライン引数 (センサーログのインポート等)
 import re # 正規表現（天気情報の整形）のために必要
+import importlib # 重いライブラリの遅延読み込み用
+import hashlib # 音声キャッシュのファイル名 (読み上げ内容のハッシュ) 用
+from contextlib import contextmanager
 
-# GPIO (キーパッド、LED、ブザー)
-import RPi.GPIO as GPIO
-# I2C LCD (液晶ディスプレイ)
-from RPLCD.i2c import CharLCD
+class LazyModule:
+    """
+    最初に属性を使ったときに読み込まれるモジュール (起動を速くするため)
+    OpenCV・Pillow・gTTS など読み込みに時間がかかり、起動直後には使わないライブラリに使う。
+    読み込みにかかった時間は startup_timer に記録する。
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            started = time.perf_counter()
+            self._module = importlib.import_module(self._name) # 複数スレッドから呼ばれてもインポートは1回
+            startup_timer.record(f"import {self._name}", started)
+        return self._module
+
+    def __getattr__(self, attr):
+        value = getattr(self._load(), attr)
+        setattr(self, attr, value) # 2回目以降はモジュールを経由せずに使えるように
+        return value
+
+# ハードウェアのバックエンド: 'pi' (実機) / 'sim' (sim_backend.py のシミュレーター。Raspberry Pi なしで動かす)
+HARDWARE_BACKEND = os.environ.get('SMARTHOME_BACKEND', 'pi')
+if HARDWARE_BACKEND == 'sim':
+    import sim_backend
+    from sim_backend import GPIO, smbus2, CharLCD
+else:
+    # GPIO (キーパッド、LED、ブザー)
+    import RPi.GPIO as GPIO
+    # I2C (センサー)
+    import smbus2
+    # I2C LCD (液晶ディスプレイ)
+    from RPLCD.i2c import CharLCD
 # Flask (Webサーバー)
-from flask import Flask, jsonify, render_template_string, request, Response, render_template
+from flask import Flask, jsonify, render_template_string, request, Response, render_template, url_for
 from flask_cors import CORS
+from werkzeug.serving import make_server
+from werkzeug.middleware.proxy_fix import ProxyFix
+# NumPy (時系列ストア・操作ログ索引・ローカルモデル。起動時から使うので通常のインポート)
+import numpy as np
+# 以下は使うときに読み込む (LazyModule)
 # Tuya (カーテン制御)
-from tuya_connector import TuyaOpenAPI
+tuya_connector = sim_backend.tuya_connector if HARDWARE_BACKEND == 'sim' else LazyModule('tuya_connector')
 # gTTS (Google Text-to-Speech)
-from gtts import gTTS
-# pandas (ログ表示用)
-import pandas as pd
+gtts = LazyModule('gtts')
 # OpenCV & Pillow (カメラ映像処理・描画)
-import cv2
-import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+cv2 = LazyModule('cv2')
+Image = LazyModule('PIL.Image')
+ImageDraw = LazyModule('PIL.ImageDraw')
+ImageFont = LazyModule('PIL.ImageFont')
 # BeautifulSoup (天気情報スクレイピング)
-from bs4 import BeautifulSoup
+bs4 = LazyModule('bs4')
 import math # ログCSVファイルページ数計算用
+import html # ログ表示用のHTMLエスケープ
+from urllib.parse import urlencode, urlparse
 
 # ==============================================================================
 # 2. ユーザー設定・定数定義
@@ -68,6 +122,10 @@ BUZZER_PIN = 5      # ブザー
 RED_PIN = 17        # 赤色LED (ログ記録OFF時)
 GREEN_PIN = 27      # 緑色LED (ログ記録ON時)
 BLUE_LED_PIN = 24   # 青色LED (自動モード時)
+# キーパッドの読み取り設定
+KEYPAD_DEBOUNCE_MS = 30             # エッジ検出のチャタリング除去時間 (ミリ秒)
+KEYPAD_SETTLE_SECONDS = 0.01        # エッジ検出後、押下を確認するまでの待ち時間
+KEYPAD_POLL_INTERVAL_SECONDS = 0.02 # エッジ検出が使えない場合のポーリング間隔
 
 # --- 外部API・デバイスID---
 # SwitchBot (API v1.0)
@@ -89,20 +147,89 @@ TUYA_DPS_INDEX_CONTROL = 'percent_control' # カーテン位置制御用のDPS
 
 # HDMI-CEC (プロジェクター制御)
 PROJECTOR_CEC_DEVICE = 0 # プロジェクターのCECデバイス番号 (通常は0)
+CEC_CLIENT_COMMAND = ['cec-client', '-t', 'p', '-d', '11'] # 常駐させるcec-client (-d 11: エラー + 警告 + 通信内容。NACKの通知は警告で出る)
+CEC_POWER_QUERY_INTERVAL_SECONDS = 30 # 電源状態を問い合わせる間隔 (秒)
+CEC_STATUS_STALE_SECONDS = 120        # この秒数応答がなければ状態を "N/A" とする
+CEC_STARTUP_TIMEOUT_SECONDS = 15      # cec-client がアダプターを開いて入力待ちになるまでの待ち時間
+CEC_COMMAND_ACK_TIMEOUT_SECONDS = 2   # コマンド1回の送信 ("<<" の出力) を待つ時間
+CEC_TRANSMIT_RESULT_SECONDS = 0.5     # "<<" の後、送信失敗 (NACK) の出力がないか待つ時間 (出なければACKされたとみなす)
+CEC_COMMAND_MAX_ATTEMPTS = 3          # 送信に失敗した (NACK・タイムアウト) 場合の最大試行回数
+PROJECTOR_READY_TIMEOUT_SECONDS = 90  # プロジェクターがONを報告するまで待つ最長時間 (過ぎたらそのままHDMIを切り替える)
+PROJECTOR_READY_POLL_SECONDS = 2      # 起動待ちの間、電源状態を問い合わせる間隔
 
 # --- センサーログ設定 ---
-CSV_FILE_PATH = "combined_sensor_log.csv" # センサーデータ記録用CSV
+CSV_FILE_PATH = "combined_sensor_log.csv" # センサーデータ記録用CSV (旧形式。エクスポート・移行用)
+SENSOR_STORE_DIR = "sensor_store"         # センサーデータ記録用の時系列ストア (日ごとのバイナリファイル)
+SENSOR_LOG_CSV_MIRROR = False             # Trueなら時系列ストアと同時に従来のCSVにも追記する
 LOG_INTERVAL_SECONDS = 300 # 300秒 (5分) ごとに記録
-is_curtain_logging_paused = True # 起動時はモデル学習データ記録をOFFにする
+CURTAIN_LOGGING_PAUSED_AT_STARTUP = True # 起動時はモデル学習データ記録をOFFにする
 
 # --- 操作ログ設定 ---
 LOG_CSV_FILE = 'smart_home_actions.log.csv' # 操作履歴用CSV
+ACTION_LOG_FSYNC_POLICY = 'interval' # 操作ログのfsync方針 ('always' / 'interval' / 'never')
+ACTION_LOG_FSYNC_INTERVAL_SECONDS = 5 # 'interval' の場合にfsyncする最短間隔 (秒)
+
+# --- 音声案内 ---
+TTS_LANG = 'ja'                          # gTTSの言語
+TTS_CACHE_DIR = "tts_cache"              # 読み上げ音声 (mp3) のキャッシュ (ファイル名は内容のハッシュ)
+TTS_CACHE_MAX_BYTES = 20 * 1024 * 1024   # キャッシュの上限。超えたら最も長く使っていないものから削除する
+TTS_QUEUE_MAX = 8                        # 再生待ちの上限 (超えた案内は捨てる)
+AI_CURTAIN_ANNOUNCEMENT = "カーテンを{percent}パーセントの位置に自動制御します" # AI自動制御の音声案内
+# 起動時にキャッシュに用意しておく読み上げ (インターネットに接続できなくても再生できるように)
+TTS_PREWARM_PHRASES = [AI_CURTAIN_ANNOUNCEMENT.format(percent=p) for p in (0, 25, 50, 75, 100)]
 
 # --- AI自動制御 ---
 PC_AI_SERVER_URL = "http://192.168.113.10:10820/predict" 
 # 300秒 (5分) ごとにAI制御を実行
 AUTO_CONTROL_INTERVAL_SECONDS = 300  
 
+# --- Web UI のイベントストリーム (/events) ---
+UI_EVENTS_KEEPALIVE_SECONDS = 15  # 変化がないときにコメント行を送る間隔
+UI_EVENTS_RETRY_MS = 3000         # 切断時にブラウザが再接続するまでの時間
+AI_PREDICT_TIMEOUT_SECONDS = 5 # PCのAIサーバーの応答がこれより遅ければローカルモデルで判定する
+# ローカルモデル (PCに接続できない場合の代替。センサーログのカーテン位置から学習する)
+LOCAL_MODEL_PATH = "local_curtain_model.npz"
+LOCAL_MODEL_MIN_SAMPLES = 200        # 学習に必要な最小サンプル数
+LOCAL_MODEL_TRAIN_ITERATIONS = 500   # 勾配降下法の反復回数
+LOCAL_MODEL_REPORT_SAMPLES = 500     # --local-model-report でPCと比べるサンプル数
+# AI学習データの送信 (いったんスプールに保存し、まとめて送る)
+TRAINING_SPOOL_PATH = "training_spool.jsonl"
+TRAINING_BATCH_MAX_RECORDS = 500     # 1回のバッチ送信に含める最大件数
+TRAINING_BATCH_MIN_RECORDS = 12      # この件数 (5分ごとの記録で1時間分) 溜まったら送信する (再接続時は件数に関係なく送る)
+
+# --- HTTP通信 (SwitchBot・AIサーバー・天気情報) ---
+HTTP_POOL_MAXSIZE = 4               # ホストごとに保持するKeep-Alive接続の数
+HTTP_DEFAULT_TIMEOUT = (3, 10)      # (接続, 読み取り) タイムアウト (秒)
+HTTP_LAN_CONNECT_TIMEOUT = 2        # LAN内のホストへの接続タイムアウト (応答しなければすぐ諦める)
+HTTP_MAX_RETRIES = 2                # 再試行の最大回数
+HTTP_RETRY_BACKOFF_SECONDS = 0.5    # 再試行までの待ち時間 (回数ごとに2倍)
+HTTP_BREAKER_FAILURE_THRESHOLD = 3  # 連続してこの回数失敗したらホストへの送信を見合わせる
+HTTP_BREAKER_RESET_SECONDS = 30     # 見合わせてから再び試すまでの秒数
+# Tuya Cloud への接続 (起動を待たせないよう、バックグラウンドで接続できるまで再試行する)
+TUYA_CONNECT_RETRY_SECONDS = 5      # 接続に失敗したときの再試行までの待ち時間 (回数ごとに2倍)
+TUYA_CONNECT_RETRY_MAX_SECONDS = 300 # 再試行までの待ち時間の上限
+TUYA_COMMAND_WAIT_SECONDS = 10      # 接続前にコマンドが来た場合に、接続を待つ最長時間
+
+# --- Webサーバー ---
+WEB_PORT = 5000                     # Web UI・APIの待ち受けポート
+# 本番モード (--production): ハードウェアを操作するプロセスとは別に、Web用のワーカープロセスを起動する
+WEB_WORKERS = os.cpu_count() or 2   # ワーカープロセスの数 (各プロセスはスレッドで複数のリクエストを処理する)
+WEB_WORKER_NICE = 5                 # ワーカーの優先度を下げる値 (キーパッド・センサーのスレッドを優先する)
+WEB_WORKER_CHECK_SECONDS = 2        # ワーカーが終了していないか確認する間隔 (終了していたら起動し直す)
+HARDWARE_CONTROL_PORT = 5001        # ワーカーから転送された操作をハードウェアプロセスが受け付けるポート (127.0.0.1のみ)
+SHARED_STATE_PATH = "/dev/shm/smart_home_state" # 状態を共有するメモリ領域 (tmpfs上のファイルをmmapする)
+SHARED_STATE_SIZE = 64 * 1024       # 共有メモリ領域の大きさ (バイト)
+SHARED_STATE_POLL_SECONDS = 0.05    # ワーカーが共有メモリ領域の変化を確認する間隔
+
+# --- シミュレーター (SMARTHOME_BACKEND=sim) ---
+# 外部のサービス・cec-client の代わりに、sim_backend.py のローカルの代替サーバーを使う
+if HARDWARE_BACKEND == 'sim':
+    SWITCHBOT_BASE_URL = sim_backend.SWITCHBOT_BASE_URL
+    TUYA_API_ENDPOINT = sim_backend.TUYA_API_ENDPOINT
+    PC_AI_SERVER_URL = sim_backend.AI_PREDICT_URL
+    CEC_CLIENT_COMMAND = sim_backend.CEC_CLIENT_COMMAND
+    GPIO.configure_keypad(KEYPAD_ROW_PINS, KEYPAD_COL_PINS, KEYPAD_MAP)
+
 
 # ==============================================================================
 # 3. グローバル変数 (プログラム全体で共有する状態)
@@ -117,32 +244,393 @@ CORS(app)               # FlaskでCORS (クロスオリジンリクエスト) 
 # --- センサー・デバイスの状態 ---
 bme280_found = False    # BME280がI2Cバス上で見つかったか
 bh1750_found = False    # BH1750がI2Cバス上で見つかったか
-latest_sensor_data = {} # Web API配信用に最新のセンサーデータを保持
 weather_data = {        # 天気情報
     'text': '---',
     'high': '--',
     'low': '--'
 }
-current_curtain_state = {"state": "unknown", "position": "N/A"} # Tuyaカーテンの現在の状態
-current_projector_status = "不明" # プロジェクターの電源状態
-current_hdmi_input = "不明"     # プロジェクターのHDMI入力状態
+
+class StateSnapshot(Mapping):
+    """
+    StateStore のある時点の状態 (読み取り専用)
+    辞書と同じように snapshot['auto_mode'] で読める。version はスナップショットの版番号
+    """
+
+    def __init__(self, version, data, key_versions):
+        self.version = version
+        self._data = data
+        self._key_versions = key_versions # キーごとの「最後に値が変わった版番号」
+
+    def version_of(self, *keys):
+        """指定したキーのどれかが最後に変わった版番号 (これらのキーが変わらない限り同じ値)"""
+        return max(self._key_versions[key] for key in keys)
+
+    @property
+    def key_versions(self):
+        """キーごとの「最後に値が変わった版番号」(読み取り専用)"""
+        return MappingProxyType(self._key_versions)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f"StateSnapshot(version={self.version}, {self._data!r})"
+
+def freeze_state_value(value):
+    """状態に保存する値を変更できない形にする (辞書は読み取り専用のビューにコピーする)"""
+    if isinstance(value, dict):
+        return MappingProxyType(dict(value))
+    return value
+
+def thaw_state_value(value):
+    """freeze_state_value() した値を通常の辞書に戻す (JSONに変換する場合など)"""
+    if isinstance(value, MappingProxyType):
+        return dict(value)
+    return value
+
+class StateStore:
+    """
+    複数のスレッド (Flask・シーン・各ループ) で共有する状態の置き場所
+    
+    - snapshot() は一貫した状態 (変更できないスナップショット) を返す。読む側はロック不要
+    - update() は変更があった場合だけ版番号 (version) を1つ上げ、新しいスナップショットに差し替える
+    - subscribe() で、指定したキーが変わったときに呼ばれる関数を登録できる (LED・LCDの更新など)
+    - wait_for_change() で、版番号が変わるまで待てる (Web UI のイベントストリーム用)
+    """
+
+    def __init__(self, initial):
+        # 起動ごとに変わる識別子 (再起動で版番号が0に戻っても、前のプロセスの ETag と区別できるように)
+        self.epoch = f"{int(time.time()):x}"
+        self._cond = threading.Condition()
+        self._snapshot = StateSnapshot(0, {key: freeze_state_value(value) for key, value in initial.items()},
+                                       dict.fromkeys(initial, 0))
+        self._subscribers = [] # [(キーの集合 or None, 関数)]
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def snapshot(self):
+        """現在の状態のスナップショットを返す"""
+        return self._snapshot
+
+    def get(self, key):
+        """現在の状態から1つの値を返す"""
+        return self._snapshot[key]
+
+    def update(self, **changes):
+        """
+        状態を変更する (値が変わったキーがなければ何もしない)
+        
+        Returns:
+            (StateSnapshot, set): (変更後のスナップショット, 値が変わったキー)
+        """
+        with self._cond:
+            current = self._snapshot
+            changed = {key for key, value in changes.items()
+                       if key not in current or current[key] != freeze_state_value(value)}
+            if not changed:
+                return current, changed
+            version = current.version + 1
+            data = dict(current._data)
+            key_versions = dict(current._key_versions)
+            for key in changed:
+                data[key] = freeze_state_value(changes[key])
+                key_versions[key] = version
+            snapshot = self._snapshot = StateSnapshot(version, data, key_versions)
+            subscribers = [callback for keys, callback in self._subscribers if keys is None or keys & changed]
+            self._cond.notify_all()
+        # 通知はロックの外で (通知先が状態を読んだり変更したりできるように)
+        for callback in subscribers:
+            try:
+                callback(snapshot, changed)
+            except Exception as e:
+                print(f"[Error] State subscriber {getattr(callback, '__name__', callback)} failed: {e}")
+        return snapshot, changed
+
+    def subscribe(self, callback, keys=None):
+        """
+        状態が変わったときに callback(snapshot, changed_keys) を呼ぶように登録する
+        
+        Args:
+            callback (callable): 変更したスレッドで呼ばれる関数
+            keys (iterable, optional): このキーのどれかが変わったときだけ呼ぶ (省略時はすべての変更)
+        Returns:
+            callable: 登録を解除する関数
+        """
+        entry = (frozenset(keys) if keys is not None else None, callback)
+        with self._cond:
+            self._subscribers.append(entry)
+        def unsubscribe():
+            with self._cond:
+                if entry in self._subscribers:
+                    self._subscribers.remove(entry)
+        return unsubscribe
+
+    def wait_for_change(self, version, timeout=None):
+        """版番号が version から変わるまで待ち、その時点のスナップショットを返す (タイムアウトしたら現在のもの)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._snapshot.version != version, timeout)
+            return self._snapshot
+
+state_store = StateStore({
+    'curtain': {"state": "unknown", "position": "N/A"}, # Tuyaカーテンの現在の状態
+    'projector_status': "不明",        # プロジェクターの電源状態
+    'hdmi_input': "不明",              # プロジェクターのHDMI入力状態
+    'auto_mode': False,                # AI自動制御がONか
+    'ai_connected': False,             # AIサーバー(PC)と通信可能か
+    'logging_paused': CURTAIN_LOGGING_PAUSED_AT_STARTUP, # モデル学習データ記録がOFFか
+    'latest_sensor_data': {},          # Web API配信用に最新のセンサーデータを保持
+    'last_curtain_command': None,      # 最後に実行したカーテンシーン名 (AI制御のスキップ用)
+    'last_ai_control_time': 0,         # AI自動制御が最後に待機に入った時刻
+})
+
+class SharedStateSegment:
+    """
+    StateStore のスナップショットを、プロセス間で共有するメモリ領域 (/dev/shm 上のファイルをmmap) に書き出すクラス
+    
+    書き込むのはハードウェアを操作するプロセスだけで、Webのワーカープロセスは SharedStateReader で読むだけ。
+    seqlock 方式: 書き込み中はシーケンス番号を奇数にし、書き終えたら偶数にする。
+    読む側は前後でシーケンス番号が同じ偶数であることを確かめ、違えば読み直す (読む側はロック不要)。
+    
+    領域の形式 (リトルエンディアン):
+        ヘッダー (24バイト): マジック 'SHST', 形式バージョン(H), 予約(H), シーケンス番号(Q), 本文の長さ(I), 予約(4バイト)
+        本文: {"epoch", "version", "key_versions", "data"} のJSON (UTF-8)
+    """
+
+    MAGIC = b'SHST'
+    LAYOUT_VERSION = 1
+    HEADER = struct.Struct('<4sHHQI4x')
+    SEQ = struct.Struct('<Q')
+    SEQ_OFFSET = 8
+    LENGTH = struct.Struct('<I')
+    LENGTH_OFFSET = 16
+
+    def __init__(self, path=SHARED_STATE_PATH, size=SHARED_STATE_SIZE):
+        self.path = path
+        self.size = size
+        self._lock = threading.Lock()
+        self._mm = None
+        self._epoch = None
+        self._seq = 0
+        self._published_version = -1
+
+    def create(self, epoch):
+        """領域を作り直す (ハードウェアプロセスの起動時に1回だけ呼ぶ)"""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, self.size)
+            self._mm = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        self._epoch = epoch
+        self.HEADER.pack_into(self._mm, 0, self.MAGIC, self.LAYOUT_VERSION, 0, 0, 0)
+
+    def close(self):
+        """領域を閉じて削除する"""
+        with self._lock:
+            if self._mm is None:
+                return
+            self._mm.close()
+            self._mm = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def publish(self, snapshot, changed=None):
+        """スナップショットを書き出す (state_store.subscribe() にそのまま登録できる)"""
+        payload = json.dumps({
+            'epoch': self._epoch,
+            'version': snapshot.version,
+            'key_versions': dict(snapshot.key_versions),
+            'data': {key: thaw_state_value(value) for key, value in snapshot.items()},
+        }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if self.HEADER.size + len(payload) > self.size:
+            print(f"[Error] Shared state ({len(payload)} bytes) does not fit in '{self.path}'.")
+            return
+        with self._lock:
+            # 通知の順序が前後した場合に、古いスナップショットで上書きしない
+            if self._mm is None or snapshot.version <= self._published_version:
+                return
+            self._seq += 1 # 奇数: 書き込み中
+            self.SEQ.pack_into(self._mm, self.SEQ_OFFSET, self._seq)
+            self._mm[self.HEADER.size:self.HEADER.size + len(payload)] = payload
+            self.LENGTH.pack_into(self._mm, self.LENGTH_OFFSET, len(payload))
+            self._seq += 1 # 偶数: 書き込み完了
+            self.SEQ.pack_into(self._mm, self.SEQ_OFFSET, self._seq)
+            self._published_version = snapshot.version
+
+class SharedStateReader:
+    """
+    SharedStateSegment を読む側 (Webのワーカープロセス用)
+    StateStore と同じ snapshot() / get() / version / wait_for_change() を持つので、
+    ワーカーでは state_store をこれに置き換えるだけで /status や /events がそのまま動く
+    (状態の変更はハードウェアプロセスだけが行う)
+    """
+
+    def __init__(self, path=SHARED_STATE_PATH, poll_seconds=SHARED_STATE_POLL_SECONDS):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self.epoch = None
+        self._mm = None
+        self._seq = 0
+        self._snapshot = None
+        self._cond = threading.Condition()
+
+    def open(self, timeout=30):
+        """領域を開いて最初のスナップショットを読み、変化の監視を始める (領域が書き込まれるまで待つ)"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with open(self.path, 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if mm[:4] == SharedStateSegment.MAGIC and self._read_seq(mm) > 0:
+                    break
+                mm.close()
+            except (OSError, ValueError):
+                pass # まだ作られていない (ValueError: 空のファイル)
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Shared state '{self.path}' is not available.")
+            time.sleep(0.1)
+        self._mm = mm
+        self._check()
+        threading.Thread(target=self._watch_loop, daemon=True).start()
+
+    @staticmethod
+    def _read_seq(mm):
+        return SharedStateSegment.SEQ.unpack_from(mm, SharedStateSegment.SEQ_OFFSET)[0]
+
+    def _read(self):
+        """seqlock で一貫した本文を読み、(シーケンス番号, 本文) を返す"""
+        start = SharedStateSegment.HEADER.size
+        while True:
+            seq = self._read_seq(self._mm)
+            if seq % 2 == 0:
+                length = SharedStateSegment.LENGTH.unpack_from(self._mm, SharedStateSegment.LENGTH_OFFSET)[0]
+                payload = self._mm[start:start + length]
+                if self._read_seq(self._mm) == seq:
+                    return seq, payload
+            time.sleep(0) # 書き込み中なら他のスレッドに譲ってから読み直す
+
+    def _check(self):
+        """シーケンス番号が変わっていればスナップショットを作り直し、待っているスレッドに知らせる"""
+        if self._read_seq(self._mm) == self._seq:
+            return
+        seq, payload = self._read()
+        doc = json.loads(payload)
+        snapshot = StateSnapshot(doc['version'], {key: freeze_state_value(value) for key, value in doc['data'].items()},
+                                 doc['key_versions'])
+        with self._cond:
+            self.epoch = doc['epoch']
+            self._seq = seq
+            self._snapshot = snapshot
+            self._cond.notify_all()
+
+    def _watch_loop(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                self._check()
+            except Exception as e:
+                print(f"[Error] Failed to read shared state: {e}")
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def snapshot(self):
+        return self._snapshot
+
+    def get(self, key):
+        return self._snapshot[key]
+
+    def update(self, **changes):
+        raise RuntimeError("State can only be changed by the hardware process.")
+
+    def wait_for_change(self, version, timeout=None):
+        """版番号が version から変わるまで待ち、その時点のスナップショットを返す (タイムアウトしたら現在のもの)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._snapshot.version != version, timeout)
+            return self._snapshot
+
+shared_state_segment = SharedStateSegment() # 本番モードで、状態をワーカープロセスと共有する
+
+class StartupTimer:
+    """
+    起動処理の段階ごとの所要時間を記録し、まとめて表示するクラス
+    並行して行う段階もあるので、段階ごとに「起動からの開始時刻」と「所要時間」を記録する
+    """
+
+    def __init__(self, origin=PROCESS_START):
+        self.origin = origin
+        self._lock = threading.Lock()
+        self._phases = [] # [(名前, 開始 (起動からの秒), 所要秒)]
+
+    def record(self, name, started, finished=None):
+        """perf_counter() の started から finished (省略時は現在) までを1つの段階として記録する"""
+        finished = time.perf_counter() if finished is None else finished
+        with self._lock:
+            self._phases.append((name, started - self.origin, finished - started))
+
+    @contextmanager
+    def phase(self, name):
+        """with startup_timer.phase('名前'): で囲んだ処理の時間を記録する"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+    def timed(self, name, func, *args):
+        """func(*args) を実行し、その時間を記録する関数を返す (スレッドプールに渡す用)"""
+        def run():
+            with self.phase(name):
+                return func(*args)
+        return run
+
+    def mark(self, name):
+        """起動からこの時点までを1つの節目として記録する (キーパッドの受付開始など)"""
+        self.record(name, self.origin)
+
+    def report(self):
+        """記録した段階を終わった順に表示し、[(名前, 開始秒, 所要秒)] を返す"""
+        with self._lock:
+            phases = sorted(self._phases, key=lambda item: item[1] + item[2])
+        print("[Startup] ---- Startup timing (seconds since process start) ----")
+        for name, start, duration in phases:
+            print(f"[Startup] {start:7.3f} -> {start + duration:7.3f} ({duration:6.3f}s)  {name}")
+        print(f"[Startup] Total: {time.perf_counter() - self.origin:.3f}s")
+        return phases
+
+startup_timer = StartupTimer()
 
 # --- プログラムの内部状態 ---
-is_auto_mode = False        # AI自動制御がONか
-is_ai_connected = False     # AIサーバー(PC)と通信可能か
-last_curtain_position_command = None # 最後に実行したカーテンシーン名 (AI制御のスキップ用)
 connected_ips = set()       # Web UIに接続したクライアントIPのセット (ログ用)
 
 # --- スレッド制御フラグ ---
+i2c_sensor_lock = threading.Lock()          # I2Cセンサー読み取りの排他制御用
+lcd_lock = threading.Lock()                 # LCDへの書き込みの排他制御用 (複数スレッドから書くため)
+# ハブへの問い合わせをI2C読み取りと並行して行うためのスレッドプール
+sensor_io_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='sensor-io')
+# PCへの学習データ送信用 (1本のスレッドで順番に送る)
+training_upload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='training-upload')
 stop_blinking_flag = threading.Event()      # 赤色LEDの点滅停止用
 stop_blue_blinking_flag = threading.Event() # 青色LEDの点滅停止用
+# LEDの更新は1つずつ行う (状態の通知が前後して届いても、古い状態で点灯させたり点滅スレッドが2つ残ったりしないように)
+led_update_lock = threading.Lock()
+led_applied_versions = {'status': -1, 'auto_mode': -1} # LEDごとに、最後に反映した状態の版番号
+led_blink_threads = {'status': None, 'auto_mode': None} # LEDごとに、実行中の点滅スレッド
 
 # 最後のログ記録時刻をグローバルで管理
 last_log_time = 0
 
-# AI自動制御が最後に待機に入った時刻
-last_ai_control_time = 0
-
 # --- BME280用キャリブレーションデータ (起動時に読み込む) ---
 dig_T1, dig_T2, dig_T3 = 0, 0, 0
 dig_P1, dig_P2, dig_P3, dig_P4, dig_P5, dig_P6, dig_P7, dig_P8, dig_P9 = 0,0,0,0,0,0,0,0,0
@@ -153,9 +641,500 @@ t_fine = 0.0 # BME280の内部計算用
 # ==============================================================================
 # 4. ログ・音声案内 関数
 # ==============================================================================
+LOG_CSV_HEADER = ['日付', '時刻', '操作元', '種別', '詳細', 'IPアドレス'] # 操作ログのヘッダー行
+
+def format_csv_row(row):
+    """1行分のリストをCSV形式の文字列 (改行付き) に変換する"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(row)
+    return buffer.getvalue()
+
+class ActionLogIndex:
+    """
+    操作ログCSVの「行の開始バイト位置」の索引を、CSVの隣のファイル (.idx) に保持するクラス
+    
+    索引があれば、任意のページの行をファイル末尾側から必要なバイト範囲だけ
+    seekして読み出せるので、ファイルが大きくなってもページ表示の時間はほぼ一定になる。
+    各行の日付・操作元・種別も数値で持っているため、絞り込みもCSVを読まずに行える。
+    
+    .idx ファイルの形式 (リトルエンディアン):
+        ヘッダー (16バイト): マジック 'SHLI', バージョン(H), 予約(H), 索引済みのCSVサイズ(Q)
+        レコード (16バイト/行): 行の開始位置(Q), 日付YYYYMMDD(I), 操作元ID(H), 種別ID(H)
+    操作元・種別の文字列とIDの対応は .idx.json に保存する。
+    """
+
+    MAGIC = b'SHLI'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHHQ')
+    RECORD = struct.Struct('<QIHH')
+    RECORD_DTYPE = np.dtype([('offset', '<u8'), ('date', '<u4'), ('source', '<u2'), ('type', '<u2')])
+
+    def __init__(self, csv_path):
+        self.csv_path = csv_path
+        self.index_path = csv_path + '.idx'
+        self.vocab_path = csv_path + '.idx.json'
+        self._lock = threading.RLock()
+        self._loaded = False
+        self.read_only = False # Trueなら索引ファイルを書かない (本番モードのワーカープロセス用)
+        self._reset()
+
+    def _reset(self):
+        """メモリ上の索引を空にする"""
+        self._offsets = array.array('Q')    # 各行の開始バイト位置
+        self._dates = array.array('I')      # 各行の日付 (YYYYMMDD)
+        self._sources = array.array('H')    # 各行の操作元ID
+        self._types = array.array('H')      # 各行の種別ID
+        self._vocab = {'sources': [], 'types': []}
+        self._vocab_ids = {'sources': {}, 'types': {}}
+        self._indexed_end = 0               # 索引済みのCSVサイズ (バイト)
+        self._data_start = 0                # ヘッダー行の次の行の開始位置
+        self._vocab_dirty = False           # 対応表に未保存の追加があるか
+
+    # --- 索引の読み込み・再構築 ---
+    def ensure_loaded(self):
+        """索引を読み込み、CSVに追いついていなければ差分を取り込む"""
+        with self._lock:
+            if not self._loaded:
+                if not self._load_from_disk():
+                    self.rebuild()
+                self._loaded = True
+            self.refresh()
+
+    def _load_from_disk(self):
+        """保存済みの索引を読み込む。使えない場合はFalseを返す"""
+        try:
+            with open(self.vocab_path, 'r', encoding='utf-8') as f:
+                vocab = json.load(f)
+            with open(self.index_path, 'rb') as f:
+                raw = f.read()
+        except (OSError, ValueError):
+            return False
+        if len(raw) < self.HEADER.size:
+            return False
+        magic, version, _, indexed_end = self.HEADER.unpack_from(raw, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            return False
+        if not os.path.exists(self.csv_path) or os.path.getsize(self.csv_path) < indexed_end:
+            return False # CSVが作り直された・切り詰められた
+
+        self._reset()
+        body = raw[self.HEADER.size:]
+        count = len(body) // self.RECORD.size # 書きかけのレコードは捨てる
+        records = np.frombuffer(body, dtype=self.RECORD_DTYPE, count=count)
+        records = records[records['offset'] < indexed_end]
+        self._offsets.frombytes(records['offset'].tobytes())
+        self._dates.frombytes(records['date'].tobytes())
+        self._sources.frombytes(records['source'].tobytes())
+        self._types.frombytes(records['type'].tobytes())
+        self._vocab = {'sources': list(vocab.get('sources', [])), 'types': list(vocab.get('types', []))}
+        self._vocab_ids = {key: {name: i for i, name in enumerate(names)} for key, names in self._vocab.items()}
+        self._indexed_end = indexed_end
+        self._data_start = self._find_data_start()
+        if len(records) != len(body) / self.RECORD.size:
+            # 途中で落ちた場合の後始末として、索引ファイルをレコード数に合わせて書き直す
+            self._write_index_file()
+        return True
+
+    def rebuild(self):
+        """CSV全体を走査して索引を作り直す"""
+        with self._lock:
+            print(f"[Log] Building action log index for '{self.csv_path}'...")
+            self._reset()
+            self._data_start = self._find_data_start()
+            self._indexed_end = self._data_start
+            self._write_index_file()
+            self._save_vocab()
+            self.refresh()
+            print(f"[Log] Action log index ready ({len(self._offsets)} rows).")
+
+    def refresh(self):
+        """CSVが索引より大きくなっていれば (外部からの追記など)、増えた部分だけを索引に追加する"""
+        with self._lock:
+            if not os.path.exists(self.csv_path):
+                if self._indexed_end:
+                    self._reset()
+                    self._write_index_file()
+                return
+            size = os.path.getsize(self.csv_path)
+            if size < self._indexed_end:
+                self.rebuild() # 切り詰められた場合は作り直す
+            elif size > self._indexed_end:
+                self._scan_from(max(self._indexed_end, self._data_start))
+
+    def _find_data_start(self):
+        """ヘッダー行の次の行 (最初のデータ行) の開始位置を返す"""
+        try:
+            with open(self.csv_path, 'rb') as f:
+                f.readline()
+                return f.tell()
+        except OSError:
+            return 0
+
+    def _scan_from(self, start):
+        """start 以降の完全な行 (改行で終わる行) を索引に追加する"""
+        new_records = []
+        with open(self.csv_path, 'rb') as f:
+            f.seek(start)
+            offset = start
+            pending = b''           # 複数の物理行にまたがる行 (改行を含む値) の途中
+            pending_offset = start
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break # 書きかけの最終行は次回に回す
+                if not pending:
+                    pending_offset = offset
+                pending += line
+                offset += len(line)
+                # 引用符の数が奇数なら、値の途中で改行されているので次の物理行とつなげる
+                if pending.count(b'"') % 2:
+                    continue
+                new_records.append((pending_offset, pending))
+                pending = b''
+            indexed_end = pending_offset if pending else offset
+
+        for row_offset, raw in new_records:
+            self._add_record(row_offset, self._parse_row(raw))
+        if new_records or indexed_end != self._indexed_end:
+            self._append_index_records(len(new_records), indexed_end)
+
+    @staticmethod
+    def _parse_row(raw):
+        """CSVの1行 (バイト列) をリストに変換する"""
+        text = raw.decode('utf-8', errors='replace').lstrip('\ufeff')
+        rows = list(csv.reader(io.StringIO(text)))
+        return rows[0] if rows else []
+
+    @staticmethod
+    def _date_key(date_str):
+        """'2025/10/08' 形式の日付を 20251008 の整数に変換する (解析できなければ0)"""
+        try:
+            y, m, d = date_str.split('/')
+            return int(y) * 10000 + int(m) * 100 + int(d)
+        except (ValueError, AttributeError):
+            return 0
+
+    def _vocab_id(self, key, name):
+        """操作元・種別の文字列をIDに変換する (新しい文字列なら登録する)"""
+        ids = self._vocab_ids[key]
+        if name not in ids:
+            ids[name] = len(self._vocab[key])
+            self._vocab[key].append(name)
+            self._vocab_dirty = True
+        return ids[name]
+
+    def _add_record(self, offset, row):
+        """1行分のレコードをメモリ上の索引に追加する"""
+        row = (row + [''] * 6)[:6]
+        self._offsets.append(offset)
+        self._dates.append(self._date_key(row[0]))
+        self._sources.append(self._vocab_id('sources', row[2]))
+        self._types.append(self._vocab_id('types', row[3]))
+
+    # --- 索引ファイルへの保存 ---
+    def _write_index_file(self):
+        """メモリ上の索引全体で .idx ファイルを書き直す"""
+        if self.read_only:
+            return
+        tmp_path = self.index_path + '.tmp'
+        records = np.empty(len(self._offsets), dtype=self.RECORD_DTYPE)
+        records['offset'] = np.frombuffer(self._offsets, dtype=np.uint64)
+        records['date'] = np.frombuffer(self._dates, dtype=np.uint32)
+        records['source'] = np.frombuffer(self._sources, dtype=np.uint16)
+        records['type'] = np.frombuffer(self._types, dtype=np.uint16)
+        with open(tmp_path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, 0, self._indexed_end))
+            f.write(records.tobytes())
+        os.replace(tmp_path, self.index_path)
+
+    def _append_index_records(self, count, indexed_end):
+        """末尾に追加された count 件のレコードを .idx に追記し、ヘッダーの索引済みサイズを更新する"""
+        if self._vocab_dirty:
+            self._save_vocab()
+        self._indexed_end = indexed_end
+        if self.read_only:
+            return
+        try:
+            with open(self.index_path, 'r+b') as f:
+                f.seek(self.HEADER.size + (len(self._offsets) - count) * self.RECORD.size)
+                for i in range(len(self._offsets) - count, len(self._offsets)):
+                    f.write(self.RECORD.pack(self._offsets[i], self._dates[i], self._sources[i], self._types[i]))
+                f.truncate()
+                # レコードを書いてからヘッダーを更新する (途中で落ちても索引が壊れないように)
+                f.seek(0)
+                f.write(self.HEADER.pack(self.MAGIC, self.VERSION, 0, indexed_end))
+        except OSError:
+            self._write_index_file()
+
+    def _save_vocab(self):
+        """操作元・種別の対応表を .idx.json に保存する"""
+        if self.read_only:
+            return
+        tmp_path = self.vocab_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._vocab, f, ensure_ascii=False)
+        os.replace(tmp_path, self.vocab_path)
+        self._vocab_dirty = False
+
+    def record_appends(self, entries, end_offset):
+        """
+        CSVに行を追記した直後に呼び出し、それらの行を索引に追加する
+        
+        Args:
+            entries (list): (追記した行の開始バイト位置, 行) のリスト (追記順)
+            end_offset (int): 追記後のCSVサイズ
+        """
+        with self._lock:
+            if not entries:
+                return
+            if not self._loaded or entries[0][0] != self._indexed_end:
+                # 索引がまだ無い・別の書き込みと食い違う場合は差分走査で追いつく
+                self.ensure_loaded()
+                return
+            for offset, row in entries:
+                self._add_record(offset, row)
+            self._append_index_records(len(entries), end_offset)
+
+    def record_new_file(self, data_start):
+        """CSVを新規作成 (ヘッダー行のみ書き込み) した直後に呼び出す"""
+        with self._lock:
+            self._reset()
+            self._data_start = data_start
+            self._indexed_end = data_start
+            self._loaded = True
+            self._write_index_file()
+            self._save_vocab()
+
+    # --- 読み出し ---
+    @property
+    def row_count(self):
+        """索引済みの行数"""
+        with self._lock:
+            return len(self._offsets)
+
+    def choices(self):
+        """絞り込み用の選択肢 (操作元・種別の一覧) を返す"""
+        with self._lock:
+            return sorted(self._vocab['sources']), sorted(self._vocab['types'])
+
+    def read_header(self):
+        """CSVのヘッダー行を返す"""
+        try:
+            with open(self.csv_path, 'rb') as f:
+                return self._parse_row(f.readline()) or list(LOG_CSV_HEADER)
+        except OSError:
+            return list(LOG_CSV_HEADER)
+
+    def _matching_rows(self, source=None, action_type=None, date_from=None, date_to=None):
+        """条件に合う行番号 (古い順) を返す。条件がなければNone (全行)"""
+        if not (source or action_type or date_from or date_to):
+            return None
+        count = len(self._offsets)
+        mask = np.ones(count, dtype=bool)
+        if source:
+            source_id = self._vocab_ids['sources'].get(source)
+            if source_id is None:
+                return np.empty(0, dtype=np.int64)
+            mask &= np.frombuffer(self._sources, dtype=np.uint16, count=count) == source_id
+        if action_type:
+            type_id = self._vocab_ids['types'].get(action_type)
+            if type_id is None:
+                return np.empty(0, dtype=np.int64)
+            mask &= np.frombuffer(self._types, dtype=np.uint16, count=count) == type_id
+        if date_from or date_to:
+            dates = np.frombuffer(self._dates, dtype=np.uint32, count=count)
+            if date_from:
+                mask &= dates >= date_from
+            if date_to:
+                mask &= dates <= date_to
+        return np.nonzero(mask)[0]
+
+    def read_page(self, page, per_page, source=None, action_type=None, date_from=None, date_to=None):
+        """
+        新しい順に並べた時の page ページ目の行を返す
+        
+        Args:
+            page (int): ページ番号 (1始まり)
+            per_page (int): 1ページあたりの件数
+            source (str, optional): 操作元で絞り込み
+            action_type (str, optional): 種別で絞り込み
+            date_from (int, optional): この日付 (YYYYMMDD) 以降に絞り込み
+            date_to (int, optional): この日付 (YYYYMMDD) 以前に絞り込み
+        Returns:
+            (list, int): (行のリスト (新しい順), 条件に合う全件数)
+        """
+        self.ensure_loaded()
+        with self._lock:
+            matches = self._matching_rows(source, action_type, date_from, date_to)
+            total = len(self._offsets) if matches is None else len(matches)
+            # 新しい順で start 件目から per_page 件 = 古い順で [total-end, total-start)
+            start = (page - 1) * per_page
+            lo = max(total - start - per_page, 0)
+            hi = max(total - start, 0)
+            if matches is None:
+                row_numbers = range(lo, hi)
+            else:
+                row_numbers = matches[lo:hi].tolist()
+            spans = [(self._offsets[i],
+                      self._offsets[i + 1] if i + 1 < len(self._offsets) else self._indexed_end)
+                     for i in row_numbers]
+
+        # 連続した行はまとめて1回で読む (絞り込みなしなら1ページ1回のseek)
+        rows = []
+        with open(self.csv_path, 'rb') as f:
+            run_start, run_end = None, None
+            for span_start, span_end in spans + [(None, None)]:
+                if run_start is not None and span_start == run_end:
+                    run_end = span_end
+                    continue
+                if run_start is not None:
+                    f.seek(run_start)
+                    text = f.read(run_end - run_start).decode('utf-8', errors='replace')
+                    rows.extend(csv.reader(io.StringIO(text)))
+                run_start, run_end = span_start, span_end
+        rows.reverse()
+        return rows, total
+
+action_log_index = ActionLogIndex(LOG_CSV_FILE) # 操作ログの索引 (初回利用時に読み込む)
+
+class ActionLogWriter:
+    """
+    操作ログCSVへの書き込みを1本のバックグラウンドスレッドに集約するクラス
+    
+    log_action() はキューに積むだけで戻り、書き込みスレッドがキューに溜まった行を
+    まとめて1回の write で追記する (グループコミット)。書き込み手が1つなので、
+    複数スレッドの行が途中で混ざることはない。fsync の頻度は fsync_policy で選ぶ:
+        'always'   : バッチを書くたびに fsync (電源断に最も強い)
+        'interval' : 最後の fsync から fsync_interval 秒以上経っていたら fsync
+        'never'    : OSに任せる
+    """
+
+    _STOP = object() # 終了指示用の番兵
+
+    def __init__(self, csv_path, index, fsync_policy='interval', fsync_interval=5.0, max_batch=500):
+        self.csv_path = csv_path
+        self.index = index
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._file = None           # 開きっぱなしにする追記用ファイル
+        self._last_fsync = 0        # 最後に fsync した時刻
+        self._pending = []          # 書き込みに失敗して再試行待ちの行
+
+    def start(self):
+        """書き込みスレッドを起動する (起動済みなら何もしない)"""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ActionLogWriter', daemon=True)
+                self._thread.start()
+
+    def enqueue(self, row):
+        """1行をキューに積む (呼び出し側はファイルI/Oを待たない)"""
+        if self._thread is None:
+            self.start()
+        self._queue.put(row)
+
+    def flush(self):
+        """キューに積まれた行がすべて書き込まれるまで待つ"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def close(self, timeout=5.0):
+        """残りの行をすべて書き出してから書き込みスレッドを終了する"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        """キューから行を取り出し、まとめて追記するループ"""
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            # すでに溜まっている行をまとめて取り出す (最大 max_batch 行)
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            rows = [row for row in batch if row is not self._STOP]
+            stopping = len(rows) != len(batch)
+            try:
+                self._write_batch(self._pending + rows)
+                self._pending = []
+            except OSError as e:
+                print(f"[Error] Failed to write action log: {e}")
+                self._close_file()
+                # 次のバッチで再試行する (溜まりすぎたら古いものから捨てる)
+                self._pending = (self._pending + rows)[-10000:]
+                if not stopping:
+                    time.sleep(1)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        self._close_file(sync=True)
+
+    def _open_file(self):
+        """追記用にCSVを開く (なければヘッダー行付きで作成する)"""
+        # 開いているファイルが削除・移動されていたら開き直す
+        if self._file is not None and os.fstat(self._file.fileno()).st_nlink == 0:
+            self._close_file()
+        if self._file is None:
+            if not os.path.exists(self.csv_path):
+                # ファイルが存在しない場合は、ヘッダー行を先に書き込む (Excel用にBOM付きUTF-8)
+                with open(self.csv_path, 'wb') as f:
+                    f.write(format_csv_row(LOG_CSV_HEADER).encode('utf-8-sig'))
+                    self.index.record_new_file(f.tell())
+            self._file = open(self.csv_path, 'ab')
+        return self._file
+
+    def _close_file(self, sync=False):
+        """追記用ファイルを閉じる"""
+        if self._file is None:
+            return
+        try:
+            if sync and self.fsync_policy != 'never':
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self._file.close()
+        except OSError:
+            pass
+        self._file = None
+
+    def _write_batch(self, rows):
+        """複数行を1回の write で追記し、索引を更新する"""
+        if not rows:
+            return
+        f = self._open_file()
+        offset = f.tell()
+        entries = []
+        chunks = []
+        for row in rows:
+            data = format_csv_row(row).encode('utf-8')
+            entries.append((offset, row))
+            chunks.append(data)
+            offset += len(data)
+        f.write(b''.join(chunks))
+        f.flush()
+
+        now = time.time()
+        if self.fsync_policy == 'always' or (
+                self.fsync_policy == 'interval' and now - self._last_fsync >= self.fsync_interval):
+            os.fsync(f.fileno())
+            self._last_fsync = now
+        self.index.record_appends(entries, f.tell())
+
+action_log_writer = ActionLogWriter(LOG_CSV_FILE, action_log_index,
+                                    fsync_policy=ACTION_LOG_FSYNC_POLICY,
+                                    fsync_interval=ACTION_LOG_FSYNC_INTERVAL_SECONDS)
+atexit.register(action_log_writer.close) # 終了時にキューの残りを書き出す
+
 def log_action(source, action_type, details, ip_addr='--'):
     """
     操作ログをCSVファイル(LOG_CSV_FILE)に追記する関数
+    (実際の書き込みは action_log_writer のスレッドがまとめて行う)
     
     Args:
         source (str): 操作元 (例: "Web UI", "Keypad", "AI")
@@ -172,46 +1151,142 @@ def log_action(source, action_type, details, ip_addr='--'):
         details,                    # 詳細
         ip_addr                     # IPアドレス
     ]
+    # 書き込みキューに積むだけ (時刻はこの時点のものを記録する)
+    action_log_writer.enqueue(log_entry)
+
+class TtsAudioCache:
+    """
+    gTTS で作った読み上げ音声 (mp3) をディスクに保存しておくキャッシュ
     
-    # ファイルが存在しない場合は、ヘッダー行を先に書き込む
-    if not os.path.exists(LOG_CSV_FILE):
-        with open(LOG_CSV_FILE, 'w', newline='', encoding='utf-8-sig') as f:
-            writer = csv.writer(f)
-            writer.writerow(['日付', '時刻', '操作元', '種別', '詳細', 'IPアドレス'])
-    
-    # ログエントリーを追記モード ('a') で書き込む
-    with open(LOG_CSV_FILE, 'a', newline='', encoding='utf-8-sig') as f:
-        writer = csv.writer(f)
-        writer.writerow(log_entry)
+    ファイル名は「言語 + 読み上げ内容」のハッシュなので、同じ内容は2回目から通信なしで再生できる。
+    使うたびにファイルの更新時刻を新しくし、合計が max_bytes を超えたら更新時刻の古いもの
+    (最も長く使っていないもの) から削除する。
+    """
+
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES, lang=TTS_LANG):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lang = lang
+        self._lock = threading.Lock() # 音声の生成とキャッシュの削除を1つずつ行う
+
+    def path_for(self, text):
+        """読み上げ内容に対応するキャッシュファイルのパス"""
+        digest = hashlib.sha256(f"{self.lang}\0{text}".encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{digest}.mp3")
+
+    def get(self, text):
+        """
+        読み上げ音声のファイルを返す (キャッシュになければ gTTS で作って保存する)
+        
+        Returns:
+            str: mp3ファイルのパス
+        Raises:
+            Exception: キャッシュになく、gTTS での生成にも失敗した場合
+        """
+        path = self.path_for(text)
+        try:
+            os.utime(path) # 使った時刻を記録する (削除の順番に使う)
+            return path
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            if not os.path.exists(path): # 待っている間に他のスレッドが作った場合はそれを使う
+                os.makedirs(self.directory, exist_ok=True)
+                tmp_path = path + '.tmp'
+                gtts.gTTS(text=text, lang=self.lang).save(tmp_path)
+                os.replace(tmp_path, path) # 書きかけのファイルを再生しないように、完成してから置き換える
+                self._evict(keep=path)
+        return path
+
+    def _evict(self, keep=None):
+        """合計サイズが上限を超えていれば、最も長く使っていないファイルから削除する"""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.mp3'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def prewarm(self, phrases):
+        """よく使う読み上げを前もってキャッシュに用意する (バックグラウンドスレッド用)"""
+        for text in phrases:
+            try:
+                self.get(text)
+            except Exception as e:
+                print(f"[音声案内] キャッシュの準備に失敗しました ('{text}'): {e}")
+                return # 通信できない場合は残りも失敗するので、次の起動時に任せる
+        print(f"[音声案内] {len(phrases)} 件の案内音声を準備しました。")
+
+tts_cache = TtsAudioCache()
+
+class AnnouncementPlayer:
+    """
+    音声案内を1本のスレッドで順番に再生するクラス
+    案内が重なっても同時に鳴らず、受け付けた順に再生する (呼び出し側は再生の終了を待たない)
+    """
+
+    def __init__(self, cache, max_pending=TTS_QUEUE_MAX):
+        self.cache = cache
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """再生スレッドを起動する (起動済みなら何もしない)"""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='AnnouncementPlayer', daemon=True)
+                self._thread.start()
+
+    def say(self, text):
+        """案内を再生待ちに加える。待ちが一杯ならFalseを返す (その案内は再生しない)"""
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(text)
+            return True
+        except queue.Full:
+            print(f"[音声案内] 再生待ちが一杯のため、案内を省略します: '{text}'")
+            return False
+
+    def _run(self):
+        while True:
+            text = self._queue.get()
+            try:
+                path = self.cache.get(text)
+                # mpg123コマンドを使って再生 (-q オプションで余計な情報を非表示に)
+                # check=Trueでコマンドが失敗したら例外を発生させる
+                subprocess.run(["mpg123", "-q", path], check=True)
+            except Exception as e:
+                # gTTS APIエラーやmpg123コマンドが見つからない場合など
+                print(f"[エラー] 音声の読み上げに失敗しました: {e}")
+            finally:
+                self._queue.task_done()
+
+announcement_player = AnnouncementPlayer(tts_cache)
 
 def speak_message(text):
     """
-    指定されたテキストをgTTSとmpg123を使って音声で読み上げる関数
+    指定されたテキストを音声で読み上げる (再生待ちに加えるだけで、すぐに戻る)
+    音声はキャッシュにあればそれを使い、なければ gTTS で作ってキャッシュに保存する
     
     Args:
         text (str): 読み上げる日本語テキスト
     """
-    try:
-        # 読み上げる内容をコンソールにも表示
-        print(f"[音声案内] アナウンス内容: '{text}'")
-        
-        # gTTSオブジェクトを作成 (lang='ja'で日本語に設定)
-        tts = gTTS(text=text, lang='ja')
-        
-        # 音声データを一時ファイル (temp_speech.mp3) として保存
-        temp_file = "temp_speech.mp3"
-        tts.save(temp_file)
-        
-        # mpg123コマンドを使って再生 (-q オプションで余計な情報を非表示に)
-        # check=Trueでコマンドが失敗したら例外を発生させる
-        subprocess.run(["mpg123", "-q", temp_file], check=True)
-        
-        # 再生が終わったら一時ファイルを削除
-        os.remove(temp_file)
-        
-    except Exception as e:
-        # gTTS APIエラーやmpg123コマンドが見つからない場合など
-        print(f"[エラー] 音声の読み上げに失敗しました: {e}")
+    # 読み上げる内容をコンソールにも表示
+    print(f"[音声案内] アナウンス内容: '{text}'")
+    announcement_player.say(text)
 
 
 # ==============================================================================
@@ -222,7 +1297,7 @@ def init_tuya_api():
     global openapi # グローバル変数のopenapiインスタンスを更新
     try:
         # TuyaOpenAPIオブジェクトを生成
-        openapi = TuyaOpenAPI(TUYA_API_ENDPOINT, TUYA_ACCESS_ID, TUYA_ACCESS_KEY)
+        openapi = tuya_connector.TuyaOpenAPI(TUYA_API_ENDPOINT, TUYA_ACCESS_ID, TUYA_ACCESS_KEY)
         # 接続（認証）を実行
         response = openapi.connect()
         
@@ -239,6 +1314,45 @@ def init_tuya_api():
         print(f"[ERROR] Exception during Tuya Cloud API connection: {e}")
         return False
 
+tuya_ready = threading.Event() # Tuya Cloud APIに接続済みか
+
+def tuya_connect_loop():
+    """
+    Tuya Cloud APIに接続できるまで、バックグラウンドで再試行するスレッド
+    (クラウドへの接続は時間がかかり、失敗することもあるので、起動やキーパッドの受付を待たせない)
+    """
+    delay = TUYA_CONNECT_RETRY_SECONDS
+    attempt = 1
+    while True:
+        with startup_timer.phase(f"tuya connect (attempt {attempt})"):
+            connected = init_tuya_api()
+        if connected:
+            tuya_ready.set()
+            return
+        print(f"[Init] Retrying Tuya Cloud API connection in {delay}s...")
+        time.sleep(delay)
+        delay = min(delay * 2, TUYA_CONNECT_RETRY_MAX_SECONDS)
+        attempt += 1
+
+def init_camera():
+    """カメラを開き、解像度を設定する (開けなかった場合は camera を None にする)"""
+    global camera
+    print("[Init] Initializing Camera...")
+    if HARDWARE_BACKEND == 'sim':
+        capture = sim_backend.SimVideoCapture(0) # 合成した映像を返すカメラ
+    else:
+        capture = cv2.VideoCapture(0) # デバイス0番のカメラを開く
+    if not capture.isOpened():
+        print("[CRITICAL] Failed to open camera.") # 開けなかった場合
+        capture.release()
+        return False
+    # カメラの解像度を16:9 (1280x720) に設定
+    capture.set(cv2.CAP_PROP_FRAME_WIDTH, VIDEO_FRAME_WIDTH)
+    capture.set(cv2.CAP_PROP_FRAME_HEIGHT, VIDEO_FRAME_HEIGHT)
+    camera = capture
+    print(f"[Init] Camera initialized successfully ({VIDEO_FRAME_WIDTH}x{VIDEO_FRAME_HEIGHT}).")
+    return True
+
 def init_i2c():
     """I2CバスとLCD(液晶ディスプレイ)、BH1750(照度)を初期化する"""
     global bus, lcd, bh1750_found # グローバル変数を更新
@@ -354,6 +1468,232 @@ def setup_bme280():
 # ==============================================================================
 # 6. センサー・デバイス読み取り関数
 # ==============================================================================
+# --- 共有HTTPクライアント (ホストごとの接続プール・リトライ・サーキットブレーカー・レイテンシ計測) ---
+HTTP_LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000) # レイテンシ集計の区切り (ミリ秒)
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """サーキットブレーカーが開いている (ホストが応答しない) ため、リクエストを送らなかったことを表す例外"""
+
+class LatencyHistogram:
+    """エンドポイントごとのレイテンシを固定の区切りで数えるヒストグラム"""
+
+    def __init__(self, bounds_ms=HTTP_LATENCY_BUCKETS_MS):
+        self.bounds_ms = bounds_ms
+        self.counts = [0] * (len(bounds_ms) + 1) # 最後は上限超え
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms, ok=True):
+        """1回分のレイテンシを記録する"""
+        index = len(self.bounds_ms)
+        for i, bound in enumerate(self.bounds_ms):
+            if elapsed_ms <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if not ok:
+            self.errors += 1
+
+    def percentile(self, p):
+        """p (0〜100) パーセンタイルが含まれる区切りの上限 (ミリ秒) を返す"""
+        if self.count == 0:
+            return None
+        target = self.count * p / 100
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return self.bounds_ms[i] if i < len(self.bounds_ms) else round(self.max_ms, 1)
+        return round(self.max_ms, 1)
+
+    def snapshot(self):
+        buckets = {f"le_{b}ms": c for b, c in zip(self.bounds_ms, self.counts)}
+        buckets['inf'] = self.counts[-1]
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': round(self.total_ms / self.count, 1) if self.count else None,
+            'max_ms': round(self.max_ms, 1),
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'buckets': buckets,
+        }
+
+class CircuitBreaker:
+    """
+    ホストごとのサーキットブレーカー
+    連続して failure_threshold 回失敗したら開き、reset_seconds の間はリクエストを送らない。
+    その後は1回だけ試し (half-open)、成功すれば閉じ、失敗すればまた開く。
+    """
+
+    def __init__(self, failure_threshold=HTTP_BREAKER_FAILURE_THRESHOLD, reset_seconds=HTTP_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """リクエストを送ってよいか"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half-open' # 試しに1回だけ通す
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half-open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+class HttpClient:
+    """
+    SwitchBot・AIサーバー・天気情報で共有するHTTPクライアント
+    
+    - ホストごとに requests.Session を持ち、Keep-Aliveで接続を使い回す
+    - 接続できなかった場合 (リクエストが届いていない) は指数バックオフで再試行する。
+      タイムアウトや5xxは、二重実行しても問題ない (idempotent) リクエストだけ再試行する
+    - ホストごとのサーキットブレーカーで、応答しないホストにはタイムアウトを待たずに CircuitOpenError を返す
+    - エンドポイント名ごとにレイテンシのヒストグラムを記録する
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._breakers = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def _host_key(self, url):
+        parsed = urlparse(url)
+        return f"{parsed.scheme}://{parsed.netloc}"
+
+    def _session_for(self, host):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=0)
+                session.mount(host, adapter)
+                self._sessions[host] = session
+                self._breakers[host] = CircuitBreaker()
+            return session, self._breakers[host]
+
+    @staticmethod
+    def _not_connected(e):
+        """
+        接続自体ができなかった (リクエストが相手に届いていない) 例外かどうかを返す
+        
+        ConnectTimeout か、原因をたどって urllib3 の NewConnectionError に行き着く ConnectionError だけをTrueとする。
+        接続後の切断や読み取りタイムアウトは、相手が処理済みの可能性があるのでFalse
+        """
+        if isinstance(e, requests.exceptions.ConnectTimeout):
+            return True
+        if not isinstance(e, requests.exceptions.ConnectionError) or isinstance(e, requests.exceptions.ReadTimeout):
+            return False
+        # requests.ConnectionError -> urllib3.MaxRetryError (.reason) -> NewConnectionError の順に包まれている
+        seen = set()
+        pending = [e]
+        while pending:
+            cause = pending.pop()
+            if cause is None or id(cause) in seen:
+                continue
+            seen.add(id(cause))
+            if isinstance(cause, urllib3.exceptions.NewConnectionError):
+                return True
+            pending.append(getattr(cause, 'reason', None))
+            pending.append(cause.__cause__)
+            pending.extend(arg for arg in getattr(cause, 'args', ()) if isinstance(arg, BaseException))
+        return False
+
+    def _observe(self, endpoint, elapsed_ms, ok):
+        with self._lock:
+            histogram = self._histograms.get(endpoint)
+            if histogram is None:
+                histogram = self._histograms[endpoint] = LatencyHistogram()
+            histogram.observe(elapsed_ms, ok)
+
+    def request(self, endpoint, method, url, timeout=HTTP_DEFAULT_TIMEOUT, retries=HTTP_MAX_RETRIES,
+                idempotent=None, **kwargs):
+        """
+        HTTPリクエストを送る
+        
+        Args:
+            endpoint (str): レイテンシ集計用の名前 (例: 'ai.predict')
+            method (str): 'GET' / 'POST'
+            url (str): 送信先URL
+            timeout: requests と同じ形式のタイムアウト ((接続, 読み取り) のタプルも可)
+            retries (int): 再試行の最大回数
+            idempotent (bool, optional): Trueならタイムアウトや5xxでも再試行する (省略時はGETのみTrue)
+        Returns:
+            requests.Response
+        Raises:
+            CircuitOpenError: ホストへの送信を見合わせている場合
+            requests.exceptions.RequestException: 通信に失敗した場合
+        """
+        if idempotent is None:
+            idempotent = method.upper() == 'GET'
+        host = self._host_key(url)
+        session, breaker = self._session_for(host)
+
+        for attempt in range(retries + 1):
+            if not breaker.allow():
+                self._observe(endpoint, 0.0, ok=False)
+                raise CircuitOpenError(f"Circuit open for {host}; request to {endpoint} skipped.")
+            started = time.monotonic()
+            try:
+                response = session.request(method, url, timeout=timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._observe(endpoint, (time.monotonic() - started) * 1000, ok=False)
+                breaker.record_failure()
+                # 接続自体ができなかった場合は、リクエストが届いていないので再送しても安全
+                # (接続後の切断などは相手が処理済みかもしれないので、idempotent なリクエストだけ再試行する)
+                if attempt >= retries or not (idempotent or self._not_connected(e)):
+                    raise
+            else:
+                elapsed_ms = (time.monotonic() - started) * 1000
+                if response.status_code >= 500:
+                    self._observe(endpoint, elapsed_ms, ok=False)
+                    breaker.record_failure()
+                    if attempt >= retries or not idempotent:
+                        return response # 呼び出し側の raise_for_status() に任せる
+                else:
+                    self._observe(endpoint, elapsed_ms, ok=True)
+                    breaker.record_success()
+                    return response
+            time.sleep(HTTP_RETRY_BACKOFF_SECONDS * (2 ** attempt)) # 0.5秒, 1秒, 2秒...
+
+    def get(self, endpoint, url, **kwargs):
+        return self.request(endpoint, 'GET', url, **kwargs)
+
+    def post(self, endpoint, url, **kwargs):
+        return self.request(endpoint, 'POST', url, **kwargs)
+
+    def stats(self):
+        """エンドポイントごとのレイテンシと、ホストごとのサーキットブレーカーの状態を返す"""
+        with self._lock:
+            return {
+                'endpoints': {name: h.snapshot() for name, h in sorted(self._histograms.items())},
+                'hosts': {host: {'state': b.state, 'consecutive_failures': b.failures}
+                          for host, b in sorted(self._breakers.items())},
+            }
+
+http_client = HttpClient()
+
 def read_bme280():
     """
     BME280から温湿度・気圧を読み取り、補正計算して返す
@@ -363,54 +1703,55 @@ def read_bme280():
     """
     global t_fine
     if not bme280_found: return None, None, None # センサーが見つからなければNone
-    try:
-        # センサーデータレジスタ (0xF7〜0xFE) から8バイト一括読み取り
-        data = bus.read_i2c_block_data(BME280_ADDRESS, 0xF7, 8)
+    with i2c_sensor_lock: # 複数スレッドからの同時読み取り (t_fineの競合) を防ぐ
+        try:
+            # センサーデータレジスタ (0xF7〜0xFE) から8バイト一括読み取り
+            data = bus.read_i2c_block_data(BME280_ADDRESS, 0xF7, 8)
+            
+            # 8バイトのデータを気圧・温度・湿度のADC(生)値に分割
+            adc_P = (data[0] << 12) | (data[1] << 4) | (data[2] >> 4)
+            adc_T = (data[3] << 12) | (data[4] << 4) | (data[5] >> 4)
+            adc_H = (data[6] << 8) | data[7]
+
+            # --- 温度の補正計算 (データシート参照) ---
+            v1 = (adc_T / 16384.0 - dig_T1 / 1024.0) * dig_T2
+            v2 = ((adc_T / 131072.0 - dig_T1 / 8192.0) ** 2) * dig_T3
+            t_fine = v1 + v2 # t_fineは気圧と湿度の計算にも使われる
+            temperature = t_fine / 5120.0
+
+            # --- 気圧の補正計算 (データシート参照) ---
+            var1 = (t_fine / 2.0) - 64000.0
+            var2 = var1 * var1 * dig_P6 / 32768.0
+            var2 = var2 + var1 * dig_P5 * 2.0
+            var2 = (var2 / 4.0) + (dig_P4 * 65536.0)
+            var1 = (dig_P3 * var1 * var1 / 524288.0 + dig_P2 * var1) / 524288.0
+            var1 = (1.0 + var1 / 32768.0) * dig_P1
+            pressure = 0
+            if var1 != 0:
+                p = 1048576.0 - adc_P
+                p = (p - (var2 / 4096.0)) * 6250.0 / var1
+                var1 = dig_P9 * p * p / 2147483648.0
+                var2 = p * dig_P8 / 32768.0
+                p = p + (var1 + var2 + dig_P7) / 16.0
+                pressure = p / 100 # hPaに変換
+
+            # --- 湿度の補正計算 (データシート参照) ---
+            h = t_fine - 76800.0
+            h = (adc_H - (dig_H4 * 64.0 + dig_H5 / 16384.0 * h)) * \
+                (dig_H2 / 65536.0 * (1.0 + dig_H6 / 67108864.0 * h * \
+                (1.0 + dig_H3 / 67108864.0 * h)))
+            h = h * (1.0 - dig_H1 * h / 524288.0)
+
+            if h > 100: h = 100 # 0-100%の範囲に丸める
+            elif h < 0: h = 0
+            humidity = h
+
+            return temperature, humidity, pressure
         
-        # 8バイトのデータを気圧・温度・湿度のADC(生)値に分割
-        adc_P = (data[0] << 12) | (data[1] << 4) | (data[2] >> 4)
-        adc_T = (data[3] << 12) | (data[4] << 4) | (data[5] >> 4)
-        adc_H = (data[6] << 8) | data[7]
-
-        # --- 温度の補正計算 (データシート参照) ---
-        v1 = (adc_T / 16384.0 - dig_T1 / 1024.0) * dig_T2
-        v2 = ((adc_T / 131072.0 - dig_T1 / 8192.0) ** 2) * dig_T3
-        t_fine = v1 + v2 # t_fineは気圧と湿度の計算にも使われる
-        temperature = t_fine / 5120.0
-
-        # --- 気圧の補正計算 (データシート参照) ---
-        var1 = (t_fine / 2.0) - 64000.0
-        var2 = var1 * var1 * dig_P6 / 32768.0
-        var2 = var2 + var1 * dig_P5 * 2.0
-        var2 = (var2 / 4.0) + (dig_P4 * 65536.0)
-        var1 = (dig_P3 * var1 * var1 / 524288.0 + dig_P2 * var1) / 524288.0
-        var1 = (1.0 + var1 / 32768.0) * dig_P1
-        pressure = 0
-        if var1 != 0:
-            p = 1048576.0 - adc_P
-            p = (p - (var2 / 4096.0)) * 6250.0 / var1
-            var1 = dig_P9 * p * p / 2147483648.0
-            var2 = p * dig_P8 / 32768.0
-            p = p + (var1 + var2 + dig_P7) / 16.0
-            pressure = p / 100 # hPaに変換
-
-        # --- 湿度の補正計算 (データシート参照) ---
-        h = t_fine - 76800.0
-        h = (adc_H - (dig_H4 * 64.0 + dig_H5 / 16384.0 * h)) * \
-            (dig_H2 / 65536.0 * (1.0 + dig_H6 / 67108864.0 * h * \
-            (1.0 + dig_H3 / 67108864.0 * h)))
-        h = h * (1.0 - dig_H1 * h / 524288.0)
-
-        if h > 100: h = 100 # 0-100%の範囲に丸める
-        elif h < 0: h = 0
-        humidity = h
-
-        return temperature, humidity, pressure
-    
-    except Exception as e:
-        # 読み取り中のI2Cエラー
-        print(f"[Error] Failed to read from BME280: {e}")
-        return None, None, None
+        except Exception as e:
+            # 読み取り中のI2Cエラー
+            print(f"[Error] Failed to read from BME280: {e}")
+            return None, None, None
 
 def read_bh1750():
     """
@@ -420,14 +1761,15 @@ def read_bh1750():
         float or None: 照度(lux)
     """
     if not bh1750_found: return None # センサーが見つからなければNone
-    try:
-        # 高解像度モード (0x20) で2バイト読み取り
-        data = bus.read_i2c_block_data(BH1750_ADDRESS, 0x20, 2)
-        # 2バイトを結合し、係数(1.2)で割ってluxに変換
-        return (data[0] << 8 | data[1]) / 1.2
-    except Exception as e:
-        print(f"[Error] Failed to read from BH1750: {e}")
-        return None
+    with i2c_sensor_lock: # 複数スレッドからの同時読み取りを防ぐ
+        try:
+            # 高解像度モード (0x20) で2バイト読み取り
+            data = bus.read_i2c_block_data(BH1750_ADDRESS, 0x20, 2)
+            # 2バイトを結合し、係数(1.2)で割ってluxに変換
+            return (data[0] << 8 | data[1]) / 1.2
+        except Exception as e:
+            print(f"[Error] Failed to read from BH1750: {e}")
+            return None
 
 def get_hub_status():
     """SwitchBot API (v1.0) にアクセスし、ハブミニの温湿度・照度を取得"""
@@ -439,7 +1781,8 @@ def get_hub_status():
         "deviceId": HUB_DEVICE_ID
     }
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=10)
+        response = http_client.post('switchbot.status', url, headers=headers, data=json.dumps(payload),
+                                    timeout=(HTTP_LAN_CONNECT_TIMEOUT, 10), idempotent=True)
         response.raise_for_status() # 200 OK 以外は例外を発生
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -451,38 +1794,359 @@ def get_tuya_curtain_status():
     Tuyaカーテンの状態を返す (内部で記憶している状態を返すのみ)
     ※API制限を避けるため、実際のAPIアクセスは制御時にのみ行う
     """
-    return current_curtain_state
+    return state_store.get('curtain')
+
+CEC_POWER_STATUS_NAMES = {0x00: "ON", 0x01: "OFF", 0x02: "ON", 0x03: "OFF"} # 0x02/0x03 は切替中 (切替先の状態として扱う)
+CEC_POWER_TEXT_CODES = {
+    "on": 0x00,
+    "standby": 0x01,
+    "in transition from standby to on": 0x02,
+    "in transition from on to standby": 0x03,
+}
+CEC_TRAFFIC_PATTERN = re.compile(r'(>>|<<)\s+([0-9a-fA-F]{2}(?::[0-9a-fA-F]{2})*)')
+CEC_POWER_TEXT_PATTERN = re.compile(r'power status:\s*(.+?)\s*$')
+CEC_READY_PATTERN = re.compile(r'waiting for input', re.IGNORECASE)
+CEC_FAILURE_PATTERN = re.compile(r'not acked|transmit failed|command failed|failed to send', re.IGNORECASE)
+
+def parse_cec_expectation(command_str):
+    """
+    cec-client のコマンドから、送信したときに出力される "<<" フレームの条件を作る
+    
+    Args:
+        command_str (str): 例 "tx 1F:82:20:00", "on 0", "standby 0", "as", "pow 0"
+    Returns:
+        tuple or None: (宛先の論理アドレス, オペコード, パラメータ) / 判定できないコマンドはNone
+    """
+    parts = command_str.split()
+    if not parts:
+        return None
+    name, args = parts[0].lower(), parts[1:]
+    try:
+        if name == 'tx' and args:
+            frame = [int(b, 16) for b in args[0].split(':')]
+            if len(frame) < 2:
+                return None
+            return (frame[0] & 0x0F, frame[1], tuple(frame[2:]))
+        if name == 'on' and args:
+            return (int(args[0], 16), 0x04, ())
+        if name == 'standby' and args:
+            return (int(args[0], 16), 0x36, ())
+        if name == 'pow' and args:
+            return (int(args[0], 16), 0x8F, ())
+        if name == 'as':
+            return (0x0F, 0x82, ())
+    except ValueError:
+        return None
+    return None
+
+class CecMonitor:
+    """
+    常駐させた1つの cec-client からHDMI-CECの通信を読み取り、プロジェクターの状態を保持する
+    
+    cec-client の TRAFFIC 出力 (">> 01:90:00" のような行) を解析し、
+    電源状態の通知 (Report Power Status: 0x90) やスタンバイ (0x36)、
+    アクティブソースの通知 (0x82, 0x80, 0x81) をキャッシュに反映する。
+    LCDや /status はこのキャッシュを読むだけで、プロセスを起動することはない。
+    """
+
+    def __init__(self, command=CEC_CLIENT_COMMAND):
+        self.command = command
+        self.process = None
+        self._lock = threading.Lock()
+        self.power_code = None            # 最後に観測した電源状態 (CECの値 0x00〜0x03)
+        self.power_updated_at = 0         # power_code を更新した時刻 (time.monotonic)
+        self.active_source_address = None # 最後に観測したアクティブソースの物理アドレス (例: "20:00")
+        self.last_error = None            # 起動失敗などの理由
+        self.ready = threading.Event()    # cec-client がアダプターを開き、入力待ちになったらセット
+        self._command_lock = threading.Lock() # 送信確認を待つコマンドは1つずつ
+        self._pending = None              # 送信確認待ちのコマンド {'expect', 'event', 'result'}
+        self._power_cond = threading.Condition() # 電源状態が更新されたら通知
+        self.warmup_history = collections.deque(maxlen=50) # 起動にかかった時間の記録 [(時刻, 秒数 or None)]
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """cec-client を起動し、出力を読むスレッドを開始する (起動済みなら何もしない)"""
+        with self._lock:
+            if self.is_running():
+                return True
+            try:
+                self.process = subprocess.Popen(
+                    self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT, text=True, bufsize=1)
+            except OSError as e:
+                self.process = None
+                self.last_error = str(e)
+                print(f"[Error] Failed to start cec-client: {e}")
+                return False
+            self.last_error = None
+            self.ready.clear()
+            process = self.process
+        print(f"[CEC] Monitor session started (pid {process.pid}).")
+        threading.Thread(target=self._read_loop, args=(process,), name='CecMonitor', daemon=True).start()
+        return True
+
+    def stop(self):
+        """cec-client を終了する"""
+        with self._lock:
+            process, self.process = self.process, None
+        if process and process.poll() is None:
+            try:
+                process.stdin.write("q\n")
+                process.stdin.flush()
+                process.wait(timeout=3)
+            except Exception:
+                process.kill()
+
+    def _write(self, line):
+        """cec-client の標準入力に1行書き込む"""
+        with self._lock:
+            process = self.process
+            if process is None or process.poll() is not None:
+                return False
+            try:
+                process.stdin.write(line + "\n")
+                process.stdin.flush()
+                return True
+            except (OSError, ValueError) as e:
+                print(f"[Error] Failed to write to cec-client: {e}")
+                return False
+
+    def request_power_status(self):
+        """プロジェクターに電源状態を問い合わせる (結果は出力の解析で反映される)"""
+        return self._write(f"pow {PROJECTOR_CEC_DEVICE}")
+
+    def _read_loop(self, process):
+        """cec-client の出力を1行ずつ解析する"""
+        for line in process.stdout:
+            try:
+                self.handle_line(line.rstrip("\n"))
+            except Exception as e:
+                print(f"[Error] Failed to parse CEC output '{line.strip()}': {e}")
+        self.ready.clear()
+        self._mark_failed(session_ended=True) # 送信確認待ちのコマンドがあれば失敗にする
+        print(f"[CEC] Monitor session ended (exit code {process.wait()}).")
+
+    def send_command(self, command_str, attempts=CEC_COMMAND_MAX_ATTEMPTS):
+        """
+        常駐中のセッションにコマンドを書き込み、送信確認 (ACK) を待つ
+        libCEC は "<<" の行をフレームを送信キューに積んだ時点 (ACK/NACKが分かる前) に出力するので、
+        "<<" が出た後 CEC_TRANSMIT_RESULT_SECONDS の間に失敗の行 ("not acked" など) が出なければ成功とする
+        (その前に送信先の機器からフレームが届いた場合は、届いた時点で成功とする)。
+        送信に失敗 (NACK・タイムアウト) した場合のみ再送する
+        ※ 確認が取れるまで戻らないので、キーパッドやWebリクエストのスレッドからは直接呼ばず、シーンの手順として実行する
+        
+        Args:
+            command_str (str): cec-client のコマンド (例: "tx 1F:82:20:00")
+            attempts (int): 最大試行回数
+        Returns:
+            bool: 送信が確認できたらTrue
+        """
+        if not self.is_running() and not self.start():
+            return False
+        if not self.ready.wait(CEC_STARTUP_TIMEOUT_SECONDS):
+            print(f"[Error] cec-client did not become ready. Command '{command_str}' was not sent.")
+            return False
+
+        expect = parse_cec_expectation(command_str)
+        with self._command_lock:
+            for attempt in range(1, attempts + 1):
+                pending = {'expect': expect, 'sent': threading.Event(), 'failed': threading.Event(),
+                           'result': threading.Event()}
+                self._pending = pending
+                print(f"-> [CEC] Sending (Attempt {attempt}/{attempts}): {command_str}")
+                if not self._write(command_str):
+                    self._pending = None
+                    return False
+                if expect is None:
+                    # 送信確認の形が分からないコマンドは書き込めた時点で成功とする
+                    self._pending = None
+                    return True
+                sent = pending['sent'].wait(CEC_COMMAND_ACK_TIMEOUT_SECONDS)
+                if sent and not pending['failed'].is_set():
+                    # 送信キューに積まれた。NACKならこの後に失敗の行が出る
+                    pending['result'].wait(CEC_TRANSMIT_RESULT_SECONDS)
+                self._pending = None
+                if sent and not pending['failed'].is_set():
+                    return True
+                print(f"   [CEC] No acknowledgement for '{command_str}'.")
+            return False
+
+    def _mark_sent(self, frame):
+        """送信確認待ちのコマンドのフレームが送信キューに積まれた ("<<") ことを記録する (条件に合わなければ何もしない)"""
+        pending = self._pending
+        if pending is None or pending['sent'].is_set():
+            return
+        destination, opcode, params = pending['expect']
+        if (frame[0] & 0x0F) != destination or frame[1] != opcode or tuple(frame[2:2 + len(params)]) != params:
+            return
+        pending['sent'].set()
+
+    def _mark_answered(self, frame):
+        """送信済みのコマンドの送信先からフレームが届いたら、送信結果を待たずに成功とする (NACKなら応答は来ない)"""
+        pending = self._pending
+        if pending is None or not pending['sent'].is_set():
+            return
+        if (frame[0] >> 4) == pending['expect'][0]:
+            pending['result'].set()
+
+    def _mark_failed(self, session_ended=False):
+        """
+        送信確認待ちのコマンドを失敗にする
+        失敗の行は "<<" の後に出るので、まだ "<<" が出ていないコマンドには適用しない
+        (前のコマンドの遅れて出た失敗の行で、次のコマンドを失敗にしないため)。セッション終了時は常に失敗にする
+        """
+        pending = self._pending
+        if pending is None or not (session_ended or pending['sent'].is_set()):
+            return
+        pending['failed'].set()
+        pending['result'].set()
+        pending['sent'].set() # 送信待ちで止まっている send_command を起こす
+
+    def handle_line(self, line):
+        """cec-client の出力1行を解析して状態を更新する"""
+        match = CEC_TRAFFIC_PATTERN.search(line)
+        if match:
+            self.ready.set()
+            frame = [int(b, 16) for b in match.group(2).split(':')]
+            self.handle_frame(frame)
+            if match.group(1) == '<<' and len(frame) >= 2:
+                self._mark_sent(frame) # 自分が送信したフレーム (この時点ではACKされたかは分からない)
+            elif match.group(1) == '>>':
+                self._mark_answered(frame)
+            return
+        if CEC_READY_PATTERN.search(line):
+            self.ready.set()
+            return
+        if CEC_FAILURE_PATTERN.search(line):
+            self._mark_failed()
+            return
+        match = CEC_POWER_TEXT_PATTERN.search(line)
+        if match and match.group(1) in CEC_POWER_TEXT_CODES:
+            # "pow" コマンドへの応答 (cec-client が整形して表示したもの)
+            self._set_power(CEC_POWER_TEXT_CODES[match.group(1)])
+
+    def handle_frame(self, frame):
+        """
+        CECフレーム (ヘッダ, オペコード, パラメータ...) を状態に反映する
+        
+        Args:
+            frame (list[int]): 例 [0x01, 0x90, 0x00]
+        """
+        if len(frame) < 2:
+            return # ポーリング (ヘッダのみ) は無視
+        initiator, destination = frame[0] >> 4, frame[0] & 0x0F
+        opcode, params = frame[1], frame[2:]
+
+        if opcode == 0x90 and initiator == PROJECTOR_CEC_DEVICE and params:
+            # Report Power Status
+            self._set_power(params[0])
+        elif opcode == 0x36 and destination in (PROJECTOR_CEC_DEVICE, 0x0F):
+            # Standby (プロジェクター宛て、または全体へのブロードキャスト)
+            self._set_power(0x01)
+        elif opcode in (0x04, 0x0D) and destination == PROJECTOR_CEC_DEVICE:
+            # Image View On / Text View On (電源ONの要求。実際の状態は次の通知で確定する)
+            self._set_power(0x02)
+        elif opcode == 0x82 and len(params) >= 2:
+            # Active Source
+            self._set_active_source(params[0], params[1])
+        elif opcode == 0x80 and len(params) >= 4:
+            # Routing Change (切替後のアドレスは後半2バイト)
+            self._set_active_source(params[2], params[3])
+        elif opcode == 0x81 and len(params) >= 2:
+            # Routing Information
+            self._set_active_source(params[0], params[1])
+
+    def _set_power(self, code):
+        with self._power_cond:
+            self.power_code = code
+            self.power_updated_at = time.monotonic()
+            self._power_cond.notify_all()
+        self._publish()
+
+    def wait_for_power_on(self, timeout=PROJECTOR_READY_TIMEOUT_SECONDS, cancel_event=None):
+        """
+        プロジェクターが電源ON (Report Power Status: 0x00) を報告するまで待つ
+        待っている間は PROJECTOR_READY_POLL_SECONDS ごとに電源状態を問い合わせる
+        
+        Args:
+            timeout (float): 最長の待ち時間 (秒)
+            cancel_event (threading.Event, optional): セットされたら待つのをやめる
+        Returns:
+            bool: ONを確認できたらTrue (タイムアウト・中止はFalse)
+        """
+        deadline = time.monotonic() + timeout
+        next_query = 0
+        while True:
+            now = time.monotonic()
+            if self.power_code == 0x00:
+                return True
+            if now >= deadline or (cancel_event is not None and cancel_event.is_set()):
+                return False
+            if now >= next_query:
+                self.request_power_status()
+                next_query = now + PROJECTOR_READY_POLL_SECONDS
+            with self._power_cond:
+                # 通知が来るか、中止を確認するために最長0.5秒ごとに起きる
+                self._power_cond.wait(min(0.5, next_query - now, deadline - now))
+
+    def _set_active_source(self, high, low):
+        self.active_source_address = f"{high:02x}:{low:02x}"
+        self._publish()
+
+    def _publish(self):
+        """キャッシュを state_store (/status やLCDが参照する) に反映する"""
+        changes = {'projector_status': self.status_text()}
+        port = self.active_hdmi_port()
+        if port:
+            changes['hdmi_input'] = f"HDMI {port}"
+        state_store.update(**changes)
+
+    def active_hdmi_port(self):
+        """アクティブソースの物理アドレスからHDMIポート番号 (1〜) を返す (不明ならNone)"""
+        if not self.active_source_address:
+            return None
+        port = int(self.active_source_address[0], 16)
+        return port or None
+
+    def status_text(self):
+        """
+        プロジェクターの電源状態を文字列で返す
+        
+        Returns:
+            str: "ON", "OFF", "Error", "N/A"
+        """
+        if not self.is_running() and self.power_code is None:
+            return "Error" if self.last_error else "N/A"
+        if self.power_code is None:
+            return "N/A"
+        if time.monotonic() - self.power_updated_at > CEC_STATUS_STALE_SECONDS:
+            return "N/A" # しばらく応答がない (ケーブル抜けなど)
+        return CEC_POWER_STATUS_NAMES.get(self.power_code, "N/A")
+
+cec_monitor = CecMonitor()
 
 def get_projector_status():
     """
-    HDMI-CEC (cec-client) を使ってプロジェクターの電源状態を取得
+    プロジェクターの電源状態を返す (CecMonitor が保持している状態を返すのみ)
+    ※ cec-client の起動は CecMonitor が1度だけ行うので、ここでプロセスを起動することはない
     
     Returns:
         str: "ON", "OFF", "Error", "N/A"
     """
-    # cec-clientコマンドを実行し、電源状態(pow)を問い合わせる
-    full_command = f'echo "pow {PROJECTOR_CEC_DEVICE}" | cec-client -s -d 1'
-    try:
-        # タイムアウト10秒でコマンド実行
-        process = subprocess.run(full_command, shell=True, capture_output=True, text=True, timeout=10)
-        # 標準出力に "power status: on" があればON
-        if "power status: on" in process.stdout: return "ON"
-        # "power status: standby" があればOFF
-        elif "power status: standby" in process.stdout: return "OFF"
-    except Exception as e:
-        # タイムアウトやコマンドエラー
-        print(f"[Error] Failed to get projector status: {e}")
-        return "Error"
-    return "N/A" # "on" "standby" どちらでもない場合
+    return cec_monitor.status_text()
 
 def get_all_sensor_data():
     """
     すべてのセンサー(ローカル・ハブ)とカーテンの状態を一度に取得し、辞書で返す
     (ログ記録とAPI配信用)
+    ハブへのHTTPリクエストは sensor_io_executor で投げておき、その間にI2Cセンサーを読む
     """
+    hub_future = sensor_io_executor.submit(get_hub_status)
     local_temp, local_hum, local_pres = read_bme280()
     local_lux = read_bh1750()
-    hub_status = get_hub_status()
+    hub_status = hub_future.result()
     hub_temp, hub_hum, hub_lux = (None, None, None)
     
     # ハブのステータスが辞書として正しく取得できた場合のみ値を展開
@@ -508,48 +2172,119 @@ def get_all_sensor_data():
 # ==============================================================================
 # 7. デバイス制御関数
 # ==============================================================================
-def control_tuya_device(commands):
+class LatestWinsCommandQueue:
     """
-    Tuya Cloud API (tuya-connector) を使ってデバイスを操作し、内部状態を更新する
+    デバイスごとのコマンドキュー (最新の指示だけを送る)
     
-    Args:
-        commands (list): Tuya API形式のコマンドリスト (例: [{'code': 'percent_control', 'value': 0}])
+    送信待ちのコマンドは1つだけ保持し、新しいコマンドが来たら古いものは送らずに捨てる。
+    送信は専用スレッドが1件ずつ行うので、同じデバイスへの送信中リクエストは常に1つ以下になる。
+    (キーパッドで 1 → 5 と素早く押した場合などに、途中の位置をクラウドに送らないため)
     """
-    global current_curtain_state
-    
-    # APIに送信するコマンドを整形
-    api_commands = []
-    target_value = None # 操作後の位置を記憶するため
-    for command in commands:
-        if command.get('code') == 'percent_control':
-            target_value = command.get('value')
-            # ユーザー設定のDPS Index (code) を使う
-            api_commands.append({'code': TUYA_DPS_INDEX_CONTROL, 'value': target_value})
-
-    if not api_commands: # 送信すべき有効なコマンドがなければ終了
-        print("[Tuya Cloud] No valid commands to send.")
-        return
 
+    def __init__(self, name, send_func):
+        self.name = name
+        self.send_func = send_func    # 実際に送信する関数 (引数は submit に渡した値)
+        self._cond = threading.Condition()
+        self._pending = None          # 送信待ちのコマンド (最新の1つ)
+        self._has_pending = False
+        self._in_flight = False
+        self._thread = None
+        self.sent_count = 0           # 送信した数
+        self.superseded_count = 0     # 送信前に新しい指示で置き換えられた数
+
+    def submit(self, command):
+        """コマンドを送信待ちにする (送信待ちのコマンドがあれば置き換える)"""
+        with self._cond:
+            if self._has_pending:
+                self.superseded_count += 1
+                print(f"[{self.name}] Dropped superseded command: {self._pending}")
+            self._pending = command
+            self._has_pending = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name=f"{self.name}-queue", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """送信待ち・送信中のコマンドがなくなるまで待つ (タイムアウトしたらFalse)"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._has_pending and not self._in_flight, timeout)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._has_pending)
+                command = self._pending
+                self._pending, self._has_pending = None, False
+                self._in_flight = True
+            try:
+                self.send_func(command)
+            except Exception as e:
+                print(f"[{self.name}] Failed to send command: {e}")
+            finally:
+                with self._cond:
+                    self._in_flight = False
+                    self.sent_count += 1
+                    self._cond.notify_all()
+
+def send_tuya_commands(api_commands):
+    """
+    Tuya Cloud API (tuya-connector) にコマンドを送信し、内部状態を更新する
+    (tuya_command_queue の送信スレッドから呼ばれる)
+    
+    Args:
+        api_commands (list): 送信するコマンドリスト (例: [{'code': 'percent_control', 'value': 0}])
+    """
+    target_value = api_commands[-1].get('value') # 操作後の位置を記憶するため
     print(f"-> [Tuya Cloud] Sending commands: {api_commands}")
+    # 起動直後などでまだ接続できていなければ、少しだけ接続を待つ
+    if not tuya_ready.wait(TUYA_COMMAND_WAIT_SECONDS):
+        print("   [Tuya Cloud] Not connected yet. Command dropped.")
+        state_store.update(curtain={"state": "error", "position": "NoConn"})
+        return
     try:
         # Tuya APIのエンドポイント (v1.0/devices/{id}/commands) にPOSTリクエスト
         response = openapi.post(f'/v1.0/devices/{TUYA_DEVICE_ID}/commands', {'commands': api_commands})
         print(f"   [Tuya Cloud] API Response: {response}")
         
-        # コマンド送信が成功したら、内部の状態 (current_curtain_state) を更新
+        # コマンド送信が成功したら、内部の状態 (state_store の curtain) を更新
         if response.get("success"):
             print("   [Tuya Cloud] Command sent successfully.")
             # 実際のデバイスは位置が逆 (0=全開, 100=全閉) なので、100から引いた値を「開度(%)」として記憶
             final_position = 100 - target_value if target_value is not None else "N/A"
-            current_curtain_state = {"state": "stopped", "position": final_position}
+            state_store.update(curtain={"state": "stopped", "position": final_position})
         else:
             # 失敗した場合は状態をエラーに
-            current_curtain_state = {"state": "error", "position": "CmdFail"}
+            state_store.update(curtain={"state": "error", "position": "CmdFail"})
 
     except Exception as e:
         # API通信例外
         print(f"   [Tuya Cloud] Failed to send command: {e}")
-        current_curtain_state = {"state": "error", "position": "Exception"}
+        state_store.update(curtain={"state": "error", "position": "Exception"})
+
+tuya_command_queue = LatestWinsCommandQueue('Tuya Cloud', send_tuya_commands)
+
+def control_tuya_device(commands):
+    """
+    Tuyaデバイス (カーテン) を操作する
+    コマンドは tuya_command_queue に入れるだけで、送信は専用スレッドが行う
+    (送信前に新しい指示が来た場合、古い位置は送らない)
+    
+    Args:
+        commands (list): Tuya API形式のコマンドリスト (例: [{'code': 'percent_control', 'value': 0}])
+    """
+    # APIに送信するコマンドを整形
+    api_commands = []
+    for command in commands:
+        if command.get('code') == 'percent_control':
+            # ユーザー設定のDPS Index (code) を使う
+            api_commands.append({'code': TUYA_DPS_INDEX_CONTROL, 'value': command.get('value')})
+
+    if not api_commands: # 送信すべき有効なコマンドがなければ終了
+        print("[Tuya Cloud] No valid commands to send.")
+        return
+
+    tuya_command_queue.submit(api_commands)
 
 def control_switchbot_device(device_id, parameter):
     """SwitchBot API (v1.0) を使ってデバイス (カーテン) を操作する"""
@@ -567,22 +2302,35 @@ def control_switchbot_device(device_id, parameter):
     }
     try:
         print(f"-> [SwitchBot] Sending setPosition={parameter} to '{device_id}'...")
-        requests.post(url, headers=headers, data=json.dumps(payload), timeout=15)
+        http_client.post('switchbot.command', url, headers=headers, data=json.dumps(payload),
+                         timeout=(HTTP_LAN_CONNECT_TIMEOUT, 15))
         print("   [SwitchBot] Command sent successfully.")
     except Exception as e:
         print(f"   [SwitchBot] Failed to send command: {e}")
 
 def run_cec_command(command_str):
-    """cec-clientコマンドを非同期で実行する (プロジェクター制御用)"""
-    full_command = f'echo "{command_str}" | cec-client -s -d 1'
-    print(f"-> [CEC] Executing: {command_str}")
-    # Popenを使い、コマンドの終了を待たずにバックグラウンドで実行
-    subprocess.Popen(full_command, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-def control_projector_activate():
-    """プロジェクターの電源をONにし、入力をアクティブソースに設定"""
-    run_cec_command("on 0") # デバイス0 (TV/プロジェクター) の電源ON
-    time.sleep(0.5)
+    """
+    cec-client のコマンドを常駐中のセッション (cec_monitor) で実行する (プロジェクター制御用)
+    送信確認 (ACK) が取れるまで待ち、失敗した場合のみ再送する
+    ※ 最悪で数十秒かかるので、シーンの手順 (scene_engine) からのみ呼ぶ
+    
+    Returns:
+        bool: 送信が確認できたらTrue
+    """
+    success = cec_monitor.send_command(command_str)
+    if not success:
+        print(f"   [CEC] Failed to send command: {command_str}")
+    return success
+
+def control_projector_activate(run=None):
+    """
+    プロジェクターの電源をONにし、入力をアクティブソースに設定
+    シーンの手順として実行した場合、電源ONの送信中にシーンが中止されたらアクティブソースは送らない
+    (送ると、直後にOFFにしたプロジェクターが再び起動するため)
+    """
+    run_cec_command(f"on {PROJECTOR_CEC_DEVICE}") # デバイス0 (TV/プロジェクター) の電源ON
+    if run is not None and run.is_cancelled():
+        return False
     run_cec_command("as")   # このラズパイをアクティブソース (入力切替) にする
 
 def control_projector_off():
@@ -591,9 +2339,11 @@ def control_projector_off():
 
 def switch_hdmi_input(port):
     """
-    プロジェクターのHDMI入力を切り替える（リトライ機能付き）
+    プロジェクターのHDMI入力を切り替える（送信確認が取れなければ再送）
     Args:
         port (int): HDMIポート番号 (1 or 2)
+    Returns:
+        bool: 送信が確認できたらTrue
     """
     # 物理アドレスを指定 (10:00 or 20:00)
     target_physical_address = f"{port}0:00"
@@ -601,12 +2351,7 @@ def switch_hdmi_input(port):
     command = f"tx 1F:82:{target_physical_address}"
     
     logging.info(f"【プロジェクター】HDMI{port}への入力切替を試行...")
-    
-    # 成功率を上げるために、間隔をあけて3回コマンドを送信する
-    for i in range(3):
-        print(f"-> [CEC] Sending command (Attempt {i+1}/3): {command}")
-        run_cec_command(command)
-        time.sleep(1) # コマンド間に1秒待つ
+    return run_cec_command(command)
 
 def beep(duration=0.05):
     """ブザーを短く鳴らす"""
@@ -622,6 +2367,216 @@ def beep(duration=0.05):
 # 8. シーン実行関数
 # ==============================================================================
 
+class SceneStep:
+    """
+    シーンを構成する1つの手順
+    
+    Args:
+        name (str): 手順の名前 (シーン内で一意)
+        action (callable): SceneRun を引数に取る関数。False を返すと失敗扱いになり、後続の手順は実行されない
+        group (str): 操作するデバイスグループ ('curtain' / 'projector')
+        after (tuple): 先に完了している必要がある手順の名前
+    """
+
+    def __init__(self, name, action, group, after=()):
+        self.name = name
+        self.action = action
+        self.group = group
+        self.after = tuple(after)
+
+def call_step(func, *args):
+    """関数を呼ぶだけの手順用のアクションを作る"""
+    return lambda run: func(*args)
+
+def wait_step(seconds):
+    """指定秒数待つ手順用のアクションを作る (シーンが中止されたらすぐに抜ける)"""
+    return lambda run: run.sleep(seconds)
+
+class SceneRun:
+    """実行中 (または実行済み) のシーン1回分"""
+
+    def __init__(self, name, steps, triggered_by):
+        self.name = name
+        self.steps = steps
+        self.triggered_by = triggered_by
+        self.groups = {step.group for step in steps}
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        self.started_at = time.time()
+        self.completed_steps = []
+        self.status = 'running' # 'running' / 'completed' / 'cancelled' / 'failed'
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def sleep(self, seconds):
+        """中止されるまで最大 seconds 秒待つ (中止されたらFalse)"""
+        return not self.cancel_event.wait(seconds)
+
+    def wait(self, timeout=None):
+        """シーンの完了 (中止を含む) を待つ"""
+        return self.done_event.wait(timeout)
+
+class SceneEngine:
+    """
+    シーンの実行エンジン
+    
+    - シーンは SceneStep の依存関係 (after) で表し、依存関係のない手順は並行して実行する
+    - デバイスグループごとに実行中のシーンは1つだけ。新しいシーンが同じグループを使う場合、
+      古いシーンは中止され、まだ始まっていない手順 (待機後のHDMI切替など) は実行されない
+    """
+
+    def __init__(self, definitions, max_workers=6):
+        self.definitions = definitions
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scene-step')
+        self._active = {} # デバイスグループ -> 実行中の SceneRun
+        self._lock = threading.Lock()
+
+    def start(self, scene_name, triggered_by='manual'):
+        """
+        シーンの実行を開始する (完了を待たずに戻る)
+        
+        Returns:
+            SceneRun or None: 不明なシーン名の場合はNone
+        """
+        steps = self.definitions.get(scene_name)
+        if steps is None:
+            return None
+        run = SceneRun(scene_name, steps, triggered_by)
+        with self._lock:
+            superseded = {self._active[g] for g in run.groups if g in self._active}
+            for old in superseded:
+                old.cancel()
+            for group in run.groups:
+                self._active[group] = run
+        for old in superseded:
+            print(f"[Scene] '{old.name}' cancelled (superseded by '{scene_name}').")
+            log_action('System', 'シーン中止', f"シーン'{old.name}'を中止 (シーン'{scene_name}'を優先)")
+        threading.Thread(target=self._run, args=(run,), name=f"scene-{scene_name}", daemon=True).start()
+        return run
+
+    def active_scenes(self):
+        """デバイスグループごとに実行中のシーン名を返す"""
+        with self._lock:
+            return {group: run.name for group, run in self._active.items()}
+
+    def _run_step(self, run, step):
+        if run.is_cancelled():
+            return False
+        try:
+            return step.action(run) is not False
+        except Exception as e:
+            print(f"[Error] Scene '{run.name}' step '{step.name}' failed: {e}")
+            return False
+
+    def _run(self, run):
+        """依存関係の満たされた手順から順に (並行して) 実行する"""
+        pending = {step.name: step for step in run.steps}
+        running = {}
+        failed = False
+        while True:
+            if not run.is_cancelled():
+                for name, step in list(pending.items()):
+                    if all(dep in run.completed_steps for dep in step.after):
+                        running[self._executor.submit(self._run_step, run, step)] = name
+                        del pending[name]
+            if not running:
+                break # 実行できる手順がもうない (完了・中止・失敗)
+            finished, _ = wait_futures(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                if future.result():
+                    run.completed_steps.append(name)
+                else:
+                    failed = True
+
+        if run.is_cancelled():
+            run.status = 'cancelled'
+        elif failed or pending:
+            run.status = 'failed'
+        else:
+            run.status = 'completed'
+        with self._lock:
+            for group in run.groups:
+                if self._active.get(group) is run:
+                    del self._active[group]
+        print(f"[Scene] '{run.name}' {run.status} in {time.time() - run.started_at:.1f}s.")
+        run.done_event.set()
+
+# --- HDMI切替 ---
+def scene_set_hdmi1():
+    """HDMI 1 (ChromeCast) に切り替える"""
+    print("Switching to HDMI 1")
+    switch_hdmi_input(1)
+    state_store.update(hdmi_input="HDMI 1") # 内部状態を更新
+
+def scene_set_hdmi2():
+    """HDMI 2 (RaspberryPi) に切り替える"""
+    print("Switching to HDMI 2")
+    switch_hdmi_input(2)
+    state_store.update(hdmi_input="HDMI 2") # 内部状態を更新
+
+def wait_for_projector_ready(run):
+    """
+    プロジェクターがONを報告するまで待つシーンの手順 (以前は固定で60秒待っていた)
+    起動にかかった時間 (シーン開始からの秒数) を記録する。タイムアウトした場合もHDMI切替には進む
+    """
+    print("[CEC] プロジェクターの起動を待機しています...")
+    ready = cec_monitor.wait_for_power_on(PROJECTOR_READY_TIMEOUT_SECONDS, run.cancel_event)
+    if run.is_cancelled():
+        return False
+    if ready:
+        warmup_seconds = round(time.time() - run.started_at, 1)
+        cec_monitor.warmup_history.append((datetime.now().isoformat(timespec='seconds'), warmup_seconds))
+        log_action('System', 'プロジェクター', f'起動完了 ({warmup_seconds}秒)')
+    else:
+        cec_monitor.warmup_history.append((datetime.now().isoformat(timespec='seconds'), None))
+        log_action('System', 'プロジェクター', f'起動を確認できず ({PROJECTOR_READY_TIMEOUT_SECONDS}秒でタイムアウト)')
+    return True
+
+def set_hdmi_state(port_name):
+    """HDMI入力の内部状態だけを先に変更する (シーン開始時、表示を切替先にするため)"""
+    state_store.update(hdmi_input=port_name)
+
+# --- シーン定義 (手順と依存関係) ---
+def projector_on_scene_steps(tuya_value, switchbot_value):
+    """カーテンを動かし、プロジェクターをONにしてHDMI 2 に切り替えるシーンの手順"""
+    return [
+        SceneStep('hdmi_state', call_step(set_hdmi_state, "HDMI 2"), 'projector'), # 先に内部状態を変更
+        SceneStep('projector_on', control_projector_activate, 'projector'),
+        SceneStep('tuya', call_step(control_tuya_device, [{'code': 'percent_control', 'value': tuya_value}]), 'curtain'),
+        SceneStep('switchbot', call_step(control_switchbot_device, SWITCHBOT_CURTAIN_DEVICE_ID, switchbot_value), 'curtain'),
+        SceneStep('projector_warmup', wait_for_projector_ready, 'projector', after=['projector_on']), # プロジェクターがONを報告するまで待つ
+        SceneStep('hdmi2', call_step(switch_hdmi_input, 2), 'projector', after=['projector_warmup']),
+    ]
+
+def projector_off_scene_steps(tuya_value, switchbot_value):
+    """カーテンを動かし、プロジェクターをOFFにするシーンの手順"""
+    return [
+        SceneStep('tuya', call_step(control_tuya_device, [{'code': 'percent_control', 'value': tuya_value}]), 'curtain'),
+        SceneStep('switchbot', call_step(control_switchbot_device, SWITCHBOT_CURTAIN_DEVICE_ID, switchbot_value), 'curtain'),
+        SceneStep('projector_off', call_step(control_projector_off), 'projector'),
+    ]
+
+# Tuyaの値は実際のデバイスの向き (0=全閉, 100=全開)、SwitchBotは 0=開放, 40=遮光
+SCENE_DEFINITIONS = {
+    "set100": projector_on_scene_steps(0, 40),   # 100% (全閉) & プロジェクターON & HDMI 2
+    "set0": projector_off_scene_steps(100, 0),   # 0% (全開) & プロジェクターOFF
+    "set25": projector_off_scene_steps(75, 0),   # 25% (25%開) & プロジェクターOFF
+    "set50": projector_on_scene_steps(50, 40),   # 50% (半開) & プロジェクターON & HDMI 2
+    "set75": projector_on_scene_steps(25, 40),   # 75% (75%閉) & プロジェクターON & HDMI 2
+    # HDMI切替・プロジェクター電源 (キーパッド・Web UI)。待機中のシーンのHDMI切替を取り消すため、エンジン経由で実行する
+    "hdmi1": [SceneStep('hdmi1', call_step(scene_set_hdmi1), 'projector')],
+    "hdmi2": [SceneStep('hdmi2', call_step(scene_set_hdmi2), 'projector')],
+    "projector_on": [SceneStep('projector_on', control_projector_activate, 'projector')],
+    "projector_off": [SceneStep('projector_off', call_step(control_projector_off), 'projector')],
+}
+
+scene_engine = SceneEngine(SCENE_DEFINITIONS)
+
 def execute_scene(scene_name, triggered_by='manual', ip_addr=None):
     """
     指定されたシーン名に対応するアクションを実行し、ログを記録する
@@ -631,22 +2586,17 @@ def execute_scene(scene_name, triggered_by='manual', ip_addr=None):
         triggered_by (str, optional): トリガー ( "manual" or "ai" )
         ip_addr (str, optional): 手動操作時のIPアドレス
     """
-    global is_auto_mode, last_curtain_position_command
-
     if triggered_by == 'manual':
         # 手動操作の場合
         source = "Web UI" if ip_addr else "Keypad"
         log_action(source, 'シーン実行', f"シーン'{scene_name}'を実行", ip_addr=ip_addr or '--')
         
-        # 手動操作が実行されたら、自動モードを強制的にOFFにする
-        if is_auto_mode:
-            is_auto_mode = False
-            update_auto_mode_led()
-            log_action(source, 'モード切替', '「手動モード」に切替', ip_addr=ip_addr or '--')
-        
-        # 手動で実行したシーンを「最後に実行したシーン」として記憶する
+        # 手動操作が実行されたら、自動モードを強制的にOFFにする (LEDは状態の変化に応じて更新される)
+        # また、手動で実行したシーンを「最後に実行したシーン」として記憶する
         # (これにより、AIが同じ操作をしようとした時にスキップされる)
-        last_curtain_position_command = scene_name
+        _, changed = state_store.update(auto_mode=False, last_curtain_command=scene_name)
+        if 'auto_mode' in changed:
+            log_action(source, 'モード切替', '「手動モード」に切替', ip_addr=ip_addr or '--')
 
     else: # triggered_by == 'ai'
         # AIによる操作の場合
@@ -654,97 +2604,14 @@ def execute_scene(scene_name, triggered_by='manual', ip_addr=None):
 
     # 手動操作時のみLCDにシーン名を表示
     if lcd and triggered_by == 'manual':
-        lcd.clear()
-        lcd.write_string(f"Scene:\n{scene_name}")
-    
-    # シーン名と実行する関数のマッピング
-    scene_actions = {
-        "set100": scene_set100, 
-        "set0": scene_set0, 
-        "set25": scene_set25,
-        "set50": scene_set50, 
-        "set75": scene_set75,
-    }
-    
-    # 対応する関数を取得
-    action = scene_actions.get(scene_name)
+        with lcd_lock:
+            lcd.clear()
+            lcd.write_string(f"Scene:\n{scene_name}")
     
-    if action:
-        # アクションの実行（重い処理を含むため別スレッドで実行）
-        threading.Thread(target=action, daemon=True).start()
-    else:
+    # シーンエンジンで実行 (同じデバイスを使う実行中のシーンは中止される)
+    if scene_engine.start(scene_name, triggered_by) is None:
         log_action('System', 'エラー', f"不明なシーン名: '{scene_name}'")
 
-# --- HDMI切替シーン ---
-def scene_set_hdmi1():
-    """HDMI 1 (ChromeCast) に切り替える"""
-    global current_hdmi_input
-    print("Switching to HDMI 1")
-    switch_hdmi_input(1)
-    current_hdmi_input = "HDMI 1" # 内部状態を更新
-
-def scene_set_hdmi2():
-    """HDMI 2 (RaspberryPi) に切り替える"""
-    global current_hdmi_input
-    print("Switching to HDMI 2")
-    switch_hdmi_input(2)
-    current_hdmi_input = "HDMI 2" # 内部状態を更新
-
-# --- カーテン・プロジェクター連動シーン ---
-def scene_set100():
-    """シーン 100% (全閉) & プロジェクターON & HDMI 2"""
-    print("\n--- Activating Scene: set100 (Close & Projector ON) ---")
-    global current_hdmi_input
-    current_hdmi_input = "HDMI 2"   # 先に内部状態を変更
-    control_projector_activate()    # プロジェクターON (非同期)
-    control_tuya_device([{'code': 'percent_control', 'value': 0}]) # Tuya 0% (全閉)
-    time.sleep(1)
-    control_switchbot_device(SWITCHBOT_CURTAIN_DEVICE_ID, 40) # SwitchBot 40% (遮光)
-    print("[CEC] プロジェクターの起動を待機しています... (60秒)")
-    time.sleep(60) # プロジェクターが起動するまで待つ
-    switch_hdmi_input(2) # HDMI 2 に切り替え (リトライ付き)
-
-def scene_set0():
-    """シーン 0% (全開) & プロジェクターOFF"""
-    print("\n--- Activating Scene: set0 (Open & Projector OFF) ---")
-    control_tuya_device([{'code': 'percent_control', 'value': 100}]) # Tuya 100% (全開)
-    control_switchbot_device(SWITCHBOT_CURTAIN_DEVICE_ID, 0) # SwitchBot 0% (開放)
-    time.sleep(1)
-    control_projector_off() # プロジェクターOFF (非同期)
-
-def scene_set25():
-    """シーン 25% (25%開) & プロジェクターOFF"""
-    print("\n--- Activating Scene: set25 (25% Open) ---")
-    control_tuya_device([{'code': 'percent_control', 'value': 75}]) # Tuya 75% (25%開)
-    control_switchbot_device(SWITCHBOT_CURTAIN_DEVICE_ID, 0) # SwitchBot 0% (開放)
-    control_projector_off() # プロジェクターOFF (非同期)
-
-def scene_set50():
-    """シーン 50% (半開) & プロジェクターON & HDMI 2"""
-    print("\n--- Activating Scene: set50 (Half Open & Projector ON) ---")
-    global current_hdmi_input
-    current_hdmi_input = "HDMI 2"
-    control_projector_activate()
-    control_tuya_device([{'code': 'percent_control', 'value': 50}]) # Tuya 50% (半開)
-    time.sleep(1)
-    control_switchbot_device(SWITCHBOT_CURTAIN_DEVICE_ID, 40) # SwitchBot 40% (遮光)
-    print("[CEC] プロジェクターの起動を待機しています... (60秒)")
-    time.sleep(60)
-    switch_hdmi_input(2)
-
-def scene_set75():
-    """シーン 75% (75%閉) & プロジェクターON & HDMI 2"""
-    print("\n--- Activating Scene: set75 (75% Closed & Projector ON) ---")
-    global current_hdmi_input
-    current_hdmi_input = "HDMI 2"
-    control_projector_activate()
-    control_tuya_device([{'code': 'percent_control', 'value': 25}]) # Tuya 25% (75%閉)
-    time.sleep(1)
-    control_switchbot_device(SWITCHBOT_CURTAIN_DEVICE_ID, 40) # SwitchBot 40% (遮光)
-    print("[CEC] プロジェクターの起動を待機しています... (60秒)")
-    time.sleep(60)
-    switch_hdmi_input(2)
-    
 
 # ==============================================================================
 # 9. LED・ステータス表示関数
@@ -753,94 +2620,677 @@ def blink_red_led():
     """赤色LEDを点滅させる (別スレッドで実行)"""
     while not stop_blinking_flag.is_set(): # 停止フラグが立つまでループ
         GPIO.output(RED_PIN, GPIO.HIGH)
-        time.sleep(0.5)
-        if stop_blinking_flag.is_set(): break # 待機後にもう一度チェック
+        if stop_blinking_flag.wait(0.5): break # 待機中に停止フラグが立ったらすぐ抜ける
         GPIO.output(RED_PIN, GPIO.LOW)
-        time.sleep(0.5)
-
-def update_led_status():
-    """データ記録モード(is_curtain_logging_paused)に応じてLEDを更新"""
-    global stop_blinking_flag
-    stop_blinking_flag.set() # 既存の点滅スレッドを停止
-    time.sleep(0.1) # スレッドが停止するのを待つ
-    GPIO.output(RED_PIN, GPIO.LOW) # LEDを一旦消灯
-    GPIO.output(GREEN_PIN, GPIO.LOW)
-
-    if is_curtain_logging_paused:
-        # 記録OFF (一時停止中) -> 赤色LEDを点滅
-        print("[Status] Logging is PAUSED. LED: Red (Blinking)")
-        stop_blinking_flag.clear() # 停止フラグをリセット
-        threading.Thread(target=blink_red_led, daemon=True).start() # 点滅スレッド開始
-    else:
-        # 記録ON (アクティブ) -> 緑色LEDを点灯
-        print("[Status] Logging is ACTIVE. LED: Green (Solid)")
-        GPIO.output(GREEN_PIN, GPIO.HIGH)
-
-def update_auto_mode_led():
-    """自動モード(is_auto_mode)とAI接続状態(is_ai_connected)に応じて青色LEDを制御"""
-    global stop_blue_blinking_flag
-    stop_blue_blinking_flag.set() # 既存の点滅スレッドを停止
-    time.sleep(0.1) # スレッドが停止するのを待つ
-    GPIO.output(BLUE_LED_PIN, GPIO.LOW) # 一旦消灯
-
-    if is_auto_mode:
-        if is_ai_connected:
-            # 自動モードON & AI接続OK -> 青色LED 点灯
-            GPIO.output(BLUE_LED_PIN, GPIO.HIGH)
+        stop_blinking_flag.wait(0.5)
+
+def update_led_status(snapshot=None, changed=None):
+    """
+    データ記録モード (logging_paused) に応じてLEDを更新
+    (state_store の logging_paused が変わったときにも呼ばれる)
+    """
+    with led_update_lock:
+        if snapshot is not None and snapshot.version < led_applied_versions['status']:
+            return # 新しい状態を反映した後に届いた、古い通知
+        snapshot = state_store.snapshot() # 通知された時点ではなく、最新の状態で点灯させる
+        led_applied_versions['status'] = snapshot.version
+        stop_blinking_flag.set() # 既存の点滅スレッドを停止
+        if led_blink_threads['status']:
+            led_blink_threads['status'].join() # スレッドが停止するのを待つ
+            led_blink_threads['status'] = None
+        GPIO.output(RED_PIN, GPIO.LOW) # LEDを一旦消灯
+        GPIO.output(GREEN_PIN, GPIO.LOW)
+
+        if snapshot['logging_paused']:
+            # 記録OFF (一時停止中) -> 赤色LEDを点滅
+            print("[Status] Logging is PAUSED. LED: Red (Blinking)")
+            stop_blinking_flag.clear() # 停止フラグをリセット
+            led_blink_threads['status'] = threading.Thread(target=blink_red_led, daemon=True)
+            led_blink_threads['status'].start() # 点滅スレッド開始
         else:
-            # 自動モードON & AI接続NG -> 青色LED 点滅
-            stop_blue_blinking_flag.clear() # 停止フラグをリセット
-            threading.Thread(target=blink_blue_led, daemon=True).start() # 点滅スレッド開始
-    else:
-        # 自動モードOFF -> 青色LED 消灯
-        GPIO.output(BLUE_LED_PIN, GPIO.LOW)
+            # 記録ON (アクティブ) -> 緑色LEDを点灯
+            print("[Status] Logging is ACTIVE. LED: Green (Solid)")
+            GPIO.output(GREEN_PIN, GPIO.HIGH)
+
+def update_auto_mode_led(snapshot=None, changed=None):
+    """
+    自動モード (auto_mode) とAI接続状態 (ai_connected) に応じて青色LEDを制御
+    (state_store のどちらかが変わったときにも呼ばれる)
+    """
+    with led_update_lock:
+        if snapshot is not None and snapshot.version < led_applied_versions['auto_mode']:
+            return # 新しい状態を反映した後に届いた、古い通知
+        snapshot = state_store.snapshot() # 通知された時点ではなく、最新の状態で点灯させる
+        led_applied_versions['auto_mode'] = snapshot.version
+        stop_blue_blinking_flag.set() # 既存の点滅スレッドを停止
+        if led_blink_threads['auto_mode']:
+            led_blink_threads['auto_mode'].join() # スレッドが停止するのを待つ
+            led_blink_threads['auto_mode'] = None
+        GPIO.output(BLUE_LED_PIN, GPIO.LOW) # 一旦消灯
+
+        if snapshot['auto_mode']:
+            if snapshot['ai_connected']:
+                # 自動モードON & AI接続OK -> 青色LED 点灯
+                GPIO.output(BLUE_LED_PIN, GPIO.HIGH)
+            else:
+                # 自動モードON & AI接続NG -> 青色LED 点滅
+                stop_blue_blinking_flag.clear() # 停止フラグをリセット
+                led_blink_threads['auto_mode'] = threading.Thread(target=blink_blue_led, daemon=True)
+                led_blink_threads['auto_mode'].start() # 点滅スレッド開始
+        else:
+            # 自動モードOFF -> 青色LED 消灯
+            GPIO.output(BLUE_LED_PIN, GPIO.LOW)
 
 def blink_blue_led():
     """青色LEDを点滅させる (別スレッドで実行)"""
     while not stop_blue_blinking_flag.is_set(): # 停止フラグが立つまでループ
         GPIO.output(BLUE_LED_PIN, GPIO.HIGH)
-        time.sleep(0.5)
-        if stop_blue_blinking_flag.is_set(): break
+        if stop_blue_blinking_flag.wait(0.5): break
         GPIO.output(BLUE_LED_PIN, GPIO.LOW)
-        time.sleep(0.5)
+        stop_blue_blinking_flag.wait(0.5)
 
 
 # ==============================================================================
 # 10. AI制御・データ送信 関数
 # ==============================================================================
+# --- センサーデータの時系列ストア ---
+# 1レコード = 5分ごとのセンサーデータ1件 (固定長40バイト)。欠損値は NaN で表す
+SENSOR_RECORD_DTYPE = np.dtype([
+    ('ts', '<i8'),                      # 記録時刻 (UNIX秒)
+    ('local_temp', '<f4'),              # 窓際 温度 (℃)
+    ('local_hum', '<f4'),               # 窓際 湿度 (%)
+    ('local_pres', '<f4'),              # 窓際 気圧 (hPa)
+    ('local_lux', '<f4'),               # 窓際 照度 (lux)
+    ('hub_temp', '<f4'),                # 室内 温度 (℃)
+    ('hub_hum', '<f4'),                 # 室内 湿度 (%)
+    ('hub_lux', '<f4'),                 # 室内 照度 (レベル)
+    ('tuya_curtain_percent', '<f4'),    # カーテン開度 (%) / 学習ラベル
+])
+SENSOR_VALUE_FIELDS = SENSOR_RECORD_DTYPE.names[1:] # ts 以外の値の列
+SENSOR_CSV_HEADER = "timestamp,local_temp_c,local_humidity_percent,local_pressure_hpa,local_light_lux,hub_temp_c,hub_humidity_percent,hub_light_level,tuya_curtain_percent\n"
+
+class SensorStore:
+    """
+    センサーログを日ごとのセグメントファイル (YYYYMMDD.bin) に固定長レコードで追記するストア
+    
+    レコードは SENSOR_RECORD_DTYPE のバイト列をそのまま並べただけなので、
+    読み出しは np.memmap でファイルを配列として見るだけで済み、テキストの解析は不要。
+    書き込み途中で落ちて末尾に半端なバイトが残っても、読み出し時に無視される。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _segment_path(self, day):
+        """日付 (date) に対応するセグメントファイルのパス"""
+        return os.path.join(self.directory, day.strftime('%Y%m%d') + '.bin')
+
+    def _ensure_directory(self):
+        """保存先ディレクトリとレコード形式の説明ファイルを用意する"""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        meta_path = os.path.join(self.directory, 'meta.json')
+        if not os.path.exists(meta_path):
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': 1, 'dtype': SENSOR_RECORD_DTYPE.descr}, f)
+
+    @staticmethod
+    def make_record(timestamp, data):
+        """
+        タイムスタンプとセンサーデータの辞書から1件分のレコードを作る
+        
+        Args:
+            timestamp (datetime or float): 記録時刻
+            data (dict): get_all_sensor_data() 形式の辞書 (数値以外は欠損扱い)
+        """
+        record = np.zeros(1, dtype=SENSOR_RECORD_DTYPE)
+        record['ts'] = int(timestamp.timestamp() if isinstance(timestamp, datetime) else timestamp)
+        for field in SENSOR_VALUE_FIELDS:
+            value = data.get(field)
+            record[field] = value if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan
+        return record
+
+    def append(self, timestamp, data):
+        """1件のレコードをその日のセグメントファイルに追記する"""
+        record = self.make_record(timestamp, data)
+        day = datetime.fromtimestamp(int(record['ts'][0])).date()
+        with self._lock:
+            self._ensure_directory()
+            with open(self._segment_path(day), 'ab') as f:
+                # 書きかけのレコードが残っていたら、その直後から書かないよう境界に揃える
+                misaligned = f.tell() % SENSOR_RECORD_DTYPE.itemsize
+                if misaligned:
+                    f.truncate(f.tell() - misaligned)
+                    f.seek(0, os.SEEK_END)
+                f.write(record.tobytes())
+        return record
+
+    def segment_days(self):
+        """保存されているセグメントの日付 (date) を古い順に返す"""
+        if not os.path.isdir(self.directory):
+            return []
+        days = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.bin') and len(name) == 12:
+                try:
+                    days.append(datetime.strptime(name[:8], '%Y%m%d').date())
+                except ValueError:
+                    continue
+        return sorted(days)
+
+    def load_segment(self, day):
+        """1日分のセグメントをメモリマップした配列として返す (ファイルがなければ空配列)"""
+        path = self._segment_path(day)
+        try:
+            count = os.path.getsize(path) // SENSOR_RECORD_DTYPE.itemsize
+        except OSError:
+            count = 0
+        if count == 0:
+            return np.empty(0, dtype=SENSOR_RECORD_DTYPE)
+        return np.memmap(path, dtype=SENSOR_RECORD_DTYPE, mode='r', shape=(count,))
+
+    def read(self, start=None, end=None):
+        """
+        [start, end) の範囲のレコードを古い順に返す
+        
+        Args:
+            start (datetime or float, optional): 範囲の始まり (含む)
+            end (datetime or float, optional): 範囲の終わり (含まない)
+        Returns:
+            numpy.ndarray: SENSOR_RECORD_DTYPE の配列 (1日分だけならメモリマップのスライス)
+        """
+        to_ts = lambda t: t.timestamp() if isinstance(t, datetime) else t
+        start_ts = to_ts(start) if start is not None else None
+        end_ts = to_ts(end) if end is not None else None
+        # セグメント単位でまず範囲を絞り込む (前後1日は時刻の境界の誤差を吸収するため含める)
+        first_day = datetime.fromtimestamp(start_ts).date() if start_ts is not None else None
+        last_day = datetime.fromtimestamp(end_ts).date() if end_ts is not None else None
+
+        parts = []
+        for day in self.segment_days():
+            if first_day and day < first_day: continue
+            if last_day and day > last_day: continue
+            segment = self.load_segment(day)
+            if len(segment) == 0:
+                continue
+            # セグメント内は時刻順に並んでいるので二分探索で切り出す
+            lo = np.searchsorted(segment['ts'], start_ts, side='left') if start_ts is not None else 0
+            hi = np.searchsorted(segment['ts'], end_ts, side='left') if end_ts is not None else len(segment)
+            if hi > lo:
+                parts.append(segment[lo:hi])
+        if not parts:
+            return np.empty(0, dtype=SENSOR_RECORD_DTYPE)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    # --- CSVとの相互変換 ---
+    @staticmethod
+    def _parse_csv_timestamp(text):
+        """CSVのタイムスタンプ ('2025/8/27 16:19' や '2025-11-17 06:20:03') を datetime に変換する"""
+        for fmt in ('%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M', '%Y-%m-%d %H:%M'):
+            try:
+                return datetime.strptime(text.strip(), fmt)
+            except ValueError:
+                continue
+        return None
+
+    @staticmethod
+    def _parse_csv_value(text):
+        """CSVの値を数値に変換する ('', 'None', 'N/A', '---' などは欠損)"""
+        try:
+            value = float(text)
+        except (TypeError, ValueError):
+            return None
+        return value if math.isfinite(value) else None
+
+    def import_csv(self, csv_path):
+        """
+        既存のセンサーログCSVを取り込む (一度きりの移行用)
+        ヘッダー行の文字コード (Shift_JIS / UTF-8) や、途中で形式が変わったタイムスタンプにも対応する。
+        すでにストアにある時刻のレコードとは重複しないように統合する。
+        
+        Returns:
+            int: 取り込んだレコード数
+        """
+        records = []
+        with open(csv_path, 'rb') as f:
+            for raw_line in f:
+                try:
+                    line = raw_line.decode('utf-8-sig')
+                except UnicodeDecodeError:
+                    line = raw_line.decode('cp932', errors='replace')
+                row = next(csv.reader([line]), [])
+                if len(row) < 9:
+                    continue
+                timestamp = self._parse_csv_timestamp(row[0])
+                if timestamp is None:
+                    continue # ヘッダー行・説明行など
+                data = {field: self._parse_csv_value(value) for field, value in zip(SENSOR_VALUE_FIELDS, row[1:9])}
+                records.append(self.make_record(timestamp, data))
+        if not records:
+            return 0
+
+        imported = np.concatenate(records)
+        days = np.array([datetime.fromtimestamp(int(ts)).strftime('%Y%m%d') for ts in imported['ts']])
+        with self._lock:
+            self._ensure_directory()
+            for day_str in np.unique(days):
+                day = datetime.strptime(day_str, '%Y%m%d').date()
+                merged = np.concatenate([np.array(self.load_segment(day)), imported[days == day_str]])
+                # 時刻順に並べ、同じ時刻のレコードは最初の1件だけ残す (既存のレコードを優先)
+                order = np.argsort(merged['ts'], kind='stable')
+                merged = merged[order]
+                _, first = np.unique(merged['ts'], return_index=True)
+                merged = merged[first]
+                tmp_path = self._segment_path(day) + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(merged.tobytes())
+                os.replace(tmp_path, self._segment_path(day))
+        return len(imported)
+
+    def export_csv(self, csv_path, start=None, end=None):
+        """
+        ストアの内容を write_log() 互換の形式でCSVに書き出す
+        
+        Returns:
+            int: 書き出したレコード数
+        """
+        records = self.read(start, end)
+        with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(SENSOR_CSV_HEADER)
+            for record in records:
+                f.write(format_sensor_csv_line(datetime.fromtimestamp(int(record['ts'])).strftime("%Y-%m-%d %H:%M:%S"),
+                                               {field: (None if np.isnan(record[field]) else float(record[field]))
+                                                for field in SENSOR_VALUE_FIELDS}))
+        return len(records)
+
+sensor_store = SensorStore(SENSOR_STORE_DIR) # センサーログの保存先
+
+# --- センサーデータの集計 (ロールアップ) ---
+SENSOR_ROLLUP_RESOLUTIONS = {'1m': 60, '5m': 300, '1h': 3600, '1d': 86400} # 集計の粒度 (秒)
+SENSOR_HISTORY_MAX_POINTS = 2000 # resolution=auto の時に返す最大バケット数の目安
+
+class SensorRollups:
+    """
+    センサーデータを粒度 (1分/5分/1時間/1日) ごとのバケットに集計して保持するクラス
+    
+    バケットごとに各値の min / max / 合計 / 件数 を持ち、レコードが追記されるたびに
+    該当するバケットだけを更新する。履歴の問い合わせは集計済みの配列を二分探索で
+    切り出すだけなので、生ログを読み直す必要はない。
+    バケットの境界はローカル時刻 (1日 = 0時〜24時) に揃える。
+    """
+
+    STATS = ('min', 'max', 'sum', 'count')
+
+    def __init__(self, store, resolutions=SENSOR_ROLLUP_RESOLUTIONS):
+        self.store = store
+        self.resolutions = dict(resolutions)
+        self._lock = threading.Lock()
+        self._built = False
+        self._series = {} # 粒度名 -> {'keys': int64配列, 'stats': (n, 4, 値の数) 配列, 'size': 使用中の件数}
+
+    @staticmethod
+    def _bucket_keys(ts, seconds):
+        """UNIX秒の配列をローカル時刻に揃えたバケット開始時刻に変換する"""
+        ts = np.asarray(ts, dtype=np.int64)
+        offsets = np.array([time.localtime(int(t)).tm_gmtoff for t in ts], dtype=np.int64)
+        return (ts + offsets) // seconds * seconds - offsets
+
+    def ensure_built(self):
+        """まだ集計していなければ、ストアの全レコードから集計を作る"""
+        with self._lock:
+            if not self._built:
+                self._build(self.store.read())
+                self._built = True
+
+    def _build(self, records):
+        """レコードの配列からすべての粒度の集計をまとめて作る"""
+        values = np.stack([np.asarray(records[f], dtype=np.float64) for f in SENSOR_VALUE_FIELDS], axis=1) \
+            if len(records) else np.empty((0, len(SENSOR_VALUE_FIELDS)))
+        valid = ~np.isnan(values)
+        for name, seconds in self.resolutions.items():
+            keys, inverse = np.unique(self._bucket_keys(records['ts'], seconds), return_inverse=True)
+            stats = np.empty((len(keys), 4, values.shape[1]))
+            stats[:, 0] = np.inf
+            stats[:, 1] = -np.inf
+            stats[:, 2:] = 0
+            np.minimum.at(stats[:, 0], inverse, np.where(valid, values, np.inf))
+            np.maximum.at(stats[:, 1], inverse, np.where(valid, values, -np.inf))
+            np.add.at(stats[:, 2], inverse, np.where(valid, values, 0))
+            np.add.at(stats[:, 3], inverse, valid)
+            self._series[name] = {'keys': keys, 'stats': stats, 'size': len(keys)}
+
+    def add(self, record):
+        """
+        追記された1件のレコードで、該当するバケットを更新する
+        
+        Args:
+            record (numpy.ndarray): SENSOR_RECORD_DTYPE のレコード (長さ1の配列)
+        """
+        self.ensure_built()
+        ts = int(record['ts'][0])
+        values = np.array([float(record[f][0]) for f in SENSOR_VALUE_FIELDS])
+        valid = ~np.isnan(values)
+        with self._lock:
+            for name, seconds in self.resolutions.items():
+                key = int(self._bucket_keys([ts], seconds)[0])
+                series = self._series[name]
+                size = series['size']
+                keys = series['keys']
+                # 通常は最後のバケットの更新か、末尾への追加になる
+                pos = size - 1 if size and keys[size - 1] == key else int(np.searchsorted(keys[:size], key))
+                if pos >= size or keys[pos] != key:
+                    self._insert_bucket(series, pos, key)
+                bucket = series['stats'][pos]
+                bucket[0] = np.where(valid, np.minimum(bucket[0], values), bucket[0])
+                bucket[1] = np.where(valid, np.maximum(bucket[1], values), bucket[1])
+                bucket[2] += np.where(valid, values, 0)
+                bucket[3] += valid
+
+    @staticmethod
+    def _insert_bucket(series, pos, key):
+        """pos の位置に空のバケットを挿入する (配列は倍々で確保して追加のコストを抑える)"""
+        size = series['size']
+        if size == len(series['keys']):
+            capacity = max(16, size * 2)
+            keys = np.empty(capacity, dtype=np.int64)
+            stats = np.empty((capacity,) + series['stats'].shape[1:])
+            keys[:size] = series['keys'][:size]
+            stats[:size] = series['stats'][:size]
+            series['keys'], series['stats'] = keys, stats
+        keys, stats = series['keys'], series['stats']
+        # 時刻が巻き戻った場合 (NTP同期前など) だけ途中への挿入になる
+        keys[pos + 1:size + 1] = keys[pos:size].copy()
+        stats[pos + 1:size + 1] = stats[pos:size].copy()
+        keys[pos] = key
+        stats[pos, 0] = np.inf
+        stats[pos, 1] = -np.inf
+        stats[pos, 2:] = 0
+        series['size'] = size + 1
+
+    def choose_resolution(self, start_ts, end_ts):
+        """期間に対して、バケット数が SENSOR_HISTORY_MAX_POINTS 以下になる最も細かい粒度を選ぶ"""
+        span = max(end_ts - start_ts, 0)
+        for name, seconds in sorted(self.resolutions.items(), key=lambda item: item[1]):
+            if span / seconds <= SENSOR_HISTORY_MAX_POINTS:
+                return name
+        return max(self.resolutions, key=self.resolutions.get)
+
+    def query(self, start_ts, end_ts, resolution, selected_fields=None, selected_stats=None):
+        """
+        [start_ts, end_ts) に始まるバケットの集計を列ごとの配列で返す
+        
+        Args:
+            selected_fields (set, optional): 返す値の名前 (省略時はすべて)
+            selected_stats (set, optional): 返す統計量 (min/max/mean/count。省略時はすべて)
+
+        Returns:
+            dict: {'resolution', 'from', 'to', 'buckets': [開始時刻...], 'fields': {値名: {'min', 'max', 'mean', 'count'}}}
+        """
+        self.ensure_built()
+        with self._lock:
+            series = self._series[resolution]
+            keys = series['keys'][:series['size']]
+            lo = int(np.searchsorted(keys, start_ts, side='left'))
+            hi = int(np.searchsorted(keys, end_ts, side='left'))
+            bucket_keys = keys[lo:hi].copy()
+            stats = series['stats'][lo:hi].copy()
+
+        counts = stats[:, 3]
+        has_data = counts > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = stats[:, 2] / counts
+
+        def as_list(column):
+            """配列を小数第2位に丸めたリストにする (データなしは JSON の null)"""
+            values = np.round(column, 2).astype(object)
+            values[~np.isfinite(column)] = None
+            return values.tolist()
+
+        fields = {}
+        for i, field in enumerate(SENSOR_VALUE_FIELDS):
+            if selected_fields and field not in selected_fields:
+                continue
+            column_stats = {
+                'min': lambda: as_list(np.where(has_data[:, i], stats[:, 0, i], np.nan)),
+                'max': lambda: as_list(np.where(has_data[:, i], stats[:, 1, i], np.nan)),
+                'mean': lambda: as_list(means[:, i]),
+                'count': lambda: counts[:, i].astype(int).tolist(),
+            }
+            fields[field] = {name: make() for name, make in column_stats.items()
+                             if not selected_stats or name in selected_stats}
+        return {
+            'resolution': resolution,
+            'from': int(start_ts),
+            'to': int(end_ts),
+            'buckets': bucket_keys.tolist(),
+            'fields': fields,
+        }
+
+sensor_rollups = SensorRollups(sensor_store) # センサーデータの集計 (初回利用時にストアから作成)
+
+def format_sensor_csv_line(timestamp, data):
+    """センサーデータ1件をCSVの1行 (改行付き) に整形する"""
+    # データがNoneの場合は空文字にするヘルパー
+    def get_val(key, format_str="{:.2f}"):
+        val = data.get(key)
+        if val is None: return ""
+        if isinstance(val, str): return val
+        return format_str.format(val)
+
+    # 整数で記録している値 (照度レベル・カーテン開度) は小数点なしで出す
+    def get_int(key):
+        val = data.get(key)
+        if val is None: return ""
+        if isinstance(val, float) and val.is_integer(): return str(int(val))
+        return str(val)
+
+    return (
+        f"{timestamp},"
+        f"{get_val('local_temp')},"
+        f"{get_val('local_hum')},"
+        f"{get_val('local_pres')},"
+        f"{get_val('local_lux')},"
+        f"{get_val('hub_temp')},"
+        f"{get_val('hub_hum')},"
+        f"{get_int('hub_lux')},"
+        f"{get_int('tuya_curtain_percent')}\n"
+    )
+
 def write_log(timestamp, data):
-    """センサーデータをローカルのCSVファイルに追記する"""
-    header = "timestamp,local_temp_c,local_humidity_percent,local_pressure_hpa,local_light_lux,hub_temp_c,hub_humidity_percent,hub_light_level,tuya_curtain_percent\n"
-    # ファイルがなければヘッダーを書き込む
-    if not os.path.exists(CSV_FILE_PATH):
-        with open(CSV_FILE_PATH, "w") as f:
-            f.write(header)
-            
-    # データをCSV形式で追記
-    with open(CSV_FILE_PATH, "a") as f:
-        # データがNoneの場合は空文字にするヘルパー
-        def get_val(key, format_str="{:.2f}"):
-            val = data.get(key)
-            if val is None: return ""
-            if isinstance(val, str): return val
-            return format_str.format(val)
+    """
+    センサーデータを時系列ストア (sensor_store) に追記し、集計 (sensor_rollups) を更新する
+    (SENSOR_LOG_CSV_MIRROR が True の場合は、従来のCSVにも追記する)
+    
+    Args:
+        timestamp (str or datetime): 記録時刻 ("%Y-%m-%d %H:%M:%S" 形式の文字列も可)
+        data (dict): get_all_sensor_data() 形式のセンサーデータ
+    """
+    if isinstance(timestamp, str):
+        timestamp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+    record = sensor_store.append(timestamp, data)
+    # 履歴APIの集計も、追記した1件分だけ更新する
+    sensor_rollups.add(record)
+
+    if SENSOR_LOG_CSV_MIRROR:
+        # ファイルがなければヘッダーを書き込む
+        if not os.path.exists(CSV_FILE_PATH):
+            with open(CSV_FILE_PATH, "w") as f:
+                f.write(SENSOR_CSV_HEADER)
+        # データをCSV形式で追記
+        with open(CSV_FILE_PATH, "a") as f:
+            f.write(format_sensor_csv_line(timestamp.strftime("%Y-%m-%d %H:%M:%S"), data))
+
+def migrate_sensor_csv_if_needed():
+    """ストアがまだ作られていなければ、既存のセンサーログCSVを一度だけ取り込む"""
+    if os.path.isdir(SENSOR_STORE_DIR) or not os.path.exists(CSV_FILE_PATH):
+        return
+    print(f"[Init] Importing '{CSV_FILE_PATH}' into sensor store '{SENSOR_STORE_DIR}'...")
+    count = sensor_store.import_csv(CSV_FILE_PATH)
+    print(f"[Init] Imported {count} sensor records.")
+
+def init_sensor_store():
+    """起動時の時系列ストアの準備 (CSVからの移行と、履歴APIの集計の作成)"""
+    # 時系列ストアがまだなければ、既存のセンサーログCSVを取り込む (初回のみ)
+    migrate_sensor_csv_if_needed()
+    # 履歴APIの集計をストアから作っておく (以降は記録のたびに差分更新)
+    sensor_rollups.ensure_built()
+
+class TrainingSpool:
+    """
+    AI学習データの追記専用スプール (PCが停止していても学習データを失わないため)
+    
+    学習データは送信前に必ず TRAINING_SPOOL_PATH (1行1件のJSON) に追記し、fsyncする。
+    PCへの送信に成功した位置 (バイトオフセット) を .offset ファイルに記録し、
+    すべて送り終えたらスプールを空にする。
+    
+    バッチ送信の形式 (PCのAIサーバー側 /add_training_data_batch):
+        POST, Content-Type: application/json, Content-Encoding: gzip
+        本文: {"batch_id": "<スプール内の開始位置>", "records": [<add_training_data と同じ形式>, ...]}
+        成功時は 2xx を返す。同じ batch_id が再送されることがある (応答が届かなかった場合) ので、
+        サーバー側で重複を除外できるようにしている。
+    404/405/501 が返った場合 (バッチ未対応のサーバー) は1件ずつ /add_training_data に送る。
+    """
+
+    def __init__(self, path=TRAINING_SPOOL_PATH):
+        self.path = path
+        self.offset_path = path + '.offset'
+        self._lock = threading.Lock()        # スプールファイルの追記・切り詰め用
+        self._drain_lock = threading.Lock()  # 送信処理は同時に1つだけ
+        self._repaired = False
+
+    def _read_offset(self):
+        try:
+            with open(self.offset_path, 'r', encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_offset(self, offset):
+        tmp_path = self.offset_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+
+    def _repair_tail(self):
+        """書き込み途中で停止した場合に残る、改行で終わらない最終行を取り除く"""
+        if self._repaired or not os.path.exists(self.path):
+            self._repaired = True
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+        self._repaired = True
+
+    def append(self, record):
+        """学習データを1件スプールに追記する"""
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._repair_tail()
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def pending_count(self):
+        """まだ送信していない件数"""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return 0
+            with open(self.path, 'rb') as f:
+                f.seek(self._read_offset())
+                return f.read().count(b'\n')
+
+    def _read_batch(self, offset, max_records):
+        """offset から最大 max_records 件を読み込む ([(次のオフセット, レコード)], 終端のオフセット)"""
+        entries = []
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while len(entries) < max_records:
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    break # 書き込み途中の行は次回に回す
+                offset += len(line)
+                try:
+                    entries.append((offset, json.loads(line)))
+                except ValueError:
+                    print(f"[AI Training] Skipping a corrupt spool line at offset {offset - len(line)}.")
+        return entries, offset
+
+    def drain(self, min_records=0):
+        """
+        スプールの未送信データをPCに送る (バッチ単位。送信済みの位置を記録しながら進める)
         
-        # ログエントリーの文字列を作成
-        log_entry = (
-            f"{timestamp},"
-            f"{get_val('local_temp')},"
-            f"{get_val('local_hum')},"
-            f"{get_val('local_pres')},"
-            f"{get_val('local_lux')},"
-            f"{get_val('hub_temp')},"
-            f"{get_val('hub_hum')},"
-            f"{data.get('hub_lux', '')},"
-            f"{data.get('tuya_curtain_percent', '')}\n"
-        )
-        f.write(log_entry)
+        Args:
+            min_records (int, optional): 未送信がこの件数に満たなければ送らない
+        Returns:
+            int: 送信した件数
+        """
+        if not self._drain_lock.acquire(blocking=False):
+            return 0 # 他のスレッドが送信中
+        sent = 0
+        try:
+            if min_records and self.pending_count() < min_records:
+                return sent
+            base_url = PC_AI_SERVER_URL.rsplit('/', 1)[0]
+            while True:
+                with self._lock:
+                    if not os.path.exists(self.path):
+                        return sent
+                    start = self._read_offset()
+                    entries, end = self._read_batch(start, TRAINING_BATCH_MAX_RECORDS)
+                if not entries:
+                    if end != start:
+                        self._write_offset(end) # 壊れた行だけだった場合
+                    self._compact_if_drained()
+                    return sent
+
+                records = [record for _, record in entries]
+                body = gzip.compress(json.dumps({'batch_id': f"{os.path.basename(self.path)}:{start}", 'records': records}).encode('utf-8'))
+                response = http_client.post('ai.training_batch', f"{base_url}/add_training_data_batch", data=body,
+                                            headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'},
+                                            timeout=(HTTP_LAN_CONNECT_TIMEOUT, 30))
+                if response.status_code in (404, 405, 501):
+                    # バッチ未対応のサーバー: 1件ずつ送る (送れた分だけ位置を進める)
+                    for next_offset, record in entries:
+                        single = http_client.post('ai.training', f"{base_url}/add_training_data", json=record,
+                                                  timeout=(HTTP_LAN_CONNECT_TIMEOUT, 10))
+                        single.raise_for_status()
+                        self._write_offset(next_offset)
+                        sent += 1
+                else:
+                    response.raise_for_status()
+                    self._write_offset(end)
+                    sent += len(records)
+                print(f"[AI Training] Uploaded {sent} spooled records.")
+        except requests.exceptions.RequestException as e:
+            print(f"[AI Training] Upload paused; records stay in the spool: {e}")
+            return sent
+        except OSError as e:
+            # スプール・送信位置ファイルの読み書き失敗 (ディスクがいっぱい等)
+            log_action('System', 'AI学習', f'学習データのスプールの読み書きに失敗: {e}')
+            return sent
+        finally:
+            self._drain_lock.release()
+
+    def _compact_if_drained(self):
+        """すべて送信済みならスプールを空にする"""
+        with self._lock:
+            if os.path.exists(self.path) and self._read_offset() >= os.path.getsize(self.path):
+                open(self.path, 'w').close()
+                self._write_offset(0)
+
+training_spool = TrainingSpool()
 
 def send_data_to_pc_for_training(log_data):
-    """(ログ記録ONの時) 学習用データをPCのAIサーバーに送信する"""
+    """
+    (ログ記録ONの時) 学習用データをスプールに追記する
+    送信は TRAINING_BATCH_MIN_RECORDS 件溜まってからまとめて行う (1件ごとには送らない)。
+    PCが停止中のデータはスプールに残り、接続が戻ったときに check_ai_connection_loop が送信する
+    """
     try:
         training_data = log_data.copy()
         
@@ -851,71 +3301,74 @@ def send_data_to_pc_for_training(log_data):
         # 不要なキーを削除
         training_data.pop("tuya_curtain_position", None)
         
-        # PCサーバーの学習用エンドポイントURL (/add_training_data) を生成
-        base_url = PC_AI_SERVER_URL.rsplit('/', 1)[0]
-        training_url = f"{base_url}/add_training_data"
-        
-        print(f"[AI Training] Sending data to {training_url}")
-        # データをJSON形式でPOST送信
-        response = requests.post(training_url, json=training_data, timeout=10)
-        response.raise_for_status() # エラーチェック
-        
+        training_spool.append(training_data)
     except Exception as e:
-        # PCへの送信失敗
-        log_action('System', 'AI学習', f'PCへのデータ送信に失敗: {e}')
+        # スプールへの書き込み失敗 (ディスクがいっぱい等)
+        log_action('System', 'AI学習', f'学習データの保存に失敗: {e}')
+        return
+
+    if state_store.get('ai_connected'):
+        training_spool.drain(min_records=TRAINING_BATCH_MIN_RECORDS)
 
 def show_ai_indicator_on_lcd():
     """LCDの右上に'*AI*'と2秒間だけ表示して、AIの動作を通知する (未使用)"""
     if lcd:
         try:
-            original_pos = lcd.cursor_pos # 元のカーソル位置を保存
-            lcd.cursor_pos = (1, 12)
-            lcd.write_string("*AI*")
+            with lcd_lock:
+                original_pos = lcd.cursor_pos # 元のカーソル位置を保存
+                lcd.cursor_pos = (1, 12)
+                lcd.write_string("*AI*")
             time.sleep(2)
-            lcd.cursor_pos = (1, 12) # 同じ位置に
-            lcd.write_string("    ") # スペースを書いて消す
-            lcd.cursor_pos = original_pos # カーソル位置を戻す
+            with lcd_lock:
+                lcd.cursor_pos = (1, 12) # 同じ位置に
+                lcd.write_string("    ") # スペースを書いて消す
+                lcd.cursor_pos = original_pos # カーソル位置を戻す
         except Exception as e:
             print(f"[LCD] AIインジケーターの表示に失敗: {e}")
 
-def get_data_for_ai():
+def build_ai_data(sensor_data, now=None):
     """
-    AI制御に必要な形式でセンサーデータを取得・整形する
+    get_all_sensor_data() 形式のセンサーデータを、AIサーバーの入力形式に変換する
     
+    Args:
+        sensor_data (dict): get_all_sensor_data() 形式の辞書
+        now (datetime, optional): 特徴量 (時・月) に使う時刻
     Returns:
         dict or None: AIサーバーの入力形式に合わせたセンサーデータ
     """
-    local_temp, local_hum, local_pres = read_bme280()
-    local_lux = read_bh1750()
-    hub_status = get_hub_status()
-    hub_temp = hub_status.get("temperature") if hub_status else None
-    hub_hum = hub_status.get("humidity") if hub_status else None
-    hub_lux = hub_status.get("lightLevel") if hub_status else None
-    now = datetime.now()
-    
-    sensor_data = {
+    now = now or datetime.now()
+    ai_data = {
         'hour': now.hour, 
         'month': now.month, 
-        'local_temp_c': local_temp,
-        'local_humidity_percent': local_hum, 
-        'local_pressure_hpa': local_pres,
-        'local_light_lux': local_lux, 
-        'hub_temp_c': hub_temp,
-        'hub_humidity_percent': hub_hum, 
-        'hub_light_level': hub_lux
+        'local_temp_c': sensor_data.get('local_temp'),
+        'local_humidity_percent': sensor_data.get('local_hum'), 
+        'local_pressure_hpa': sensor_data.get('local_pres'),
+        'local_light_lux': sensor_data.get('local_lux'), 
+        'hub_temp_c': sensor_data.get('hub_temp'),
+        'hub_humidity_percent': sensor_data.get('hub_hum'), 
+        'hub_light_level': sensor_data.get('hub_lux')
     }
     
     # 必須のセンサーデータが1つでもNone (取得失敗) だったら、制御は実行しない
-    if any(v is None for v in sensor_data.values()):
+    if any(v is None for v in ai_data.values()):
         print("[AI] センサーデータの一部が取得できませんでした。")
         return None
     
     # データを丸めて (小数点第1位) 送信
-    for key, value in sensor_data.items():
+    for key, value in ai_data.items():
         if isinstance(value, float):
-            sensor_data[key] = round(value, 1)
+            ai_data[key] = round(value, 1)
+
+    return ai_data
 
-    return sensor_data
+def get_data_for_ai():
+    """
+    AI制御に必要な形式でセンサーデータを取得・整形する
+    
+    Returns:
+        dict or None: AIサーバーの入力形式に合わせたセンサーデータ
+    """
+    return build_ai_data(get_all_sensor_data())
 
 def operate_curtain_from_ai(predicted_label):
     """
@@ -924,7 +3377,6 @@ def operate_curtain_from_ai(predicted_label):
     Args:
         predicted_label (int): AIサーバーが返した制御ラベル (0:set0, 1:set25, ...)
     """
-    global last_curtain_position_command
 
     # AIのラベル (0-4) とシーン名のマッピング
     label_to_scene = {
@@ -944,7 +3396,7 @@ def operate_curtain_from_ai(predicted_label):
 
     # --- 制御スキップ処理 ---
     # 最後に実行したシーン (手動またはAI) と同じであれば、操作をスキップする
-    if target_scene == last_curtain_position_command:
+    if target_scene == state_store.get('last_curtain_command'):
         print(f"[AI] シーン '{target_scene}' は既に実行済みのためスキップします。")
         return
 
@@ -953,9 +3405,8 @@ def operate_curtain_from_ai(predicted_label):
     # --- 音声案内処理 ---
     target_percent = label_to_percent.get(predicted_label)
     if target_percent is not None:
-        message = f"カーテンを{target_percent}パーセントの位置に自動制御します"
-        # 音声再生は時間がかかるため、別スレッドで実行 (daemon=True)
-        threading.Thread(target=speak_message, args=(message,), daemon=True).start()
+        # 再生スレッドに渡すだけで、再生の終了は待たない
+        speak_message(AI_CURTAIN_ANNOUNCEMENT.format(percent=target_percent))
         # 音声が少し先に始まってからカーテンが動き出すように、0.5秒待つ
         time.sleep(0.5) 
     
@@ -963,7 +3414,294 @@ def operate_curtain_from_ai(predicted_label):
     execute_scene(target_scene, triggered_by='ai')
     
     # 最後に実行したシーンを記録
-    last_curtain_position_command = target_scene
+    state_store.update(last_curtain_command=target_scene)
+
+
+# --- ローカルモデル (PCのAIサーバーに接続できない場合の代替) ---
+LOCAL_MODEL_LABEL_PERCENTS = (0, 25, 50, 75, 100) # ラベル (0-4) に対応するカーテン位置 (%)
+# build_ai_data() のキーと、時系列ストアの列の対応
+AI_FEATURE_FIELDS = {
+    'local_temp_c': 'local_temp',
+    'local_humidity_percent': 'local_hum',
+    'local_pressure_hpa': 'local_pres',
+    'local_light_lux': 'local_lux',
+    'hub_temp_c': 'hub_temp',
+    'hub_humidity_percent': 'hub_hum',
+    'hub_light_level': 'hub_lux',
+}
+
+def build_model_features(columns):
+    """
+    AI入力形式の列 (hour, month, local_temp_c, ...) からローカルモデルの特徴量行列を作る
+    時・月は周期性を表すため sin/cos に、照度は桁が大きく変わるため log1p に変換する
+    
+    Args:
+        columns (dict): build_ai_data() と同じキーで、値はスカラーまたは配列
+    Returns:
+        numpy.ndarray: (サンプル数, 特徴量数) の行列
+    """
+    col = lambda key: np.atleast_1d(np.asarray(columns[key], dtype=np.float64))
+    hour, month = col('hour'), col('month')
+    return np.column_stack([
+        np.sin(2 * np.pi * hour / 24), np.cos(2 * np.pi * hour / 24),
+        np.sin(2 * np.pi * month / 12), np.cos(2 * np.pi * month / 12),
+        col('local_temp_c'), col('local_humidity_percent'), col('local_pressure_hpa'),
+        np.log1p(np.maximum(col('local_light_lux'), 0)),
+        col('hub_temp_c'), col('hub_humidity_percent'), col('hub_light_level'),
+        col('local_temp_c') - col('hub_temp_c'), # 室内と窓際の温度差 (学習データ送信時と同じ特徴量)
+    ])
+
+def training_columns_from_records(records):
+    """
+    時系列ストアのレコードから、ローカルモデルの学習データ (AI入力形式の列, ラベル) を作る
+    カーテン位置が 0/25/50/75/100% のいずれかで、センサー値がすべて揃っているレコードだけを使う
+    
+    Returns:
+        (dict, numpy.ndarray): (build_ai_data() と同じキーの列, ラベル 0-4)
+    """
+    usable = np.isin(records['tuya_curtain_percent'], LOCAL_MODEL_LABEL_PERCENTS)
+    for field in AI_FEATURE_FIELDS.values():
+        usable &= np.isfinite(records[field])
+    records = records[usable]
+    columns = {key: records[field].astype(np.float64) for key, field in AI_FEATURE_FIELDS.items()}
+    times = [datetime.fromtimestamp(int(ts)) for ts in records['ts']]
+    columns['hour'] = np.array([t.hour for t in times], dtype=np.int64)
+    columns['month'] = np.array([t.month for t in times], dtype=np.int64)
+    labels = (records['tuya_curtain_percent'] / 25).astype(np.int64)
+    return columns, labels
+
+class LocalCurtainModel:
+    """
+    NumPyだけで動く多クラスロジスティック回帰 (softmax) のカーテン位置分類器
+    
+    PCのAIサーバーと同じく 0〜4 のラベル (operate_curtain_from_ai() の入力) を返す。
+    重みは LOCAL_MODEL_PATH (.npz) に保存し、起動時に読み込む。
+    PCのAIサーバーが応答したときはローカルモデルの判定と比べ、一致率を記録する。
+    """
+
+    def __init__(self, path=LOCAL_MODEL_PATH):
+        self.path = path
+        self.weights = None   # (特徴量数 + 1, クラス数) バイアス込み
+        self.mean = None
+        self.std = None
+        self.info = {}        # 学習日時・サンプル数・検証精度など
+        self._lock = threading.Lock()
+        self.agreement = np.zeros((5, 5), dtype=np.int64) # [PCのラベル, ローカルのラベル] の件数
+
+    def is_ready(self):
+        return self.weights is not None
+
+    def load(self):
+        """保存済みの重みを読み込む (ファイルがなければFalse)"""
+        if not os.path.exists(self.path):
+            return False
+        with np.load(self.path) as data:
+            with self._lock:
+                self.weights, self.mean, self.std = data['weights'], data['mean'], data['std']
+                self.info = json.loads(str(data['info']))
+        print(f"[AI] Local model loaded ({self.info.get('samples')} samples, accuracy {self.info.get('validation_accuracy')}).")
+        return True
+
+    def save(self):
+        tmp_path = self.path + '.tmp.npz'
+        np.savez(tmp_path, weights=self.weights, mean=self.mean, std=self.std, info=json.dumps(self.info))
+        os.replace(tmp_path, self.path)
+
+    def train(self, features, labels, iterations=LOCAL_MODEL_TRAIN_ITERATIONS, learning_rate=0.5, l2=1e-3,
+              validation_ratio=0.2):
+        """
+        全件の勾配降下法で学習する (ラズパイでも数秒で終わる規模)
+        学習データの一部 (validation_ratio) を検証用に取り分け、精度を info に記録してから全件で学習し直す
+        
+        Returns:
+            dict: 学習結果 (info)
+        """
+        if len(labels) < LOCAL_MODEL_MIN_SAMPLES:
+            raise ValueError(f"Not enough labelled samples to train ({len(labels)} < {LOCAL_MODEL_MIN_SAMPLES}).")
+        order = np.random.default_rng(0).permutation(len(labels))
+        cut = int(len(labels) * (1 - validation_ratio))
+        train_idx, valid_idx = order[:cut], order[cut:]
+
+        weights, mean, std = self._fit(features[train_idx], labels[train_idx], iterations, learning_rate, l2)
+        predicted = self._predict_with(weights, mean, std, features[valid_idx]).argmax(axis=1)
+        accuracy = float((predicted == labels[valid_idx]).mean())
+        majority = float((labels[valid_idx] == np.bincount(labels[train_idx]).argmax()).mean())
+
+        weights, mean, std = self._fit(features, labels, iterations, learning_rate, l2)
+        with self._lock:
+            self.weights, self.mean, self.std = weights, mean, std
+            self.info = {
+                'trained_at': datetime.now().isoformat(timespec='seconds'),
+                'samples': int(len(labels)),
+                'class_counts': np.bincount(labels, minlength=5).tolist(),
+                'validation_accuracy': round(accuracy, 4),
+                'majority_baseline': round(majority, 4), # 常に最多ラベルを答えた場合の精度 (比較用)
+            }
+        return self.info
+
+    @staticmethod
+    def _fit(features, labels, iterations, learning_rate, l2):
+        mean = features.mean(axis=0)
+        std = features.std(axis=0) + 1e-9
+        x = np.hstack([(features - mean) / std, np.ones((len(features), 1))])
+        onehot = np.eye(5)[labels]
+        weights = np.zeros((x.shape[1], 5))
+        for _ in range(iterations):
+            probs = LocalCurtainModel._softmax(x @ weights)
+            weights -= learning_rate * (x.T @ (probs - onehot) / len(x) + l2 * weights)
+        return weights, mean, std
+
+    @staticmethod
+    def _softmax(z):
+        z = z - z.max(axis=1, keepdims=True)
+        e = np.exp(z)
+        return e / e.sum(axis=1, keepdims=True)
+
+    @staticmethod
+    def _predict_with(weights, mean, std, features):
+        x = (features - mean) / std
+        return LocalCurtainModel._softmax(x @ weights[:-1] + weights[-1])
+
+    def predict_proba(self, features):
+        """特徴量行列から各ラベルの確率を返す"""
+        with self._lock:
+            weights, mean, std = self.weights, self.mean, self.std
+        return self._predict_with(weights, mean, std, features)
+
+    def predict(self, ai_data):
+        """
+        build_ai_data() 形式の1件からラベルを判定する
+        
+        Returns:
+            (int, float): (ラベル 0-4, そのラベルの確率)
+        """
+        probs = self.predict_proba(build_model_features(ai_data))[0]
+        label = int(probs.argmax())
+        return label, float(probs[label])
+
+    def record_agreement(self, remote_label, local_label):
+        """PCのAIサーバーの判定とローカルモデルの判定の組を記録する"""
+        if remote_label in range(5) and local_label in range(5):
+            self.agreement[remote_label, local_label] += 1
+
+    def agreement_report(self, matrix=None):
+        """PCのAIサーバーとの一致率と混同行列 (行: PC、列: ローカル) を返す"""
+        matrix = self.agreement if matrix is None else matrix
+        total = int(matrix.sum())
+        return {
+            'compared': total,
+            'agreement': round(float(np.trace(matrix)) / total, 4) if total else None,
+            'confusion_matrix': matrix.tolist(),
+        }
+
+local_model = LocalCurtainModel()
+
+def train_local_model():
+    """時系列ストアのデータでローカルモデルを学習し、保存する"""
+    columns, labels = training_columns_from_records(sensor_store.read())
+    info = local_model.train(build_model_features(columns), labels)
+    local_model.save()
+    print(f"[AI] Local model trained: {info}")
+    return info
+
+def init_local_model():
+    """起動時にローカルモデルを読み込む (保存済みのものがなければ学習する)"""
+    try:
+        if not local_model.load():
+            train_local_model()
+    except Exception as e:
+        print(f"[Warning] Local model is not available: {e}")
+
+def predict_curtain_label(ai_data):
+    """
+    制御ラベル (0-4) を判定する
+    PCのAIサーバーに問い合わせ、接続できない・応答が遅い場合はローカルモデルで判定する
+    
+    Returns:
+        (int or None, str or None): (ラベル, 判定元 'remote' / 'local')
+    """
+    try:
+        response = http_client.post('ai.predict', PC_AI_SERVER_URL, json=ai_data,
+                                    timeout=(HTTP_LAN_CONNECT_TIMEOUT, AI_PREDICT_TIMEOUT_SECONDS), retries=0)
+        response.raise_for_status() # エラーチェック
+        result = response.json()
+        print(f"[AI] PCから制御位置を受信: {result}")
+        remote_label = result.get('predicted_label')
+        if remote_label is not None and local_model.is_ready():
+            local_model.record_agreement(remote_label, local_model.predict(ai_data)[0])
+        return remote_label, 'remote'
+    except (requests.exceptions.RequestException, ValueError) as e:
+        # AIサーバーへの接続失敗 (LED点滅処理は check_ai_connection_loop が担当)
+        logging.error(f"Failed to connect to PC AI server: {e}")
+
+    if not local_model.is_ready():
+        return None, None
+    label, probability = local_model.predict(ai_data)
+    print(f"[AI] ローカルモデルで判定しました: ラベル {label} (確率 {probability:.2f})")
+    log_action('AI', 'AI判定', f'PCに接続できないためローカルモデルで判定 (ラベル {label})')
+    return label, 'local'
+
+def local_model_report(samples=LOCAL_MODEL_REPORT_SAMPLES):
+    """
+    ローカルモデルの推論速度・メモリ使用量と、PCのAIサーバーとの一致率を測る (--local-model-report 用)
+    一致率は時系列ストアの直近 samples 件をPCのAIサーバーとローカルモデルの両方で判定して比べる
+    """
+    import tracemalloc
+    import resource
+
+    if not local_model.load():
+        train_local_model()
+    columns, labels = training_columns_from_records(sensor_store.read())
+    if len(labels) == 0:
+        raise ValueError("No labelled samples in the sensor store.")
+    recent_columns = {key: values[-samples:] for key, values in columns.items()}
+    recent_labels = labels[-samples:]
+    recent = build_model_features(recent_columns)
+    local_labels = local_model.predict_proba(recent).argmax(axis=1)
+
+    # 1件ずつの推論時間 (自動制御と同じ使い方)
+    single = recent[-1:]
+    durations = []
+    for _ in range(1000):
+        started = time.perf_counter()
+        local_model.predict_proba(single)
+        durations.append((time.perf_counter() - started) * 1e6)
+    durations.sort()
+
+    tracemalloc.start()
+    local_model.predict_proba(recent)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    report = {
+        'model': local_model.info,
+        'inference_us': {'mean': round(sum(durations) / len(durations), 1),
+                         'p50': round(durations[len(durations) // 2], 1),
+                         'p99': round(durations[int(len(durations) * 0.99)], 1)},
+        'model_bytes': int(local_model.weights.nbytes + local_model.mean.nbytes + local_model.std.nbytes),
+        'batch_predict_peak_bytes': {'samples': int(len(recent)), 'bytes': int(peak)},
+        'process_max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'label_accuracy_on_recent': round(  # 直近のデータも学習に使っているので参考値
+            float((local_labels == recent_labels).mean()), 4),
+    }
+
+    # PCのAIサーバーとの一致率 (接続できない場合は省略)
+    matrix = np.zeros((5, 5), dtype=np.int64)
+    for i, local_label in enumerate(local_labels):
+        ai_data = {key: round(values[i].item(), 1) for key, values in recent_columns.items()} # build_ai_data() と同じく丸める
+        try:
+            response = http_client.post('ai.predict', PC_AI_SERVER_URL, json=ai_data,
+                                        timeout=(HTTP_LAN_CONNECT_TIMEOUT, AI_PREDICT_TIMEOUT_SECONDS), retries=0)
+            response.raise_for_status()
+            remote_label = response.json().get('predicted_label')
+        except (requests.exceptions.RequestException, ValueError) as e:
+            report['remote_agreement'] = {'error': str(e)}
+            break
+        if remote_label in range(5):
+            matrix[remote_label, local_label] += 1
+    else:
+        report['remote_agreement'] = local_model.agreement_report(matrix)
+    return report
 
 
 # ==============================================================================
@@ -975,169 +3713,253 @@ def auto_control_loop():
     (AUTO_CONTROL_INTERVAL_SECONDS ごとに実行)
     """
 
-    global last_ai_control_time
-
     print("[AI] 自動制御ループを開始します。")
     while True:
         # 自動モードがONの時だけ実行
-        if is_auto_mode:
+        if state_store.get('auto_mode'):
             print("[AI] 自動モードON。センサーデータを取得し制御を実行します。")
             sensor_data = get_data_for_ai() # AI用のデータを取得
             
             if sensor_data:
-                try:
-                    # PCのAIサーバーにデータをPOST送信
-                    response = requests.post(PC_AI_SERVER_URL, json=sensor_data, timeout=15)
-                    response.raise_for_status() # エラーチェック
-                    result = response.json()
-                    print(f"[AI] PCから制御位置を受信: {result}")
-                    
-                    # 'predicted_label' キーがあれば制御を実行
-                    predicted_label = result.get('predicted_label')
-                    if predicted_label is not None:
-                        operate_curtain_from_ai(predicted_label)
-                        
-                except requests.exceptions.RequestException as e:
-                    # AIサーバーへの接続失敗 (LED点滅処理は check_ai_connection_loop が担当)
-                    logging.error(f"Failed to connect to PC AI server: {e}")
+                # PCのAIサーバーで判定 (接続できない・応答が遅い場合はローカルモデル)
+                predicted_label, _ = predict_curtain_label(sensor_data)
+                if predicted_label is not None:
+                    operate_curtain_from_ai(predicted_label)
 
         # 次の実行までのカウントダウン表示用に、現在時刻を記録
-        last_ai_control_time = time.time()
+        state_store.update(last_ai_control_time=time.time()) # Web UI のカウントダウンもこれで合わせ直す
 
         # 次の制御実行まで待機
         time.sleep(AUTO_CONTROL_INTERVAL_SECONDS)
 
 def projector_status_loop():
     """
-    バックグラウンドでプロジェクターの状態を定期的に取得・更新するスレッド
-    (30秒ごとに実行)
+    CecMonitor の見張りスレッド
+    cec-client が終了していれば起動し直し、30秒ごとに電源状態を問い合わせる
+    (問い合わせは常駐中のセッションに書き込むだけで、新しいプロセスは起動しない)
     """
-    global current_projector_status
+    retry_wait = 5
     while True:
-        status = get_projector_status()
-        # 取得に失敗('Error')した場合のみ、2秒後にもう一度だけ再試行
-        if status == 'Error':
-            time.sleep(2)
-            status = get_projector_status()
-        
-        current_projector_status = status # グローバル変数を更新
-        time.sleep(30) # 30秒待機
+        if not cec_monitor.is_running():
+            if cec_monitor.start():
+                retry_wait = 5
+            else:
+                # cec-client が起動できない場合は間隔を広げて再試行する
+                state_store.update(projector_status=cec_monitor.status_text())
+                time.sleep(retry_wait)
+                retry_wait = min(retry_wait * 2, 300)
+                continue
+        cec_monitor.request_power_status()
+        time.sleep(CEC_POWER_QUERY_INTERVAL_SECONDS)
+        state_store.update(projector_status=cec_monitor.status_text()) # 応答がない場合に "N/A" へ落とすため
 
 def check_ai_connection_loop():
     """
     バックグラウンドでAIサーバーへの接続を定期的に確認するスレッド
     (60秒ごとに実行)
     """
-    global is_ai_connected
     while True:
-        previous_status = is_ai_connected # 前回の接続状態
         try:
             # PCサーバーの/pingエンドポイントに接続試行
             ping_url = PC_AI_SERVER_URL.replace('/predict', '/ping')
-            response = requests.get(ping_url, timeout=5)
-            is_ai_connected = (response.status_code == 200) # 200 OK なら接続成功
+            response = http_client.get('ai.ping', ping_url, timeout=(HTTP_LAN_CONNECT_TIMEOUT, 5), retries=0)
+            connected = (response.status_code == 200) # 200 OK なら接続成功
         except requests.exceptions.RequestException:
-            is_ai_connected = False # タイムアウト等は接続失敗
+            connected = False # タイムアウト等は接続失敗
         
-        # 状態が変化した瞬間にログを記録
-        if is_ai_connected != previous_status:
-            status_text = "接続" if is_ai_connected else "切断"
+        # 状態が変化した瞬間にログを記録 (LEDは状態の変化に応じて更新される)
+        _, changed = state_store.update(ai_connected=connected)
+        if changed:
+            status_text = "接続" if connected else "切断"
             log_action('AI', '接続', f'AIサーバー{status_text}')
         
-        # LEDの状態を更新 (自動モードONかつ接続NGなら点滅)
-        update_auto_mode_led()
+        # 接続が戻ったら、スプールに溜まった学習データを送信する
+        # (接続中は、前回の送信に失敗して TRAINING_BATCH_MIN_RECORDS 件以上残っている場合のみ)
+        if connected:
+            min_records = 0 if 'ai_connected' in changed else TRAINING_BATCH_MIN_RECORDS
+            training_upload_executor.submit(training_spool.drain, min_records)
         
         time.sleep(60) # 60秒待機
 
-def background_tasks_loop():
-    """
-    メインのバックグラウンドタスク (キーパッド監視, LCD更新, ログ記録)
-    このスレッドはビジーループ (time.sleep(0.05)) で高速に回り、キー入力を検知する
+class KeypadDriver:
     """
-    global is_curtain_logging_paused, is_auto_mode, latest_sensor_data, last_log_time
-    
-    last_lcd_update = 0 # 最後のLCD更新時刻
+    4x4キーパッドを割り込み (GPIOのエッジ検出) で読み取るドライバー
     
-    # 平均値計算用のサンプリング設定
-    last_sampling_time = 0 # 最後のサンプリング時刻
-    sampling_interval = 10 # 10秒間隔
-    # データ蓄積用リスト
-    sensor_samples = {
-        "temp": [], "hum": [], "pres": [], "lux": []
-    }
+    待機中はすべての列(COL)ピンをHIGHにしておき、キーが押されて行(ROW)ピンが
+    HIGHになった立ち上がりエッジで RPi.GPIO のコールバックが呼ばれる。
+    コールバックでは一定時間待って (チャタリングが収まってから) 押されたままかを確かめ、
+    列を1本ずつHIGHにして押されたキーを特定し、key_queue に (キー, 検出時刻) を積む。
+    キーを押し続けても新しい立ち上がりエッジは来ないので、ループが待たされることはない。
+    エッジ検出が使えない環境では、押しっぱなしで止まらないポーリングに切り替える。
+    """
 
-    print("\n[Main] Background task loop started. Ready for input.")
-    update_led_status() # LEDの初期状態を更新
+    def __init__(self, key_queue, debounce_ms=KEYPAD_DEBOUNCE_MS, settle_seconds=KEYPAD_SETTLE_SECONDS):
+        self.key_queue = key_queue
+        self.debounce_ms = debounce_ms
+        self.settle_seconds = settle_seconds
+        self._scan_lock = threading.Lock()
+        self._ignore_until = 0      # 自分のスキャンで発生したエッジを無視する期限
+        self.mode = None            # 'interrupt' または 'polling'
+
+    def start(self):
+        """エッジ検出を登録する (失敗したらポーリングスレッドを起動する)"""
+        self._set_columns(GPIO.HIGH)
+        try:
+            for row_pin in KEYPAD_ROW_PINS:
+                GPIO.add_event_detect(row_pin, GPIO.RISING, callback=self._on_row_edge,
+                                      bouncetime=self.debounce_ms)
+            self.mode = 'interrupt'
+            print("[Keypad] Edge-triggered keypad driver started.")
+        except RuntimeError as e:
+            # カーネルやライブラリの都合でエッジ検出が使えない場合
+            for row_pin in KEYPAD_ROW_PINS:
+                try:
+                    GPIO.remove_event_detect(row_pin)
+                except RuntimeError:
+                    pass
+            self.mode = 'polling'
+            print(f"[Keypad] Edge detection unavailable ({e}). Falling back to polling.")
+            threading.Thread(target=self._poll_loop, name='KeypadPoller', daemon=True).start()
+
+    def _set_columns(self, level):
+        """すべての列(COL)ピンを同じレベルにする"""
+        for col_pin in KEYPAD_COL_PINS:
+            GPIO.output(col_pin, level)
 
-    while True:
-        # --- 1. キーパッドのスキャン ---
+    def _scan_matrix(self, idle_level):
+        """
+        列を1本ずつHIGHにして押されているキーを探す
+        
+        Args:
+            idle_level: スキャン後に列ピンを戻すレベル
+        Returns:
+            str or None: 押されているキー (複数ある場合は最初の1つ)
+        """
         key_pressed = None
-        # 列(COL)ピンを順番にHIGHにする
+        self._set_columns(GPIO.LOW)
         for c, col_pin in enumerate(KEYPAD_COL_PINS):
             GPIO.output(col_pin, GPIO.HIGH)
-            # 行(ROW)ピンの入力をチェック
             for r, row_pin in enumerate(KEYPAD_ROW_PINS):
                 if GPIO.input(row_pin) == GPIO.HIGH: # 押された！
                     key_pressed = KEYPAD_MAP[r][c] # 押されたキーを特定
-                    # キーが離されるまで待つ (チャタリング防止)
-                    while GPIO.input(row_pin) == GPIO.HIGH:
-                        time.sleep(0.1)
                     break
-            GPIO.output(col_pin, GPIO.LOW) # 次の列のスキャンのためLOWに戻す
+            GPIO.output(col_pin, GPIO.LOW)
             if key_pressed:
-                break # 1ループで1キーのみ処理
-        
-        # --- 2. キー入力の処理 ---
+                break
+        self._set_columns(idle_level)
+        return key_pressed
+
+    def _on_row_edge(self, row_pin):
+        """行ピンの立ち上がりエッジで呼ばれるコールバック (RPi.GPIOのイベントスレッドで実行)"""
+        detected_at = time.monotonic()
+        if detected_at < self._ignore_until:
+            return # 直前のスキャンで列を切り替えたことによるエッジ
+        with self._scan_lock:
+            # チャタリングが収まるのを待ち、まだ押されているかを確認する (ノイズ除去)
+            time.sleep(self.settle_seconds)
+            if GPIO.input(row_pin) != GPIO.HIGH:
+                return
+            key_pressed = self._scan_matrix(GPIO.HIGH)
+            # 列を戻した瞬間に押されたままの行で立ち上がりエッジが出るので、しばらく無視する
+            self._ignore_until = time.monotonic() + self.debounce_ms / 1000
         if key_pressed:
-            # シーン実行キー
-            scene_map = {"1":"set0", "2":"set25", "3":"set50", "4":"set75", "5":"set100"}
-            # その他機能キー
-            assigned_keys = list(scene_map.keys()) + ['*', '0', '7', '8', '9', 'C', '#', 'D']
-            
-            if key_pressed in assigned_keys:
-                beep() # キー入力音
-                scene_to_run = scene_map.get(key_pressed)
-
-                if scene_to_run:
-                    execute_scene(scene_to_run) # シーン実行 (ログは関数内)
-                elif key_pressed == '7':
-                    log_action('Keypad', 'HDMI切替', 'HDMI 1 に切替')
-                    scene_set_hdmi1()
-                elif key_pressed == '8':
-                    log_action('Keypad', 'HDMI切替', 'HDMI 2 に切替')
-                    scene_set_hdmi2()
-                elif key_pressed == '*':
-                    log_action('Keypad', 'プロジェクター', 'OFFを実行')
-                    control_projector_off()
-                elif key_pressed == '0':
-                    log_action('Keypad', 'プロジェクター', 'ONを実行')
-                    control_projector_activate()
-                elif key_pressed == '9':
-                    is_auto_mode = True
-                    log_action('Keypad', 'モード切替', '「自動モード」に切替')
-                    update_auto_mode_led()
-                elif key_pressed == 'C':
-                    is_auto_mode = False
-                    log_action('Keypad', 'モード切替', '「手動モード」に切替')
-                    update_auto_mode_led()
-                elif key_pressed == '#':
-                    is_curtain_logging_paused = True
-                    log_action('Keypad', 'データ記録', '「OFF」に切替')
-                    update_led_status()
-                elif key_pressed == 'D':
-                    is_curtain_logging_paused = False
-                    log_action('Keypad', 'データ記録', '「ON」に切替')
-                    update_led_status()
-                
-                last_lcd_update = 0 # キー操作後はすぐにLCDを更新させる
+            self.key_queue.put((key_pressed, detected_at))
+
+    def _poll_loop(self):
+        """エッジ検出が使えない場合のポーリング (押しっぱなしでも待たずに次の周期へ進む)"""
+        held_key = None
+        while True:
+            with self._scan_lock:
+                key_pressed = self._scan_matrix(GPIO.LOW)
+            # 押された瞬間 (前回は押されていなかった) だけをキー入力として扱う
+            if key_pressed and key_pressed != held_key:
+                self.key_queue.put((key_pressed, time.monotonic()))
+            held_key = key_pressed
+            time.sleep(KEYPAD_POLL_INTERVAL_SECONDS)
+
+keypad_event_queue = queue.Queue()  # キーパッドのキー入力イベント (キー, 検出時刻)
+keypad_driver = KeypadDriver(keypad_event_queue)
+lcd_refresh_event = threading.Event() # セットするとLCDをすぐに更新する
+
+def handle_keypad_key(key_pressed):
+    """
+    キーパッドで押されたキーに対応する操作を実行する
+    
+    Args:
+        key_pressed (str): 押されたキー (KEYPAD_MAP の文字)
+    """
+    # シーン実行キー
+    scene_map = {"1":"set0", "2":"set25", "3":"set50", "4":"set75", "5":"set100"}
+    # その他機能キー
+    assigned_keys = list(scene_map.keys()) + ['*', '0', '7', '8', '9', 'C', '#', 'D']
+    
+    if key_pressed not in assigned_keys:
+        return
 
-        # --- 3. LCDの更新 (5秒ごと) ---
-        if time.time() - last_lcd_update > 5:
-            if lcd:
-                try:
-                    curtain_status = get_tuya_curtain_status()
-                    proj_status = get_projector_status() # プロジェクター状態はLCD更新のたびに取得
-                    
+    beep() # キー入力音
+    scene_to_run = scene_map.get(key_pressed)
+
+    if scene_to_run:
+        execute_scene(scene_to_run) # シーン実行 (ログは関数内)
+    elif key_pressed == '7':
+        log_action('Keypad', 'HDMI切替', 'HDMI 1 に切替')
+        scene_engine.start('hdmi1')
+    elif key_pressed == '8':
+        log_action('Keypad', 'HDMI切替', 'HDMI 2 に切替')
+        scene_engine.start('hdmi2')
+    elif key_pressed == '*':
+        log_action('Keypad', 'プロジェクター', 'OFFを実行')
+        scene_engine.start('projector_off')
+    elif key_pressed == '0':
+        log_action('Keypad', 'プロジェクター', 'ONを実行')
+        scene_engine.start('projector_on')
+    # モード・データ記録の切替 (LEDは状態の変化に応じて更新される)
+    elif key_pressed == '9':
+        state_store.update(auto_mode=True)
+        log_action('Keypad', 'モード切替', '「自動モード」に切替')
+    elif key_pressed == 'C':
+        state_store.update(auto_mode=False)
+        log_action('Keypad', 'モード切替', '「手動モード」に切替')
+    elif key_pressed == '#':
+        state_store.update(logging_paused=True)
+        log_action('Keypad', 'データ記録', '「OFF」に切替')
+    elif key_pressed == 'D':
+        state_store.update(logging_paused=False)
+        log_action('Keypad', 'データ記録', '「ON」に切替')
+    
+    lcd_refresh_event.set() # キー操作後はすぐにLCDを更新させる
+
+def keypad_dispatch_loop():
+    """
+    キー入力イベントを順番に取り出して処理するスレッド
+    (キーの検出は KeypadDriver、処理はこのスレッドと役割を分けている)
+    """
+    print("[Keypad] Key dispatcher started. Ready for input.")
+    while True:
+        key_pressed, detected_at = keypad_event_queue.get()
+        try:
+            handle_keypad_key(key_pressed)
+        except Exception as e:
+            print(f"[Error] Failed to handle key '{key_pressed}': {e}")
+
+def background_tasks_loop():
+    """
+    メインのバックグラウンドタスク (LCD更新)
+    5秒ごと、またはキー操作の直後 (lcd_refresh_event) にLCDの表示を更新する
+    ※ キーパッドは KeypadDriver と keypad_dispatch_loop、センサーの読み取り・ログ記録は
+      sensor_pipeline_loop が担当するので、このループが入力やネットワーク通信を待たせることはない
+    """
+    print("\n[Main] Background task loop started.")
+    update_led_status() # LEDの初期状態を更新
+
+    while True:
+        # --- LCDの更新 (5秒ごと、またはキー操作の直後) ---
+        if lcd:
+            try:
+                curtain_status = get_tuya_curtain_status()
+                proj_status = get_projector_status() # CecMonitor のキャッシュを読むだけ
+                
+                with lcd_lock:
                     lcd.clear()
                     lcd.cursor_pos = (0, 0) # 1行目
                     if curtain_status['state'] == 'active':
@@ -1147,84 +3969,103 @@ def background_tasks_loop():
 
                     lcd.cursor_pos = (1, 0) # 2行目
                     lcd.write_string(f"Projector: {proj_status}")
-                except Exception as e:
-                    print(f"[Error] Failed to update LCD: {e}")
-            last_lcd_update = time.time() # 更新時刻を記録
-        
-        # I2Cセンサーの10秒サンプリング処理
-        if time.time() - last_sampling_time >= sampling_interval:
-            # I2Cセンサーから読み取り
+            except Exception as e:
+                print(f"[Error] Failed to update LCD: {e}")
+
+        # 次の更新まで待機 (キー操作があれば待たずに更新)
+        lcd_refresh_event.wait(timeout=5)
+        lcd_refresh_event.clear()
+
+def collect_sensor_log_data(sensor_samples):
+    """
+    ログ記録用のセンサーデータを取得し、I2Cセンサーの値を蓄積した平均値で置き換える
+    (蓄積用リストは平均を計算した後にクリアする)
+    
+    Args:
+        sensor_samples (dict): sensor_pipeline_loop が10秒ごとに蓄積したI2Cセンサーの値
+    Returns:
+        dict: get_all_sensor_data() 形式のセンサーデータ
+    """
+    # 1. すべてのセンサーデータを取得 (ハブなどは瞬時値、ローカルは後で上書き)
+    data = get_all_sensor_data()
+
+    # 2. I2Cセンサーデータを蓄積された平均値で上書き
+    # リストにデータがあれば平均値を計算し、リストをクリアしてリセットする
+    for sample_key, data_key in (("temp", "local_temp"), ("hum", "local_hum"),
+                                 ("pres", "local_pres"), ("lux", "local_lux")):
+        samples = sensor_samples[sample_key]
+        if samples:
+            data[data_key] = sum(samples) / len(samples)
+            sensor_samples[sample_key] = []
+    return data
+
+def sensor_pipeline_loop():
+    """
+    センサー取得のバックグラウンドスレッド
+    - 10秒ごとにI2Cセンサー (BME280, BH1750) を読み取って蓄積
+    - LOG_INTERVAL_SECONDS ごとに平均値とハブの値をまとめて記録し、学習データを送信
+    キーパッドのスレッドとは独立しているので、ハブやPCへの通信が遅くてもキー入力は止まらない
+    """
+    global last_log_time
+
+    # 平均値計算用のサンプリング設定
+    sampling_interval = 10 # 10秒間隔
+    # データ蓄積用リスト
+    sensor_samples = {
+        "temp": [], "hum": [], "pres": [], "lux": []
+    }
+
+    print("[Sensor] Sensor pipeline started.")
+    while True:
+        loop_start = time.time()
+
+        try:
+            # --- 1. I2Cセンサーの10秒サンプリング処理 ---
             t, h, p = read_bme280()
             l = read_bh1750()
-            
+        
             # 取得できた場合のみリストに追加
             if t is not None: sensor_samples["temp"].append(t)
             if h is not None: sensor_samples["hum"].append(h)
             if p is not None: sensor_samples["pres"].append(p)
             if l is not None: sensor_samples["lux"].append(l)
-            
-            last_sampling_time = time.time()
 
-        # --- 4. センサーログの記録 (LOG_INTERVAL_SECONDS ごと) ---
-        if time.time() - last_log_time >= LOG_INTERVAL_SECONDS:
-            current_time_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            print(f"\n[{current_time_str}] Starting periodic data log...")
-            
-            # 1. すべてのセンサーデータを取得 (ハブなどは瞬時値、ローカルは後で上書き)
-            data_for_csv = get_all_sensor_data()
-
-            # I2Cセンサーデータを蓄積された平均値で上書き
-            # リストにデータがあれば平均値を計算し、リストをクリアしてリセットする
-            if sensor_samples["temp"]:
-                data_for_csv["local_temp"] = sum(sensor_samples["temp"]) / len(sensor_samples["temp"])
-                sensor_samples["temp"] = []
+            # --- 2. センサーログの記録 (LOG_INTERVAL_SECONDS ごと) ---
+            if time.time() - last_log_time >= LOG_INTERVAL_SECONDS:
+                now = datetime.now()
+                current_time_str = now.strftime("%Y-%m-%d %H:%M:%S")
+                print(f"\n[{current_time_str}] Starting periodic data log...")
             
-            if sensor_samples["hum"]:
-                data_for_csv["local_hum"] = sum(sensor_samples["hum"]) / len(sensor_samples["hum"])
-                sensor_samples["hum"] = []
-
-            if sensor_samples["pres"]:
-                data_for_csv["local_pres"] = sum(sensor_samples["pres"]) / len(sensor_samples["pres"])
-                sensor_samples["pres"] = []
-
-            if sensor_samples["lux"]:
-                data_for_csv["local_lux"] = sum(sensor_samples["lux"]) / len(sensor_samples["lux"])
-                sensor_samples["lux"] = []
+                # 2-1. センサーデータを取得 (ハブへの問い合わせとI2Cの読み取りは並行して行う)
+                data_for_csv = collect_sensor_log_data(sensor_samples)
 
-            # 2. 取得したデータをAPI配信用にグローバル変数へコピー
-            latest_sensor_data = data_for_csv.copy()
+                # 2-2. 取得したデータをAPI配信用に state_store へ保存
+                state_store.update(latest_sensor_data=data_for_csv)
             
-            # 3. ローカルのCSVファイルに記録
-            write_log(current_time_str, data_for_csv)
+                # 2-3. 時系列ストアに記録
+                write_log(current_time_str, data_for_csv)
             
-            # 4. (ログ記録ONの時のみ) PCへ学習データを送信
-            if not is_curtain_logging_paused:
-                data_for_ai = get_data_for_ai() # AI送信用の形式で再取得
-                
-                # get_data_for_aiはread_bme280を再実行してしまうため、
-                # ここで計算した平均値(data_for_csv)で値を差し替える
-                if data_for_ai:
-                    data_for_ai['local_temp_c'] = round(data_for_csv['local_temp'], 1) if data_for_csv['local_temp'] else None
-                    data_for_ai['local_humidity_percent'] = round(data_for_csv['local_hum'], 1) if data_for_csv['local_hum'] else None
-                    data_for_ai['local_pressure_hpa'] = round(data_for_csv['local_pres'], 1) if data_for_csv['local_pres'] else None
-                    data_for_ai['local_light_lux'] = round(data_for_csv['local_lux'], 1) if data_for_csv['local_lux'] else None
-
-                curtain_pos = data_for_csv.get('tuya_curtain_percent')
-
-                # データが正しく取れた場合のみ送信
-                if data_for_ai and isinstance(curtain_pos, (int, float)):
-                    log_for_pc = data_for_ai.copy()
-                    log_for_pc['timestamp'] = current_time_str
-                    log_for_pc['tuya_curtain_percent'] = curtain_pos
-                    send_data_to_pc_for_training(log_for_pc)
+                # 2-4. (ログ記録ONの時のみ) PCへ学習データを送信
+                if not state_store.get('logging_paused'):
+                    # ハブへ再度問い合わせることはせず、今回取得した値 (I2Cは平均値) から作る
+                    data_for_ai = build_ai_data(data_for_csv, now)
+                    curtain_pos = data_for_csv.get('tuya_curtain_percent')
+
+                    # データが正しく取れた場合のみ送信 (送信は別スレッドで行い、ここでは待たない)
+                    if data_for_ai and isinstance(curtain_pos, (int, float)):
+                        log_for_pc = data_for_ai.copy()
+                        log_for_pc['timestamp'] = current_time_str
+                        log_for_pc['tuya_curtain_percent'] = curtain_pos
+                        training_upload_executor.submit(send_data_to_pc_for_training, log_for_pc)
             
-            print(f"[{current_time_str}] Data logged (Average of 5min).")
-            last_log_time = time.time() # 更新時刻を記録
-
-        # --- 5. メインループの待機 ---
-        # 0.05秒待機 (CPU使用率を抑えつつ、キー入力に即座に反応できる程度)
-        time.sleep(0.05)
+                print(f"[{current_time_str}] Data logged (Average of 5min).")
+                last_log_time = time.time() # 更新時刻を記録
+        except Exception as e:
+            # 例外でスレッドが終了すると記録が止まったままになるので、表示して次の周期も続ける
+            print(f"[Error] Sensor pipeline iteration failed: {e}")
 
+        # --- 3. 次のサンプリングまで待機 ---
+        time.sleep(max(0, sampling_interval - (time.time() - loop_start)))
 
 # ==============================================================================
 # 12. Flask Webサーバー (ルーティング)
@@ -1242,42 +4083,144 @@ def index():
     # templates/index.html をレンダリングして返す
     return render_template('index.html')
 
-@app.route('/status', methods=['GET'])
-def get_status_for_app():
-    """ Web UI (JavaScript) から非同期で呼び出され、最新の状態をJSONで返す """
-    # プロジェクターがOFFの時は、HDMI入力状態を '---' にする
-    hdmi_status = current_hdmi_input if current_projector_status == 'ON' else '---'
-    
-    curtain_status = get_tuya_curtain_status()
+class VersionedJsonCache:
+    """
+    版番号ごとにJSONの応答本文をキャッシュし、ETag (If-None-Match) による条件付き応答を行うクラス
     
-    # AI自動制御の残り時間を計算する
-    # last_ai_control_time と AUTO_CONTROL_INTERVAL_SECONDS を使用
-    elapsed = time.time() - last_ai_control_time
-    remaining = AUTO_CONTROL_INTERVAL_SECONDS - elapsed
+    版番号が変わるまでは同じ本文 (bytes) を返すので、ポーリングのたびにシリアライズし直さない。
+    クライアントが前回の ETag を送ってきた場合は、本文を作らずに 304 Not Modified を返す。
+    """
 
-    # マイナス（計算誤差や実行中）の場合は0にする
-    if remaining < 0: remaining = 0
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._version = None
+        self._body = None
+
+    def etag(self, version):
+        # 再起動で版番号が0に戻っても前の ETag と一致しないように、state_store の起動ごとの識別子を含める
+        # (本番モードでは全ワーカーが同じ識別子を共有するので、どのワーカーに当たっても同じ ETag になる)
+        return f"{self.name}-{state_store.epoch}-{version}"
+
+    def body(self, version, build):
+        """版番号 version の本文を返す (キャッシュが古い場合だけ build() の結果をJSONに変換する)"""
+        with self._lock:
+            if self._version != version:
+                self._body = json.dumps(build(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                self._version = version
+            return self._body
+
+    def not_modified(self, version):
+        """リクエストの If-None-Match が version の ETag と一致すれば 304 応答を返す (一致しなければ None)"""
+        etag = self.etag(version)
+        if request.if_none_match.contains(etag):
+            return self._response(b'', version, status=304)
+        return None
 
-    # グローバル変数に保持されている最新の状態を返す
-    return jsonify({
-        'curtain_position': curtain_status['position'],
-        'projector_status': current_projector_status,
+    def _response(self, body, version, status=200):
+        response = Response(body, status=status, mimetype='application/json')
+        response.set_etag(self.etag(version))
+        response.headers['Cache-Control'] = 'no-cache' # 使う前に必ず確認させる
+        return response
+
+    def respond(self, version, build, suffix=None):
+        """
+        条件付きのJSON応答を返す
+        
+        Args:
+            version (int): 本文の元データの版番号 (ETag になる)
+            build (callable): 本文の辞書を作る関数 (版が変わったときだけ呼ばれる)
+            suffix (dict, optional): キャッシュせず毎回末尾に足す項目 (ETag には含めない)
+        """
+        response = self.not_modified(version)
+        if response is not None:
+            return response
+        body = self.body(version, build)
+        if suffix:
+            # キャッシュした本文の閉じ括弧の前に差し込む
+            extra = json.dumps(suffix, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            body = body[:-1] + (b',' if len(body) > 2 else b'') + extra[1:]
+        return self._response(body, version)
+
+# Web UI の表示に使う state_store のキー (これらが変わらない限り /status の ETag は同じ)
+UI_STATE_KEYS = ('curtain', 'projector_status', 'hdmi_input', 'logging_paused', 'auto_mode',
+                 'ai_connected', 'last_ai_control_time')
+status_response_cache = VersionedJsonCache('status')
+sensor_data_response_cache = VersionedJsonCache('sensor')
+
+def build_ui_state(snapshot):
+    """Web UI に表示する状態 (time_remaining 以外) を state_store のスナップショットから作る"""
+    # プロジェクターがOFFの時は、HDMI入力状態を '---' にする
+    hdmi_status = snapshot['hdmi_input'] if snapshot['projector_status'] == 'ON' else '---'
+    return {
+        'curtain_position': snapshot['curtain']['position'],
+        'projector_status': snapshot['projector_status'],
         'hdmi_status': hdmi_status,
-        'logging_paused': is_curtain_logging_paused,
-        'auto_mode': is_auto_mode,
-        'ai_connection_status': is_ai_connected,
-        'time_remaining': int(remaining) # 次回AI自動制御の残り時間
-    })
+        'logging_paused': snapshot['logging_paused'],
+        'auto_mode': snapshot['auto_mode'],
+        'ai_connection_status': snapshot['ai_connected'],
+    }
+
+def get_ai_time_remaining(snapshot):
+    """次回のAI自動制御までの残り秒数"""
+    # last_ai_control_time と AUTO_CONTROL_INTERVAL_SECONDS を使用
+    elapsed = time.time() - snapshot['last_ai_control_time']
+    # マイナス（計算誤差や実行中）の場合は0にする
+    return int(max(AUTO_CONTROL_INTERVAL_SECONDS - elapsed, 0))
+
+@app.route('/status', methods=['GET'])
+def get_status_for_app():
+    """
+    Web UI (JavaScript) から非同期で呼び出され、最新の状態をJSONで返す (イベントストリームが使えない場合用)
+    表示する状態が前回から変わっていなければ 304 を返す
+    (time_remaining はブラウザ側でカウントダウンするので、AI制御の周期が変わった時だけ変わったとみなす)
+    """
+    # 1つのスナップショットから作るので、項目間で食い違うことはない
+    snapshot = state_store.snapshot()
+    return status_response_cache.respond(
+        snapshot.version_of(*UI_STATE_KEYS), lambda: build_ui_state(snapshot),
+        suffix={'time_remaining': get_ai_time_remaining(snapshot)}) # 次回AI自動制御の残り時間
+
+@app.route('/events', methods=['GET'])
+def ui_events():
+    """
+    Web UI 向けのイベントストリーム (Server-Sent Events)
+    接続直後に全項目を送り、その後は state_store が変わったときに、変わった項目だけを送る
+    (time_remaining は毎回含める)
+    """
+    def generate():
+        yield f"retry: {UI_EVENTS_RETRY_MS}\n\n" # 切断時にブラウザが再接続するまでの時間
+        snapshot = state_store.snapshot()
+        sent_state, sent_cycle = {}, None
+        while True:
+            state = build_ui_state(snapshot)
+            diff = {key: value for key, value in state.items() if key not in sent_state or sent_state[key] != value}
+            if diff or snapshot['last_ai_control_time'] != sent_cycle:
+                diff['time_remaining'] = get_ai_time_remaining(snapshot)
+                yield f"id: {snapshot.version}\ndata: {json.dumps(diff, ensure_ascii=False)}\n\n"
+                sent_state, sent_cycle = state, snapshot['last_ai_control_time']
+            new_snapshot = state_store.wait_for_change(snapshot.version, UI_EVENTS_KEEPALIVE_SECONDS)
+            if new_snapshot.version == snapshot.version:
+                yield ": keep-alive\n\n" # 切断を検知するため、変化がなくても定期的に書き込む
+            snapshot = new_snapshot
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/sensor_data', methods=['GET'])
 def get_sensor_data_api():
-    """ 外部 (PCなど) から最新のセンサーデータを取得するためのAPIエンドポイント """
+    """
+    外部 (PCなど) から最新のセンサーデータを取得するためのAPIエンドポイント
+    センサーデータが更新されるまでは同じ ETag を返し、If-None-Match が一致すれば 304 を返す
+    """
+    snapshot = state_store.snapshot()
+    latest_sensor_data = snapshot['latest_sensor_data']
     if not latest_sensor_data:
         # 起動直後などでまだデータがない場合
         return jsonify({"error": "No data available yet."}), 404
 
     # 外部APIの仕様に合わせてキー名を変更して返す
-    return jsonify({
+    return sensor_data_response_cache.respond(snapshot.version_of('latest_sensor_data'), lambda: {
         "outdoor_temp": latest_sensor_data.get('local_temp'),
         "outdoor_humidity": latest_sensor_data.get('local_hum'),
         "outdoor_pressure": latest_sensor_data.get('local_pres'),
@@ -1288,6 +4231,58 @@ def get_sensor_data_api():
         "curtain_position": latest_sensor_data.get('tuya_curtain_percent')
     })
 
+@app.route('/api/local_model', methods=['GET'])
+def get_local_model_api():
+    """ ローカルモデルの学習情報と、PCのAIサーバーとの一致率を返すAPIエンドポイント """
+    return jsonify({'ready': local_model.is_ready(), 'model': local_model.info,
+                    'agreement': local_model.agreement_report()})
+
+@app.route('/api/http_stats', methods=['GET'])
+def get_http_stats_api():
+    """ 外部HTTP通信のエンドポイントごとのレイテンシとサーキットブレーカーの状態を返すAPIエンドポイント """
+    return jsonify(http_client.stats())
+
+def parse_history_time(value, default):
+    """履歴APIの from / to (UNIX秒 または ISO 8601 形式の日時) をUNIX秒に変換する"""
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp() # 不正な形式なら ValueError
+
+@app.route('/api/sensor_history', methods=['GET'])
+def get_sensor_history_api():
+    """
+    センサーデータの履歴を集計済みのバケット (min/max/mean/count) で返すAPIエンドポイント
+    クエリパラメータ:
+        from, to: 期間 (UNIX秒 または "2025-11-01T00:00" 形式。省略時は直近24時間)
+        resolution: 1m / 5m / 1h / 1d / auto (省略時は auto)
+        fields: 返す値をカンマ区切りで指定 (例: local_temp,hub_temp。省略時はすべて)
+        stats: 返す統計量をカンマ区切りで指定 (例: mean,count。省略時はすべて)
+    """
+    now = time.time()
+    try:
+        end_ts = parse_history_time(request.args.get('to'), now)
+        start_ts = parse_history_time(request.args.get('from'), end_ts - 86400)
+    except ValueError:
+        return jsonify({"error": "Invalid 'from' or 'to'."}), 400
+    if start_ts > end_ts:
+        return jsonify({"error": "'from' must be earlier than 'to'."}), 400
+
+    resolution = request.args.get('resolution', 'auto')
+    if resolution == 'auto':
+        resolution = sensor_rollups.choose_resolution(start_ts, end_ts)
+    elif resolution not in SENSOR_ROLLUP_RESOLUTIONS:
+        return jsonify({"error": f"Invalid resolution. Use one of: auto, {', '.join(SENSOR_ROLLUP_RESOLUTIONS)}"}), 400
+
+    selected_fields = {f for f in request.args.get('fields', '').split(',') if f}
+    selected_stats = {f for f in request.args.get('stats', '').split(',') if f}
+    if selected_fields - set(SENSOR_VALUE_FIELDS) or selected_stats - {'min', 'max', 'mean', 'count'}:
+        return jsonify({"error": "Invalid 'fields' or 'stats'."}), 400
+
+    return jsonify(sensor_rollups.query(start_ts, end_ts, resolution, selected_fields, selected_stats))
+
 @app.route('/command/<scene_name>', methods=['POST'])
 def handle_command_from_app(scene_name):
     """ Web UI からのシーン実行リクエスト ( /command/set0 など) """
@@ -1298,60 +4293,86 @@ def handle_command_from_app(scene_name):
 @app.route('/logging/<action>', methods=['POST'])
 def control_logging_from_app(action):
     """ Web UI からのデータ記録ON/OFFリクエスト ( /logging/on または /logging/off ) """
-    global is_curtain_logging_paused
     beep()
     if action.lower() == 'on':
-        is_curtain_logging_paused = False
+        paused = False
         status_text = 'ON'
     elif action.lower() == 'off':
-        is_curtain_logging_paused = True
+        paused = True
         status_text = 'OFF'
     else:
         return jsonify({'status': 'error', 'message': 'Invalid action'}), 400
     
+    snapshot, _ = state_store.update(logging_paused=paused) # LEDは状態の変化に応じて更新される
     log_action('Web UI', 'データ記録', f'「{status_text}」に切替', ip_addr=request.remote_addr)
-    update_led_status() # LEDの状態を即時更新
-    return jsonify({'status': 'success', 'logging_paused': is_curtain_logging_paused})
+    return jsonify({'status': 'success', 'logging_paused': snapshot['logging_paused']})
+
+def render_log_table(header, rows):
+    """操作ログの行をHTMLテーブル (class="log-table") に変換する"""
+    parts = ['<table border="1" class="dataframe log-table">', '<thead>', '<tr style="text-align: left;">']
+    parts.extend(f'<th>{html.escape(name)}</th>' for name in header)
+    parts.extend(['</tr>', '</thead>', '<tbody>'])
+    for row in rows:
+        parts.append('<tr>' + ''.join(f'<td>{html.escape(value)}</td>' for value in row) + '</tr>')
+    parts.extend(['</tbody>', '</table>'])
+    return '\n'.join(parts)
+
+def parse_date_filter(value):
+    """'2025-10-08' (input type=date の形式) を 20251008 の整数に変換する (空・不正ならNone)"""
+    try:
+        return int(datetime.strptime(value, '%Y-%m-%d').strftime('%Y%m%d')) if value else None
+    except ValueError:
+        return None
 
 @app.route('/log')
 def view_log():
-    """ 操作ログ (log.html) を表示 """
-    # URLパラメータからページ番号を取得 (デフォルトは1ページ目)
+    """
+    操作ログ (log.html) を表示
+    索引 (action_log_index) を使い、表示するページの行だけをCSVの末尾側から読み出す
+    クエリパラメータ: page, source (操作元), type (種別), from / to (日付 YYYY-MM-DD)
+    """
+    # URLパラメータからページ番号と絞り込み条件を取得 (デフォルトは1ページ目・絞り込みなし)
     page = request.args.get('page', 1, type=int)
     per_page = 50 # 1ページあたりの表示件数
+    filters = {
+        'source': request.args.get('source', ''),
+        'type': request.args.get('type', ''),
+        'from': request.args.get('from', ''),
+        'to': request.args.get('to', ''),
+    }
+    # ページ移動のリンクに絞り込み条件を引き継ぐためのクエリ文字列
+    filter_query = urlencode({k: v for k, v in filters.items() if v})
+    sources, action_types = [], []
     
     try:
-        # CSVファイルをpandasで読み込む
         if not os.path.exists(LOG_CSV_FILE):
-            return render_template('log.html', log_table="<p>ログファイルがまだ作成されていません。</p>", current_page=1, has_next=False, has_prev=False)
+            return render_template('log.html', log_table="<p>ログファイルがまだ作成されていません。</p>", current_page=1, has_next=False, has_prev=False,
+                                   total_pages=0, filters=filters, filter_query=filter_query, sources=sources, action_types=action_types)
 
-        df = pd.read_csv(LOG_CSV_FILE, encoding='utf-8')
-        
-        # 新しいログが上に来るように逆順にする
-        df = df.iloc[::-1]
-        
-        # 全体の件数とページ数を計算
-        total_rows = len(df)
-        total_pages = math.ceil(total_rows / per_page)
-        
-        # 範囲外のページ指定対策
+        # 範囲外のページ指定対策 (下限)
         if page < 1: page = 1
-        if page > total_pages and total_pages > 0: page = total_pages
 
-        # 現在のページに必要なデータを切り出す (スライス)
-        start = (page - 1) * per_page
-        end = start + per_page
-        df_subset = df.iloc[start:end]
+        query = dict(source=filters['source'] or None, action_type=filters['type'] or None,
+                     date_from=parse_date_filter(filters['from']), date_to=parse_date_filter(filters['to']))
+        rows, total_rows = action_log_index.read_page(page, per_page, **query)
+        total_pages = math.ceil(total_rows / per_page)
         
-        # DataFrameをHTMLテーブルに変換
-        log_table = df_subset.to_html(index=False, justify='left', classes='log-table')
+        # 範囲外のページ指定対策 (上限)
+        if page > total_pages and total_pages > 0:
+            page = total_pages
+            rows, total_rows = action_log_index.read_page(page, per_page, **query)
+
+        # 行をHTMLテーブルに変換
+        log_table = render_log_table(action_log_index.read_header(), rows)
+        sources, action_types = action_log_index.choices()
         
         # 次へ・前へボタンの有効無効判定
         has_prev = (page > 1)
         has_next = (page < total_pages)
 
     except Exception as e:
-        log_table = f"<p>ログの読み込みに失敗しました: {e}</p>"
+        log_table = f"<p>ログの読み込みに失敗しました: {html.escape(str(e))}</p>"
+        total_pages = 0
         has_next = False
         has_prev = False
 
@@ -1359,20 +4380,23 @@ def view_log():
     return render_template('log.html', 
                            log_table=log_table, 
                            current_page=page, 
+                           total_pages=total_pages,
                            has_next=has_next, 
-                           has_prev=has_prev)
+                           has_prev=has_prev,
+                           filters=filters,
+                           filter_query=filter_query,
+                           sources=sources,
+                           action_types=action_types)
 
 @app.route('/mode/<new_mode>', methods=['POST'])
 def set_control_mode(new_mode):
     """ Web UI からのモード切替リクエスト ( /mode/auto または /mode/manual ) """
-    global is_auto_mode
-    is_auto_mode = (new_mode == 'auto')
-    mode_text = "自動" if is_auto_mode else "手動"
+    snapshot, _ = state_store.update(auto_mode=(new_mode == 'auto')) # LEDは状態の変化に応じて更新される
+    mode_text = "自動" if snapshot['auto_mode'] else "手動"
     
     log_action('Web UI', 'モード切替', f'「{mode_text}モード」に切替', ip_addr=request.remote_addr)
-    update_auto_mode_led() # LEDの状態を即時更新
     beep()
-    return jsonify({'status': 'success', 'auto_mode': is_auto_mode})
+    return jsonify({'status': 'success', 'auto_mode': snapshot['auto_mode']})
 
 @app.route('/projector/<action>', methods=['POST'])
 def handle_projector_command(action):
@@ -1380,10 +4404,10 @@ def handle_projector_command(action):
     beep()
     if action == 'on':
         log_action('Web UI', 'プロジェクター', 'ONを実行', ip_addr=request.remote_addr)
-        control_projector_activate()
+        scene_engine.start('projector_on')
     elif action == 'off':
         log_action('Web UI', 'プロジェクター', 'OFFを実行', ip_addr=request.remote_addr)
-        control_projector_off()
+        scene_engine.start('projector_off')
     return jsonify({'status': 'success'})
 
 @app.route('/hdmi/<port_name>', methods=['POST'])
@@ -1391,10 +4415,10 @@ def handle_hdmi_command(port_name):
     """ Web UI からのHDMI入力切替 ( /hdmi/hdmi1 または /hdmi/hdmi2 ) """
     beep()
     if port_name == 'hdmi1':
-        scene_set_hdmi1()
+        scene_engine.start('hdmi1')
         log_text = 'HDMI 1 に切替'
     elif port_name == 'hdmi2':
-        scene_set_hdmi2()
+        scene_engine.start('hdmi2')
         log_text = 'HDMI 2 に切替'
     else:
         return jsonify({'status': 'error', 'message': 'Invalid port'}), 400
@@ -1402,6 +4426,136 @@ def handle_hdmi_command(port_name):
     log_action('Web UI', 'HDMI切替', log_text, ip_addr=request.remote_addr)
     return jsonify({'status': 'success'})
 
+# --- 本番モード (--production) ---
+# ワーカーで処理せず、ハードウェアプロセスに転送するエンドポイント
+# (機器の操作・操作ログへの記録・カメラ・ハードウェアプロセスにしかない情報)
+HARDWARE_ENDPOINTS = {
+    'index', 'handle_command_from_app', 'control_logging_from_app', 'set_control_mode',
+    'handle_projector_command', 'handle_hdmi_command', 'video_feed',
+    'get_local_model_api', 'get_http_stats_api', 'get_sensor_history_api',
+}
+# 転送時に引き継がないヘッダー (接続ごとのもの・本文の長さや圧縮は転送先で決まる)
+PROXY_SKIP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'content-length', 'content-encoding', 'host'}
+hardware_session = None # ワーカーからハードウェアプロセスへの接続 (Keep-Alive)
+
+def proxy_to_hardware():
+    """
+    (ワーカーの before_request) HARDWARE_ENDPOINTS へのリクエストをハードウェアプロセスに転送する
+    それ以外のリクエスト (/status, /events, /api/sensor_data, /log, 静的ファイルなど) はワーカーで処理する
+    """
+    if request.endpoint not in HARDWARE_ENDPOINTS:
+        return None
+    headers = {key: value for key, value in request.headers.items() if key.lower() not in PROXY_SKIP_HEADERS}
+    headers['X-Forwarded-For'] = request.remote_addr # 操作ログに元のIPアドレスを記録するため
+    # 映像ストリームは終わりがないので読み取りタイムアウトなし
+    read_timeout = None if request.endpoint == 'video_feed' else 30
+    try:
+        upstream = hardware_session.request(
+            request.method, f"http://127.0.0.1:{HARDWARE_CONTROL_PORT}{request.full_path}",
+            headers=headers, data=request.get_data(), stream=True, allow_redirects=False,
+            timeout=(HTTP_LAN_CONNECT_TIMEOUT, read_timeout))
+    except requests.exceptions.RequestException as e:
+        return jsonify({'status': 'error', 'message': f'Hardware process unavailable: {e}'}), 503
+    response = Response(upstream.iter_content(chunk_size=None), status=upstream.status_code,
+                        headers=[(key, value) for key, value in upstream.headers.items()
+                                 if key.lower() not in PROXY_SKIP_HEADERS])
+    response.call_on_close(upstream.close)
+    return response
+
+class WebWorkerPool:
+    """
+    本番モードのWebワーカープロセスを起動・監視するクラス
+    
+    待ち受けソケットはハードウェアプロセスで1つだけ作り、各ワーカーに引き継ぐ (接続はカーネルが振り分ける)。
+    ワーカーは別のPythonプロセスなので、重いページの処理がキーパッドやセンサーのスレッドと
+    GIL を取り合うことはなく、PiのCPUコアに分散される。
+    """
+
+    def __init__(self, port=WEB_PORT):
+        self.port = port
+        self._sock = None
+        self._processes = []
+        self._stopping = threading.Event()
+
+    def start(self, workers):
+        self._sock = socket.create_server(('0.0.0.0', self.port), backlog=128)
+        self._processes = [self._spawn() for _ in range(workers)]
+        threading.Thread(target=self._supervise, daemon=True).start()
+        print(f"[Web] Started {workers} web workers on http://0.0.0.0:{self.port}")
+
+    def _spawn(self):
+        fd = self._sock.fileno()
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--web-worker', '--listen-fd', str(fd)],
+                                pass_fds=(fd,))
+
+    def _supervise(self):
+        """終了したワーカーを起動し直す"""
+        while not self._stopping.wait(WEB_WORKER_CHECK_SECONDS):
+            for i, process in enumerate(self._processes):
+                if process.poll() is not None and not self._stopping.is_set():
+                    print(f"[Web] Worker {process.pid} exited (code {process.returncode}). Restarting...")
+                    self._processes[i] = self._spawn()
+
+    def stop(self, timeout=5):
+        """すべてのワーカーを終了させる"""
+        self._stopping.set()
+        for process in self._processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in self._processes:
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self._processes = []
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+web_worker_pool = WebWorkerPool()
+
+def run_production_server(workers):
+    """
+    本番モードでWebサーバーを動かす (ハードウェアプロセスのメインスレッドで呼び出し、終了するまで戻らない)
+    - 状態を共有メモリ領域に書き出し、変わるたびに書き直す
+    - Webのワーカープロセスを起動する (公開ポートはワーカーが処理する)
+    - ワーカーから転送された操作を 127.0.0.1:HARDWARE_CONTROL_PORT で処理する
+    """
+    shared_state_segment.create(state_store.epoch)
+    state_store.subscribe(shared_state_segment.publish)
+    shared_state_segment.publish(state_store.snapshot())
+    web_worker_pool.start(workers)
+    # 転送元 (ワーカー) が付けた X-Forwarded-For を request.remote_addr に反映する
+    control_server = make_server('127.0.0.1', HARDWARE_CONTROL_PORT, ProxyFix(app, x_for=1), threaded=True)
+    print(f"[Main] Hardware control server listening on 127.0.0.1:{HARDWARE_CONTROL_PORT}")
+    control_server.serve_forever()
+
+def exit_when_orphaned(parent_pid):
+    """(ワーカー用) ハードウェアプロセスが終了していたら、このワーカーも終了する"""
+    while True:
+        time.sleep(1)
+        if os.getppid() != parent_pid:
+            print(f"[Web] Hardware process exited. Worker {os.getpid()} is shutting down.")
+            os._exit(0)
+
+def run_web_worker(listen_fd):
+    """本番モードのWebワーカープロセスの本体 (--web-worker で起動される。ハードウェアには触れない)"""
+    global state_store, hardware_session
+    os.nice(WEB_WORKER_NICE)
+    # 状態は共有メモリ領域から読む
+    state_store = SharedStateReader()
+    state_store.open()
+    action_log_index.read_only = True # 操作ログの索引ファイルはハードウェアプロセスだけが書く
+    hardware_session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=32)
+    hardware_session.mount('http://', adapter)
+    app.before_request(proxy_to_hardware)
+    threading.Thread(target=exit_when_orphaned, args=(os.getppid(),), daemon=True).start()
+
+    server = make_server('0.0.0.0', WEB_PORT, app, threaded=True, fd=listen_fd)
+    print(f"[Web] Worker {os.getpid()} ready.")
+    server.serve_forever()
+
 
 # ==============================================================================
 # 13. 天気情報 取得関数
@@ -1416,12 +4570,12 @@ def get_weather_info():
     headers = { 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36' }
 
     try:
-        response = requests.get(WEATHER_URL, headers=headers, timeout=10)
+        response = http_client.get('weather', WEATHER_URL, headers=headers, timeout=(3, 10))
         response.encoding = 'utf-8' # 文字コードをUTF-8に
         response.raise_for_status() # エラーチェック
         
         # BeautifulSoupでHTMLをパース
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = bs4.BeautifulSoup(response.text, 'html.parser')
 
         # 「今日」の天気情報が含まれるエリアをCSSセレクタで特定
         today_weather_area = soup.select_one('#main > div.forecastCity > table > tr > td:nth-child(1)')
@@ -1469,34 +4623,62 @@ def periodic_weather_updater():
 # ==============================================================================
 # 14. カメラ映像生成 (ストリーミング)
 # ==============================================================================
-def generate_frames():
+# 映像配信の設定
+VIDEO_FRAME_WIDTH = 1280        # カメラ映像の横幅
+VIDEO_FRAME_HEIGHT = 720        # カメラ映像の縦幅
+VIDEO_JPEG_QUALITY = 90         # JPEGエンコード品質 (クエリ指定がない場合)
+VIDEO_DEFAULT_FPS = 15          # 送出フレームレート (クエリ指定がない場合)
+VIDEO_MIN_FPS = 0.2             # 指定できるフレームレートの下限
+VIDEO_MAX_FPS = 30              # 指定できるフレームレートの上限
+VIDEO_MIN_WIDTH = 160           # 指定できる横幅の下限
+VIDEO_MAX_STREAMS = 4           # 同時に配信する映像ストリーム数の上限
+VIDEO_IDLE_STOP_SECONDS = 5     # 視聴者がいなくなってからカメラ読み取りを止めるまでの秒数
+
+def load_overlay_fonts():
     """
-    カメラからフレームを取得し、Pillowを使ってセンサー情報を描画して
-    Motion JPEG形式でyield (生成) する
+    オーバーレイ描画用のフォントを読み込んで辞書で返す
+    
+    Returns:
+        dict: 用途名 -> ImageFont のマッピング
     """
-    global latest_sensor_data, weather_data
-
-    # --- 描画設定 ---
     try:
         # 日本語表示用のフォント (Noto Sans CJK)
         # (事前に sudo apt-get install fonts-noto-cjk でインストールが必要)
         font_path = "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc"
-        font_time = ImageFont.truetype(font_path, 48)
-        font_main_label = ImageFont.truetype(font_path, 32)
-        font_main_value = ImageFont.truetype(font_path, 52)
-        font_main_unit = ImageFont.truetype(font_path, 32)
-        font_v_label = ImageFont.truetype(font_path, 40)
-        font_weather_temp_max = ImageFont.truetype(font_path, 38)
-        font_weather_temp_min = ImageFont.truetype(font_path, 38)
-        font_weather_slash = ImageFont.truetype(font_path, 38)
-        font_weather_text = ImageFont.truetype(font_path, 38)
+        return {
+            'time': ImageFont.truetype(font_path, 48),
+            'main_label': ImageFont.truetype(font_path, 32),
+            'main_value': ImageFont.truetype(font_path, 52),
+            'main_unit': ImageFont.truetype(font_path, 32),
+            'v_label': ImageFont.truetype(font_path, 40),
+            'weather_temp_max': ImageFont.truetype(font_path, 38),
+            'weather_temp_min': ImageFont.truetype(font_path, 38),
+            'weather_slash': ImageFont.truetype(font_path, 38),
+            'weather_text': ImageFont.truetype(font_path, 38),
+        }
     except IOError as e:
         # フォントが見つからない場合、デフォルトフォントで続行 (文字化けする)
         print(f"[CRITICAL ERROR] メインの日本語フォントが読み込めません: {e}")
         print("         (sudo apt-get install fonts-noto-cjk を確認してください)")
-        font_time, font_main_label, font_main_value, font_main_unit, font_v_label = (ImageFont.load_default(),) * 5
-        font_weather_temp_max, font_weather_temp_min, font_weather_slash, font_weather_text = (ImageFont.load_default(),) * 4
+        default_font = ImageFont.load_default()
+        return {name: default_font for name in (
+            'time', 'main_label', 'main_value', 'main_unit', 'v_label',
+            'weather_temp_max', 'weather_temp_min', 'weather_slash', 'weather_text')}
 
+def render_overlay_layer(width, height, fonts, s_data, weather, now):
+    """
+    日時・天気・センサー情報を透明なRGBAレイヤーに描画して返す
+    (カメラ映像とは独立しているので、表示内容が変わった時だけ描き直せばよい)
+    
+    Args:
+        width (int), height (int): レイヤーのサイズ (カメラ映像と同じ)
+        fonts (dict): load_overlay_fonts() が返したフォント
+        s_data (dict): 表示するセンサーデータ (state_store の latest_sensor_data)
+        weather (dict): 表示する天気情報 (weather_data のスナップショット)
+        now (datetime): 表示する日時
+    Returns:
+        PIL.Image.Image: RGBAモードのオーバーレイ画像
+    """
     # 色の設定
     COLOR_BG_INDOOR = (255, 165, 0) # 室内 (オレンジ)
     COLOR_BG_OUTDOOR = (30, 144, 255) # 窓際 (ブルー)
@@ -1507,118 +4689,394 @@ def generate_frames():
     COLOR_BLACK_OUTLINE = (0, 0, 0) # 枠線
     STROKE_WIDTH = 2 # 枠線の太さ
 
-    while True:
-        # --- 1. カメラフレームの取得 ---
-        if camera is None or not camera.isOpened():
-            # カメラが初期化失敗した場合、エラー画像を生成
-            frame = np.zeros((720, 1280, 3), dtype=np.uint8)
-            cv2.putText(frame, "Camera not found.", (400, 360), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-        else:
-            # カメラから1フレーム読み取り
-            success, frame = camera.read()
-            if not success:
-                continue # 読み取り失敗時はスキップ
-
-        # --- 2. 描画準備 ---
-        # 最新のセンサーデータを取得
-        s_data = latest_sensor_data
+    # --- 1. 描画準備 ---
+    # 完全に透明なキャンバスを用意
+    pil_img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(pil_img)
+
+    # --- 2. 描画ヘルパー関数 (枠線付きテキスト) ---
+    def draw_text_with_outline(xy, text, font, fill_color, draw_outline=True, **kwargs):
+        """指定された座標にテキストを描画する。draw_outline=Trueの場合に黒枠も描画"""
+        if draw_outline:
+            # 先に黒枠を描画
+            draw.text(xy, text, font=font, fill=COLOR_BLACK_OUTLINE, stroke_width=STROKE_WIDTH, **kwargs)
+        # 上からメインの色のテキストを描画
+        draw.text(xy, text, font=font, fill=fill_color, **kwargs)
+
+    # --- 3. 各種情報の描画 ---
+    # 3-1. 日時
+    dow = ['月', '火', '水', '木', '金', '土', '日'][now.weekday()]
+    time_str = now.strftime(f"%m/%d({dow}) %H:%M")
+    draw_text_with_outline((20, 10), time_str, font=fonts['time'], fill_color=COLOR_WHITE)
+
+    # 3-2. 天気情報
+    weather_start_x = 20
+    weather_start_y = 80
+    # 天気テキスト (例: "曇り")
+    weather_text_str = weather['text']
+    draw_text_with_outline((weather_start_x + 10, weather_start_y), weather_text_str, font=fonts['weather_text'], fill_color=COLOR_WHITE)
+    
+    # 天気テキストの幅に合わせて気温の開始位置を調整
+    weather_text_width = draw.textlength(weather_text_str, font=fonts['weather_text'])
+    temp_start_x = weather_start_x + 10 + weather_text_width + 15
+    
+    # 最高気温
+    max_temp_str = weather['high']
+    max_temp_width = draw.textlength(max_temp_str, font=fonts['weather_temp_max'])
+    draw_text_with_outline((temp_start_x, weather_start_y), max_temp_str, font=fonts['weather_temp_max'], fill_color=COLOR_ORANGE_TEMP)
+    
+    # スラッシュ
+    slash_x = temp_start_x + max_temp_width + 5
+    draw_text_with_outline((slash_x, weather_start_y), "/", font=fonts['weather_slash'], fill_color=COLOR_WHITE)
+    
+    # 最低気温
+    min_temp_str = weather['low']
+    slash_width = draw.textlength("/", font=fonts['weather_slash'])
+    draw_text_with_outline((slash_x + slash_width + 5, weather_start_y), min_temp_str, font=fonts['weather_temp_min'], fill_color=COLOR_AQUA_TEMP)
+
+    # 3-3. センサー情報 (背景とラベル)
+    indoor_bg_y_offset = 145
+    indoor_rect = [20, indoor_bg_y_offset, 100, indoor_bg_y_offset + 215]
+    draw.rectangle(indoor_rect, fill=COLOR_BG_INDOOR)
+    # 「室内」ラベル (縦書き・中央揃え)
+    indoor_text = "室\n\n内"
+    rect_center_x = (indoor_rect[0] + indoor_rect[2]) / 2
+    rect_center_y = (indoor_rect[1] + indoor_rect[3]) / 2
+    draw_text_with_outline((rect_center_x, rect_center_y), indoor_text, font=fonts['v_label'], fill_color=COLOR_WHITE, anchor="mm", align="center", draw_outline=False)
+
+    outdoor_bg_y_offset = indoor_bg_y_offset + 215 + 25
+    outdoor_rect = [20, outdoor_bg_y_offset, 100, outdoor_bg_y_offset + 290]
+    draw.rectangle(outdoor_rect, fill=COLOR_BG_OUTDOOR)
+    # 「窓際」ラベル
+    outdoor_text = "窓\n\n際"
+    rect_center_x = (outdoor_rect[0] + outdoor_rect[2]) / 2
+    rect_center_y = (outdoor_rect[1] + outdoor_rect[3]) / 2
+    draw_text_with_outline((rect_center_x, rect_center_y), outdoor_text, font=fonts['v_label'], fill_color=COLOR_WHITE, anchor="mm", align="center", draw_outline=False)
+
+    # 3-4. センサーデータ描画ヘルパー
+    def draw_sensor_data(x, y_bottom, label, value, unit, digits=1):
+        """ Y座標を下揃え基準線としてセンサーテキストを描画 """
+        draw_text_with_outline((x, y_bottom), label, font=fonts['main_label'], fill_color=COLOR_WHITE, anchor="lb")
+        val_str = f"{value:.{digits}f}" if isinstance(value, (int, float)) else "--"
+        draw_text_with_outline((x + 100, y_bottom), val_str, font=fonts['main_value'], fill_color=COLOR_GREEN, anchor="lb")
+        val_width = draw.textlength(val_str, font=fonts['main_value'])
+        draw_text_with_outline((x + 100 + val_width + 5, y_bottom), unit, font=fonts['main_unit'], fill_color=COLOR_WHITE, anchor="lb")
+
+    # 3-5. 各センサーデータを描画
+    # 室内
+    draw_sensor_data(120, indoor_bg_y_offset + 65, "温度", s_data.get('hub_temp'), "℃")
+    draw_sensor_data(120, indoor_bg_y_offset + 140, "湿度", s_data.get('hub_hum'), "%", digits=0)
+    draw_sensor_data(120, indoor_bg_y_offset + 215, "照度", s_data.get('hub_lux'), "レベル", digits=0)
+    # 窓際
+    draw_sensor_data(120, outdoor_bg_y_offset + 65, "温度", s_data.get('local_temp'), "℃")
+    draw_sensor_data(120, outdoor_bg_y_offset + 140, "湿度", s_data.get('local_hum'), "%")
+    draw_sensor_data(120, outdoor_bg_y_offset + 215, "照度", s_data.get('local_lux'), "Lux")
+    draw_sensor_data(120, outdoor_bg_y_offset + 290, "気圧", s_data.get('local_pres'), "hPa", digits=0)
+
+    return pil_img
+
+class OverlayCache:
+    """
+    描画済みのオーバーレイレイヤーを保持し、NumPyでフレームに合成するクラス
+    
+    レイヤーは「センサーデータ」「天気情報」「表示中の分 (HH:MM)」のいずれかが
+    変わった時だけPillowで描き直す。それ以外のフレームでは、事前計算した
+    乗算済みカラーと逆アルファを使った整数演算のアルファ合成だけを行う。
+    """
+
+    # オーバーレイに表示するセンサーデータのキー
+    SENSOR_KEYS = ('hub_temp', 'hub_hum', 'hub_lux', 'local_temp', 'local_hum', 'local_lux', 'local_pres')
+
+    def __init__(self):
+        self._fonts = None      # 初回の描画時に読み込む
+        self._key = None        # 現在のレイヤーを描いた時の表示内容
+        self._layer = None      # (y0, y1, x0, x1, 乗算済みBGR, 逆アルファ)
+        self._shape = None      # レイヤーを作成したフレームサイズ
+
+    def _make_key(self, now):
+        """表示内容を比較用のタプルにまとめる"""
+        s_data = state_store.get('latest_sensor_data')
+        weather = weather_data
+        return (
+            tuple(s_data.get(k) for k in self.SENSOR_KEYS),
+            (weather.get('text'), weather.get('high'), weather.get('low')),
+            now.strftime('%Y%m%d%H%M'),
+        )
+
+    def _rebuild(self, width, height, now):
+        """レイヤーをPillowで描き直し、合成用の配列を事前計算する"""
+        if self._fonts is None:
+            self._fonts = load_overlay_fonts()
+        pil_img = render_overlay_layer(width, height, self._fonts,
+                                       dict(state_store.get('latest_sensor_data')), dict(weather_data), now)
+        rgba = np.asarray(pil_img)
+        alpha = rgba[:, :, 3]
+
+        # 何か描かれている範囲 (アルファ > 0) だけに合成対象を絞る
+        ys, xs = np.nonzero(alpha)
+        if len(ys) == 0:
+            self._layer = None
+            return
+        y0, y1 = ys.min(), ys.max() + 1
+        x0, x1 = xs.min(), xs.max() + 1
+
+        # RGB -> BGR に並べ替え、アルファを掛けた値 (uint16) を事前計算しておく
+        a = alpha[y0:y1, x0:x1, None].astype(np.uint16)
+        bgr = rgba[y0:y1, x0:x1, 2::-1].astype(np.uint16)
+        premultiplied = bgr * a + 127 # +127 は //255 の四捨五入用
+        inverse_alpha = 255 - a
+        self._layer = (y0, y1, x0, x1, premultiplied, inverse_alpha)
+
+    def apply(self, frame):
+        """
+        フレーム (BGR) にオーバーレイを直接合成する (必要ならレイヤーを更新)
         
-        # OpenCV (BGR) から Pillow (RGB) 形式に変換
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        pil_img = Image.fromarray(frame_rgb)
-        draw = ImageDraw.Draw(pil_img)
-
-        # --- 3. 描画ヘルパー関数 (枠線付きテキスト) ---
-        def draw_text_with_outline(xy, text, font, fill_color, draw_outline=True, **kwargs):
-            """指定された座標にテキストを描画する。draw_outline=Trueの場合に黒枠も描画"""
-            if draw_outline:
-                # 先に黒枠を描画
-                draw.text(xy, text, font=font, fill=COLOR_BLACK_OUTLINE, stroke_width=STROKE_WIDTH, **kwargs)
-            # 上からメインの色のテキストを描画
-            draw.text(xy, text, font=font, fill=fill_color, **kwargs)
-
-        # --- 4. 各種情報の描画 ---
-        # 4-1. 日時
+        Args:
+            frame (numpy.ndarray): OpenCV (BGR) 形式のフレーム (上書きされる)
+        Returns:
+            numpy.ndarray: 合成済みのフレーム (引数と同じ配列)
+        """
         now = datetime.now()
-        dow = ['月', '火', '水', '木', '金', '土', '日'][now.weekday()]
-        time_str = now.strftime(f"%m/%d({dow}) %H:%M")
-        draw_text_with_outline((20, 10), time_str, font=font_time, fill_color=COLOR_WHITE)
+        key = self._make_key(now)
+        height, width = frame.shape[:2]
+        if key != self._key or self._shape != (height, width):
+            self._rebuild(width, height, now)
+            self._key = key
+            self._shape = (height, width)
+
+        if self._layer is None:
+            return frame
+        y0, y1, x0, x1, premultiplied, inverse_alpha = self._layer
+        roi = frame[y0:y1, x0:x1]
+        # out = (overlay * a + frame * (255 - a)) / 255 を整数演算で行う (最大65152でuint16に収まる)
+        blended = roi.astype(np.uint16)
+        blended *= inverse_alpha
+        blended += premultiplied
+        blended //= 255
+        roi[...] = blended
+        return frame
+
+camera_missing_frame = None # カメラがない場合に配信するエラー画像 (最初に使うときに1回だけ作る)
+
+def camera_available():
+    return camera is not None and camera.isOpened()
+
+def capture_camera_frame():
+    """
+    カメラから1フレームを取得する
+    
+    Returns:
+        numpy.ndarray or None: BGRフレーム (読み取り失敗時はNone)
+    """
+    global camera_missing_frame
+    if not camera_available():
+        # カメラが初期化失敗した場合、エラー画像を返す (オーバーレイで書き換えられるのでコピーを渡す)
+        if camera_missing_frame is None:
+            frame = np.zeros((VIDEO_FRAME_HEIGHT, VIDEO_FRAME_WIDTH, 3), dtype=np.uint8)
+            cv2.putText(frame, "Camera not found.", (400, 360), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+            camera_missing_frame = frame
+        return camera_missing_frame.copy()
+    # カメラから1フレーム読み取り
+    success, frame = camera.read()
+    return frame if success else None
 
-        # 4-2. 天気情報
-        weather_start_x = 20
-        weather_start_y = 80
-        # 天気テキスト (例: "曇り")
-        weather_text_str = weather_data['text']
-        draw_text_with_outline((weather_start_x + 10, weather_start_y), weather_text_str, font=font_weather_text, fill_color=COLOR_WHITE)
-        
-        # 天気テキストの幅に合わせて気温の開始位置を調整
-        weather_text_width = draw.textlength(weather_text_str, font=font_weather_text)
-        temp_start_x = weather_start_x + 10 + weather_text_width + 15
-        
-        # 最高気温
-        max_temp_str = weather_data['high']
-        max_temp_width = draw.textlength(max_temp_str, font=font_weather_temp_max)
-        draw_text_with_outline((temp_start_x, weather_start_y), max_temp_str, font=font_weather_temp_max, fill_color=COLOR_ORANGE_TEMP)
+def encode_jpeg(frame, width, quality):
+    """
+    フレームを指定した横幅・品質でJPEGにエンコードする
+    
+    Args:
+        frame (numpy.ndarray): BGRフレーム
+        width (int): 出力する横幅 (元より小さい場合のみ縮小。縦横比は維持)
+        quality (int): JPEG品質 (1-100)
+    Returns:
+        bytes or None: JPEGバイト列 (エンコード失敗時はNone)
+    """
+    height, frame_width = frame.shape[:2]
+    if width < frame_width:
+        new_height = max(1, round(height * width / frame_width))
+        # 縮小にはモアレの出にくい INTER_AREA を使う
+        frame = cv2.resize(frame, (width, new_height), interpolation=cv2.INTER_AREA)
+    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes() if ret else None
+
+class FrameBroadcaster:
+    """
+    カメラ映像の取得・オーバーレイ合成を1本の生成スレッドに集約し、
+    任意の数の視聴クライアントに配るクラス
+    
+    バッファは「最新の1フレーム」だけを保持する。受信側は自分が最後に受け取った
+    連番より新しいフレームを待つだけなので、遅いクライアントは途中のフレームを
+    読み飛ばし、他のクライアントや生成スレッドを遅らせることはない。
+    JPEGエンコードは (横幅, 品質) の組み合わせごとに1フレームにつき1回だけ行い、
+    同じ設定で視聴しているクライアント同士で結果を共有する。
+    """
+
+    def __init__(self, idle_stop_seconds=VIDEO_IDLE_STOP_SECONDS):
+        self._cond = threading.Condition()
+        self._latest_frame = None   # 最新の合成済みフレーム (BGR)
+        self._latest_seq = 0        # 最新フレームの連番
+        self._encoded = {}          # (横幅, 品質) -> (連番, JPEGバイト列)
+        self._encode_locks = {}     # (横幅, 品質) -> エンコード用ロック
+        self._subscribers = 0       # 現在の視聴クライアント数
+        self._last_unsubscribe = 0  # 最後に視聴者が離脱した時刻
+        self._thread = None         # 生成スレッド
+        self._idle_stop_seconds = idle_stop_seconds
+
+    @property
+    def subscriber_count(self):
+        """現在の視聴クライアント数"""
+        with self._cond:
+            return self._subscribers
+
+    def try_subscribe(self, max_streams=None):
+        """
+        視聴クライアントを登録し、必要なら生成スレッドを起動する
         
-        # スラッシュ
-        slash_x = temp_start_x + max_temp_width + 5
-        draw_text_with_outline((slash_x, weather_start_y), "/", font=font_weather_slash, fill_color=COLOR_WHITE)
+        Args:
+            max_streams (int, optional): 同時視聴数の上限 (Noneなら無制限)
+        Returns:
+            bool: 登録できたらTrue、上限に達していればFalse
+        """
+        with self._cond:
+            if max_streams is not None and self._subscribers >= max_streams:
+                return False
+            self._subscribers += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._producer_loop, daemon=True)
+                self._thread.start()
+            return True
+
+    def unsubscribe(self):
+        """視聴クライアントの登録を解除する"""
+        with self._cond:
+            self._subscribers = max(0, self._subscribers - 1)
+            self._last_unsubscribe = time.time()
+
+    def wait_for_jpeg(self, last_seq, width, quality, timeout=5.0):
+        """
+        last_seq より新しいフレームが公開されるまで待ち、指定の設定でエンコードして返す
         
-        # 最低気温
-        min_temp_str = weather_data['low']
-        slash_width = draw.textlength("/", font=font_weather_slash)
-        draw_text_with_outline((slash_x + slash_width + 5, weather_start_y), min_temp_str, font=font_weather_temp_min, fill_color=COLOR_AQUA_TEMP)
-
-        # 4-3. センサー情報 (背景とラベル)
-        indoor_bg_y_offset = 145
-        indoor_rect = [20, indoor_bg_y_offset, 100, indoor_bg_y_offset + 215]
-        draw.rectangle(indoor_rect, fill=COLOR_BG_INDOOR)
-        # 「室内」ラベル (縦書き・中央揃え)
-        indoor_text = "室\n\n内"
-        rect_center_x = (indoor_rect[0] + indoor_rect[2]) / 2
-        rect_center_y = (indoor_rect[1] + indoor_rect[3]) / 2
-        draw_text_with_outline((rect_center_x, rect_center_y), indoor_text, font=font_v_label, fill_color=COLOR_WHITE, anchor="mm", align="center", draw_outline=False)
-
-        outdoor_bg_y_offset = indoor_bg_y_offset + 215 + 25
-        outdoor_rect = [20, outdoor_bg_y_offset, 100, outdoor_bg_y_offset + 290]
-        draw.rectangle(outdoor_rect, fill=COLOR_BG_OUTDOOR)
-        # 「窓際」ラベル
-        outdoor_text = "窓\n\n際"
-        rect_center_x = (outdoor_rect[0] + outdoor_rect[2]) / 2
-        rect_center_y = (outdoor_rect[1] + outdoor_rect[3]) / 2
-        draw_text_with_outline((rect_center_x, rect_center_y), outdoor_text, font=font_v_label, fill_color=COLOR_WHITE, anchor="mm", align="center", draw_outline=False)
-
-        # 4-4. センサーデータ描画ヘルパー
-        def draw_sensor_data(x, y_bottom, label, value, unit, digits=1):
-            """ Y座標を下揃え基準線としてセンサーテキストを描画 """
-            draw_text_with_outline((x, y_bottom), label, font=font_main_label, fill_color=COLOR_WHITE, anchor="lb")
-            val_str = f"{value:.{digits}f}" if isinstance(value, (int, float)) else "--"
-            draw_text_with_outline((x + 100, y_bottom), val_str, font=font_main_value, fill_color=COLOR_GREEN, anchor="lb")
-            val_width = draw.textlength(val_str, font=font_main_value)
-            draw_text_with_outline((x + 100 + val_width + 5, y_bottom), unit, font=font_main_unit, fill_color=COLOR_WHITE, anchor="lb")
-
-        # 4-5. 各センサーデータを描画
-        # 室内
-        draw_sensor_data(120, indoor_bg_y_offset + 65, "温度", s_data.get('hub_temp'), "℃")
-        draw_sensor_data(120, indoor_bg_y_offset + 140, "湿度", s_data.get('hub_hum'), "%", digits=0)
-        draw_sensor_data(120, indoor_bg_y_offset + 215, "照度", s_data.get('hub_lux'), "レベル", digits=0)
-        # 窓際
-        draw_sensor_data(120, outdoor_bg_y_offset + 65, "温度", s_data.get('local_temp'), "℃")
-        draw_sensor_data(120, outdoor_bg_y_offset + 140, "湿度", s_data.get('local_hum'), "%")
-        draw_sensor_data(120, outdoor_bg_y_offset + 215, "照度", s_data.get('local_lux'), "Lux")
-        draw_sensor_data(120, outdoor_bg_y_offset + 290, "気圧", s_data.get('local_pres'), "hPa", digits=0)
-
-        # --- 5. JPEGにエンコード ---
-        # Pillow (RGB) から OpenCV (BGR) 形式に戻す
-        frame = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-
-        # メモリ上でJPEG形式 (品質90) にエンコード
-        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
-        if not ret:
-            continue
-
-        # --- 6. Motion JPEG 形式で yield ---
-        frame_bytes = buffer.tobytes()
+        Returns:
+            (int, bytes) or (int, None): (フレーム連番, JPEGバイト列)。タイムアウト時はNone
+        """
+        variant = (width, quality)
+        with self._cond:
+            self._cond.wait_for(lambda: self._latest_seq > last_seq, timeout=timeout)
+            if self._latest_seq <= last_seq:
+                return last_seq, None
+            seq, frame = self._latest_seq, self._latest_frame
+            lock = self._encode_locks.setdefault(variant, threading.Lock())
+
+        # 同じ設定・同じフレームのエンコードは、最初の1クライアントだけが行う
+        with lock:
+            cached = self._encoded.get(variant)
+            if cached and cached[0] >= seq:
+                return cached
+            jpeg_bytes = encode_jpeg(frame, width, quality)
+            if jpeg_bytes is None:
+                return last_seq, None
+            self._encoded[variant] = (seq, jpeg_bytes)
+            return seq, jpeg_bytes
+
+    def _publish(self, frame):
+        """合成済みフレームを最新フレームとして公開し、待機中の受信側を起こす"""
+        with self._cond:
+            self._latest_frame = frame
+            self._latest_seq += 1
+            self._cond.notify_all()
+
+    def _should_stop(self):
+        """視聴者がいない状態が一定時間続いたら生成スレッドを止める"""
+        with self._cond:
+            if self._subscribers > 0:
+                return False
+            if time.time() - self._last_unsubscribe < self._idle_stop_seconds:
+                return False
+            self._thread = None
+            self._encoded.clear()
+            self._encode_locks.clear()
+            return True
+
+    def _producer_loop(self):
+        """カメラ読み取り → オーバーレイ合成を1回だけ行い、全視聴者に配る"""
+        print("[Video] Frame producer started.")
+        overlay = OverlayCache()
+        while not self._should_stop():
+            # --- 1. カメラフレームの取得 ---
+            frame = capture_camera_frame()
+            if frame is None:
+                time.sleep(0.01) # 読み取り失敗時は少し待って再試行
+                continue
+
+            # --- 2. オーバーレイの合成 (レイヤーは表示内容が変わった時だけ再描画) ---
+            frame = overlay.apply(frame)
+
+            # --- 3. 全視聴者に公開 (エンコードは視聴設定ごとに受信側で1回だけ) ---
+            self._publish(frame)
+
+            # カメラがない場合はエラー画像がすぐに返るので、カメラの代わりに間隔をあける (CPUを使い切らないように)
+            if not camera_available():
+                time.sleep(1 / VIDEO_DEFAULT_FPS)
+        print("[Video] Frame producer stopped (no viewers).")
+
+frame_broadcaster = FrameBroadcaster() # 映像配信の共有インスタンス
+
+def parse_stream_params(args):
+    """
+    /video_feed のクエリパラメータ (fps, width, quality) を読み取り、許容範囲に丸める
+    
+    Args:
+        args (MultiDict): request.args
+    Returns:
+        (float, int, int): (フレームレート, 横幅, JPEG品質)
+    """
+    fps = args.get('fps', VIDEO_DEFAULT_FPS, type=float)
+    width = args.get('width', VIDEO_FRAME_WIDTH, type=int)
+    quality = args.get('quality', VIDEO_JPEG_QUALITY, type=int)
+
+    # nan / inf は比較で丸められないため (配信間隔が壊れる)、既定値に戻してから丸める
+    if not math.isfinite(fps):
+        fps = VIDEO_DEFAULT_FPS
+    if not math.isfinite(width):
+        width = VIDEO_FRAME_WIDTH
+    if not math.isfinite(quality):
+        quality = VIDEO_JPEG_QUALITY
+
+    fps = min(max(fps, VIDEO_MIN_FPS), VIDEO_MAX_FPS)
+    # 横幅は16の倍数に揃え、エンコード結果を共有できる組み合わせを増やす
+    width = min(max(width, VIDEO_MIN_WIDTH), VIDEO_FRAME_WIDTH) // 16 * 16
+    quality = min(max(quality, 10), 95)
+    return fps, width, quality
+
+def generate_frames(fps=None, width=VIDEO_FRAME_WIDTH, quality=VIDEO_JPEG_QUALITY):
+    """
+    共有の生成スレッドからフレームを受け取り、指定のフレームレートで
+    Motion JPEG形式でyield (生成) する (視聴クライアントごとに1つ)
+    ※ 呼び出し側で frame_broadcaster.try_subscribe() 済みであること
+    
+    Args:
+        fps (float, optional): 送出フレームレート (Noneなら VIDEO_DEFAULT_FPS)
+        width (int, optional): 出力する横幅
+        quality (int, optional): JPEG品質
+    """
+    interval = 1.0 / (fps or VIDEO_DEFAULT_FPS)
+    next_due = time.monotonic()
+    last_seq = 0
+    while True:
+        # 次の送出時刻まで待つ (単調増加クロックで計測)
+        delay = next_due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        seq, frame_bytes = frame_broadcaster.wait_for_jpeg(last_seq, width, quality)
+        if frame_bytes is None:
+            continue # タイムアウト時は待ち直す
+        last_seq = seq
+
+        # 遅れた分をまとめて取り戻そうとしない (送出が詰まった後のバースト防止)
+        next_due = max(next_due + interval, time.monotonic())
+
+        # --- Motion JPEG 形式で yield ---
         yield (b'--frame\r\n' # フレームの境界
                b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
 
@@ -1626,63 +5084,148 @@ def generate_frames():
 @app.route('/monitor')
 def monitor_page():
     """ リアルタイムモニターページ (monitor.html) を表示 """
+    # /monitor?fps=5&width=640 のように指定されたら、映像ストリームにもそのまま渡す
+    stream_url = url_for('video_feed', **request.args.to_dict())
     # templates/monitor.html をレンダリングして返す
-    return render_template('monitor.html')
+    return render_template('monitor.html', stream_url=stream_url)
 # --- ▲▲▲ 追加完了 ▲▲▲ ---
 
 @app.route('/video_feed')
 def video_feed():
-    """ 映像ストリーミング (/monitor で使われる) を配信するためのエンドポイント """
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    """
+    映像ストリーミング (/monitor で使われる) を配信するためのエンドポイント
+    クエリパラメータ: fps (送出フレームレート), width (横幅px), quality (JPEG品質)
+    """
+    fps, width, quality = parse_stream_params(request.args)
+
+    # 同時視聴数の上限に達していたら、カメラに触れずにすぐ断る
+    if not frame_broadcaster.try_subscribe(VIDEO_MAX_STREAMS):
+        return Response("Too many video streams.", status=503,
+                        headers={'Retry-After': '10'}, mimetype='text/plain')
+
+    response = Response(generate_frames(fps, width, quality),
+                        mimetype='multipart/x-mixed-replace; boundary=frame')
+    # クライアント切断時 (ストリーム開始前の切断も含む) に必ず登録を解除する
+    response.call_on_close(frame_broadcaster.unsubscribe)
+    return response
 
 
 # ==============================================================================
 # 15. プログラム実行 (メイン)
 # ==============================================================================
 if __name__ == '__main__':
+    # --- コマンドライン引数 (センサーログのインポート・エクスポート用) ---
+    parser = argparse.ArgumentParser(description="スマートホーム管理サーバー")
+    parser.add_argument('--import-sensor-csv', metavar='CSV',
+                        help="センサーログCSVを時系列ストアに取り込んで終了する")
+    parser.add_argument('--export-sensor-csv', metavar='CSV',
+                        help="時系列ストアの内容をCSVに書き出して終了する")
+    parser.add_argument('--train-local-model', action='store_true',
+                        help="時系列ストアのデータでローカルモデルを学習して終了する")
+    parser.add_argument('--local-model-report', action='store_true',
+                        help="ローカルモデルの推論速度・メモリとPCのAIサーバーとの一致率を表示して終了する")
+    parser.add_argument('--production', action='store_true',
+                        help="本番モード: Webの処理を複数のワーカープロセスで行い、状態を共有メモリで渡す")
+    parser.add_argument('--workers', type=int, default=WEB_WORKERS,
+                        help=f"本番モードのワーカープロセス数 (既定: {WEB_WORKERS})")
+    parser.add_argument('--port', type=int, default=WEB_PORT,
+                        help=f"Web UI・APIの待ち受けポート (既定: {WEB_PORT})")
+    # 本番モードで、ハードウェアプロセスがワーカーを起動するときに使う (手動では使わない)
+    parser.add_argument('--web-worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--listen-fd', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    WEB_PORT = web_worker_pool.port = args.port
+    if args.web_worker:
+        run_web_worker(args.listen_fd)
+        sys.exit(0)
+    if args.import_sensor_csv:
+        print(f"Imported {sensor_store.import_csv(args.import_sensor_csv)} records into '{SENSOR_STORE_DIR}'.")
+        sys.exit(0)
+    if args.export_sensor_csv:
+        print(f"Exported {sensor_store.export_csv(args.export_sensor_csv)} records to '{args.export_sensor_csv}'.")
+        sys.exit(0)
+    if args.train_local_model:
+        train_local_model()
+        sys.exit(0)
+    if args.local_model_report:
+        print(json.dumps(local_model_report(), ensure_ascii=False, indent=2))
+        sys.exit(0)
+
     try:
+        startup_timer.mark('module import')
         log_action('System', 'システム', '起動')
+        if HARDWARE_BACKEND == 'sim':
+            # SwitchBot・Tuya Cloud・PCのAIサーバーの代替を起動する (初期化の前に)
+            sim_backend.start_services()
+            print("[Main] Running with the simulated hardware backend (SMARTHOME_BACKEND=sim).")
 
-        # --- カメラの初期化 ---
-        print("[Init] Initializing Camera...")
-        camera = cv2.VideoCapture(0) # デバイス0番のカメラを開く
-        if not camera.isOpened():
-            print("[CRITICAL] Failed to open camera.") # 開けなかった場合
-        else:
-            # カメラの解像度を16:9 (1280x720) に設定
-            camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-            camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-            print("[Init] Camera initialized successfully (1280x720).")
-        
         # --- 各種初期化の実行 ---
-        if init_i2c() and init_gpio() and init_tuya_api():
-            # I2C, GPIO, Tuya APIすべて成功したらセンサーをセットアップ
-            setup_bme280()
+        # キーパッドをすぐ使えるように、GPIOを最初に初期化してキー入力の受付を始める
+        with startup_timer.phase('gpio'):
+            gpio_ok = init_gpio()
+        if gpio_ok:
+            # キーパッド (エッジ検出でキー入力を検知し、処理スレッドに渡す)
+            keypad_driver.start()
+            threading.Thread(target=keypad_dispatch_loop, daemon=True).start()
+            startup_timer.mark('keypad ready')
+        # Tuya Cloud への接続は時間がかかるので、接続できるまでバックグラウンドで再試行する
+        threading.Thread(target=tuya_connect_loop, daemon=True).start()
+        # AI自動制御の案内音声を前もって用意する (キャッシュにあれば何もしない)
+        threading.Thread(target=tts_cache.prewarm, args=(TTS_PREWARM_PHRASES,), daemon=True).start()
+
+        # 互いに関係のない初期化を並行して行う (I2C・LCD / カメラ / 時系列ストア)
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix='init') as init_pool:
+            i2c_future = init_pool.submit(startup_timer.timed('i2c + lcd', init_i2c))
+            init_pool.submit(startup_timer.timed('camera', init_camera))
+            store_future = init_pool.submit(startup_timer.timed('sensor store', init_sensor_store))
+            i2c_ok = i2c_future.result()
+            if i2c_ok:
+                # I2Cの初期化が終わったらセンサーをセットアップ
+                with startup_timer.phase('bme280'):
+                    setup_bme280()
+            store_future.result()
+
+        if gpio_ok and i2c_ok:
+            # ローカルモデル (PCのAIサーバーの代替) を読み込む。なければ学習する (時間がかかるので別スレッド)
+            threading.Thread(target=init_local_model, daemon=True).start()
             
             # 天気情報の定期更新スレッドを開始
             threading.Thread(target=periodic_weather_updater, daemon=True).start()
 
             # --- 各種バックグラウンドスレッドを開始 ---
-            # メインのバックグラウンドタスク（キーパッド監視、LCD更新、ログ記録）
+            # メインのバックグラウンドタスク（LCD更新）
             threading.Thread(target=background_tasks_loop, daemon=True).start()
+            # センサー取得（I2Cサンプリング、ハブ取得、ログ記録、学習データ送信）
+            threading.Thread(target=sensor_pipeline_loop, daemon=True).start()
             # AI自動制御ループ
             threading.Thread(target=auto_control_loop, daemon=True).start()
             # AIサーバー接続確認ループ
             threading.Thread(target=check_ai_connection_loop, daemon=True).start()
-            # プロジェクター状態確認ループ
+            # 状態の変化に応じてLED・LCDを更新する
+            state_store.subscribe(update_led_status, keys={'logging_paused'})
+            state_store.subscribe(update_auto_mode_led, keys={'auto_mode', 'ai_connected'})
+            state_store.subscribe(lambda snapshot, changed: lcd_refresh_event.set(),
+                                  keys={'curtain', 'projector_status'})
+            # プロジェクター状態の監視 (cec-client を常駐させ、落ちたら起動し直す)
             threading.Thread(target=projector_status_loop, daemon=True).start()
 
             # LEDの初期状態を更新
             update_auto_mode_led()
+            startup_timer.mark('ready')
+            startup_timer.report()
             
             # --- Flask Webサーバーを起動 ---
-            print("[Main] Starting Flask web server on http://0.0.0.0:5000")
-            app.run(host='0.0.0.0', port=5000)
+            if args.production:
+                run_production_server(max(args.workers, 1))
+            else:
+                print(f"[Main] Starting Flask web server on http://0.0.0.0:{WEB_PORT}")
+                app.run(host='0.0.0.0', port=WEB_PORT)
             
         else:
             # 初期化に失敗した場合
             print("\n[CRITICAL] System initialization failed.")
             if lcd: lcd.write_string("System Init FAIL")
+            startup_timer.report()
             
     except KeyboardInterrupt:
         # Ctrl+C で終了した場合
@@ -1694,6 +5237,13 @@ if __name__ == '__main__':
     finally:
         # --- 終了処理 ---
         log_action('System', 'システム', '終了')
+        # 操作ログの書き込みキューを最後まで書き出す
+        action_log_writer.close()
+        # 常駐させたcec-clientを終了
+        cec_monitor.stop()
+        # 本番モードのワーカープロセスを終了し、共有メモリ領域を削除
+        web_worker_pool.stop()
+        shared_state_segment.close()
         
         # カメラリソースを解放
         if camera and camera.isOpened():
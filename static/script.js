@@ -26,67 +26,145 @@ const statusMap = {
 let countdownSeconds = 0; // 残り秒数
 const timerElement = document.getElementById('ai-timer'); // 表示場所
 
+// 状態の受信方法 (イベントストリームが使えない間だけ /status をポーリングする)
+let eventSource = null;       // /events (Server-Sent Events) の接続
+let isStreaming = false;      // イベントストリームで受信中か
+let pollingTimer = null;      // ポーリング用タイマー
+let statusEtag = null;        // 前回受け取った /status の ETag (変化がなければ 304 が返る)
+const POLLING_INTERVAL_MS = 5000;
+
 // --- 2. 非同期通信・UI更新関数 ---
 
 /**
  * サーバーの /status エンドポイントにGETリクエストを送信し、
- * 最新のステータスを取得してUIの表示を更新する
+ * 最新のステータスを取得してUIの表示を更新する (イベントストリームが使えない場合)
  */
 async function updateStatus() {
     try {
-        // サーバーに状態を問い合わせ
-        const response = await fetch('/status');
+        // サーバーに状態を問い合わせ (前回から変化がなければ 304 で本文なし)
+        // ブラウザのキャッシュは使わない (古い time_remaining で表示が戻らないように)
+        const headers = statusEtag ? { 'If-None-Match': statusEtag } : {};
+        const response = await fetch('/status', { headers, cache: 'no-store' });
+        if (response.status === 304) return; // 変化なし (カウントダウンはそのまま続ける)
+        statusEtag = response.headers.get('ETag');
         const data = await response.json(); // 応答をJSONとしてパース
+        applyStatus(data);
+    } catch (e) {
+        // 通信失敗時
+        console.error("Status fetch failed:", e);
+    }
+}
+
+/**
+ * 状態をUIの表示に反映する
+ * イベントストリームからは変わった項目だけが届くので、含まれている項目だけを更新する
+ * @param {object} data - /status または /events の内容
+ */
+function applyStatus(data) {
+    // --- カーテン状態の更新 ---
+    if (!('curtain_position' in data)) {
+        // 変化なし
+    } else if (data.curtain_position === 'N/A') {
+        statusMap.curtainVal.textContent = '不明';
+        statusMap.curtainUnit.textContent = '';
+        statusMap.curtainVal.style.color = 'var(--text-primary)';
+    } else {
+        statusMap.curtainVal.textContent = data.curtain_position;
+        statusMap.curtainUnit.textContent = '%';
+        statusMap.curtainVal.style.color = 'var(--color-green)';
+    }
 
-        // --- カーテン状態の更新 ---
-        if (data.curtain_position === 'N/A') {
-            statusMap.curtainVal.textContent = '不明';
-            statusMap.curtainUnit.textContent = '';
-            statusMap.curtainVal.style.color = 'var(--text-primary)';
-        } else {
-            statusMap.curtainVal.textContent = data.curtain_position;
-            statusMap.curtainUnit.textContent = '%';
-            statusMap.curtainVal.style.color = 'var(--color-green)';
-        }
-
-        // --- プロジェクター状態の更新 ---
-        if (data.projector_status === 'Error' || data.projector_status === 'N/A') {
-            statusMap.proj.textContent = '取得中...';
-            statusMap.proj.style.color = 'var(--text-primary)';
-        } else if (data.projector_status === 'ON') {
-            statusMap.proj.textContent = 'ON';
-            statusMap.proj.style.color = 'var(--color-green)';
-        } else {
-            statusMap.proj.textContent = 'OFF';
-            statusMap.proj.style.color = 'var(--color-red)';
-        }
-        
-        // --- HDMI入力の更新 ---
+    // --- プロジェクター状態の更新 ---
+    if (!('projector_status' in data)) {
+        // 変化なし
+    } else if (data.projector_status === 'Error' || data.projector_status === 'N/A') {
+        statusMap.proj.textContent = '取得中...';
+        statusMap.proj.style.color = 'var(--text-primary)';
+    } else if (data.projector_status === 'ON') {
+        statusMap.proj.textContent = 'ON';
+        statusMap.proj.style.color = 'var(--color-green)';
+    } else {
+        statusMap.proj.textContent = 'OFF';
+        statusMap.proj.style.color = 'var(--color-red)';
+    }
+    
+    // --- HDMI入力の更新 ---
+    if ('hdmi_status' in data) {
         statusMap.hdmi.textContent = data.hdmi_status;
         statusMap.hdmi.style.color = 'var(--text-primary)';
-        
-        // --- データ記録状態の更新 ---
+    }
+    
+    // --- データ記録状態の更新 ---
+    if ('logging_paused' in data) {
         statusMap.log.textContent = data.logging_paused ? "OFF" : "ON";
         statusMap.log.style.color = data.logging_paused ? "var(--color-red)" : "var(--color-green)";
-        
-        // --- 制御モードの更新 ---
+    }
+    
+    // --- 制御モードの更新 ---
+    if ('auto_mode' in data) {
         statusMap.mode.textContent = data.auto_mode ? "自動(AI)" : "手動";
         statusMap.mode.style.color = data.auto_mode ? "var(--color-blue)" : "var(--color-orange)";
-        
-        // --- AIサーバー接続状態の更新 ---
+    }
+    
+    // --- AIサーバー接続状態の更新 ---
+    if ('ai_connection_status' in data) {
         statusMap.ai.textContent = data.ai_connection_status ? "接続" : "切断";
         statusMap.ai.style.color = data.ai_connection_status ? "var(--color-green)" : "var(--color-red)";
+    }
+
+    // カウントダウン変数の更新 (サーバーの時間に同期)
+    if (data.time_remaining !== undefined) {
+        countdownSeconds = data.time_remaining;
+        updateTimerDisplay(); // 即時反映
+    }
+}
 
-        // カウントダウン変数の更新 (サーバーの時間に同期)
-        if (data.time_remaining !== undefined) {
-            countdownSeconds = data.time_remaining;
-            updateTimerDisplay(); // 即時反映
-        }
+/**
+ * コマンド送信後の状態更新
+ * イベントストリームで受信中なら、変化はサーバーから届くので何もしない
+ * @param {number} delayMs - ポーリング時に、デバイスの動作反映を待つ時間
+ */
+function refreshAfterCommand(delayMs) {
+    if (isStreaming) return;
+    setTimeout(updateStatus, delayMs);
+}
 
-    } catch (e) {
-        // 通信失敗時
-        console.error("Status fetch failed:", e);
+/**
+ * /status の定期ポーリングを開始・停止する (イベントストリームが使えない間の代替)
+ */
+function startPolling() {
+    if (pollingTimer !== null) return;
+    updateStatus();
+    pollingTimer = setInterval(updateStatus, POLLING_INTERVAL_MS);
+}
+
+function stopPolling() {
+    if (pollingTimer === null) return;
+    clearInterval(pollingTimer);
+    pollingTimer = null;
+}
+
+/**
+ * /events (Server-Sent Events) に接続し、状態が変わったときだけ更新を受け取る
+ * 接続できない間は /status のポーリングに切り替える (再接続はブラウザが自動で行う)
+ */
+function startEventStream() {
+    if (!('EventSource' in window)) {
+        startPolling(); // 非対応のブラウザ
+        return;
     }
+    eventSource = new EventSource('/events');
+    eventSource.onopen = () => {
+        isStreaming = true;
+        stopPolling();
+    };
+    eventSource.onmessage = (event) => {
+        applyStatus(JSON.parse(event.data));
+    };
+    eventSource.onerror = () => {
+        isStreaming = false;
+        startPolling();
+    };
 }
 
 /**
@@ -100,7 +178,7 @@ async function sendCommand(sceneName) {
         console.error("Command failed:", e);
     } finally {
         // コマンド送信後、2秒待ってからステータスを更新 (デバイスの動作反映待ち)
-        setTimeout(updateStatus, 2000);
+        refreshAfterCommand(2000);
     }
 }
 
@@ -115,7 +193,7 @@ async function setMode(mode) {
         console.error("Mode set failed:", e);
     } finally {
         // モード切替は即時反映されるため、すぐにステータスを更新
-        updateStatus();
+        refreshAfterCommand(0);
     }
 }
 
@@ -130,7 +208,7 @@ async function sendProjectorCommand(action) {
         console.error("Projector command failed:", e);
     } finally {
         // 1秒待ってからステータス更新
-        setTimeout(updateStatus, 1000);
+        refreshAfterCommand(1000);
     }
 }
 
@@ -145,7 +223,7 @@ async function sendHdmiCommand(portName) {
         console.error("HDMI command failed:", err);
     } finally {
         // 1秒待ってからステータス更新
-        setTimeout(updateStatus, 1000);
+        refreshAfterCommand(1000);
     }
 }
 
@@ -160,7 +238,7 @@ async function setLogging(action) {
         console.error("Logging set failed:", e);
     } finally {
         // 即時反映
-        updateStatus();
+        refreshAfterCommand(0);
     }
 }
 
@@ -179,8 +257,8 @@ document.querySelectorAll('.scene-btn').forEach(button => {
 // ページ読み込み完了時に、初回のステータス更新を実行
 updateStatus();
 
-// 5秒ごと (5000ミリ秒) にステータス更新を繰り返す
-setInterval(updateStatus, 5000);
+// 状態の変化をイベントストリームで受け取る (使えない間は5秒ごとのポーリング)
+startEventStream();
 
 // 1秒ごとにカウントダウンを減らして表示を更新するタイマー
 setInterval(() => {